@@ -29,11 +29,17 @@ this_dir, this_filename = os.path.split(__file__)
               help='String to be used for extracting expression value (TPM, FPKM, etc).')
 @click.option('--expression_thresh', default=5.0, type=float,
               help='Threshold used to filter transcripts based on their expression values')
+@click.option('--packed_sequences', is_flag=True,
+              help="Read the sequences from a memory-mapped 2-bit packed copy of the fasta file, written next to it on the first run")
+@click.option('--find_orfs', is_flag=True,
+              help="Write the ORFs (start to stop codon) found in the frames of the sequences without CDS instead of the translation of the whole frames, with their position in the header")
+@click.option('--min_orf_length', type=int, help="Minimum number of amino acids of the ORFs written with --find_orfs (default 0)")
+@click.option('--workers', type=int, help="Number of processes translating the sequences (default 1)")
 @click.pass_context
 def dnaseq_to_proteindb(ctx, config_file, input_fasta, translation_table, num_orfs, num_orfs_complement,
                         output_proteindb, var_prefix,
                         skip_including_all_cds, include_biotypes, exclude_biotypes, biotype_str, expression_str,
-                        expression_thresh):
+                        expression_thresh, packed_sequences, find_orfs, min_orf_length, workers):
   if input_fasta is None:
     print_help()
 
@@ -47,6 +53,14 @@ def dnaseq_to_proteindb(ctx, config_file, input_fasta, translation_table, num_or
                         EnsemblDataService.NUM_ORFS_COMPLEMENT: num_orfs_complement,
                         EnsemblDataService.EXPRESSION_STR: expression_str,
                         EnsemblDataService.EXPRESSION_THRESH: expression_thresh}
+  if packed_sequences:
+    pipeline_arguments[EnsemblDataService.PACKED_SEQUENCES] = packed_sequences
+  if find_orfs:
+    pipeline_arguments[EnsemblDataService.FIND_ORFS] = find_orfs
+  if min_orf_length is not None:
+    pipeline_arguments[EnsemblDataService.MIN_ORF_LENGTH] = min_orf_length
+  if workers:
+    pipeline_arguments[EnsemblDataService.WORKERS] = workers
 
   ensembl_data_service = EnsemblDataService(config_file, pipeline_arguments)
   ensembl_data_service.dnaseq_to_proteindb(input_fasta)
@@ -18,12 +18,16 @@ this_dir, this_filename = os.path.split(__file__)
               help='If a stop codons is found, add a new protein with suffix (_Codon_{num})', is_flag=True)
 @click.option('-aa', '--num_aa', help='Minimun number of aminoacids for a protein to be included in the database',
               default=6)
+@click.option('--summary_file', help="Write the counts of the check (proteins without Met, with premature stop codons, with gaps, too short) to this json file")
+@click.option('--workers', type=int, help="Number of processes checking the proteins (default 1)")
 @click.pass_context
-def ensembl_check(ctx, config_file, input_fasta, output, add_stop_codons, num_aa):
+def ensembl_check(ctx, config_file, input_fasta, output, add_stop_codons, num_aa, summary_file, workers):
   if input_fasta is None:
     print_help()
 
   pipeline_arguments = {EnsemblDataService.PROTEIN_DB_OUTPUT: output}
+  if workers:
+    pipeline_arguments[EnsemblDataService.WORKERS] = workers
 
   ensembl_data_service = EnsemblDataService(config_file, pipeline_arguments)
-  ensembl_data_service.check_proteindb(input_fasta, add_stop_codons, num_aa)
+  ensembl_data_service.check_proteindb(input_fasta, add_stop_codons, num_aa, summary_file)
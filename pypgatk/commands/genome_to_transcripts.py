@@ -0,0 +1,34 @@
+import os
+
+import click
+
+from pypgatk.commands.utils import print_help
+from pypgatk.ensembl.ensembl import EnsemblDataService
+
+this_dir, this_filename = os.path.split(__file__)
+
+
+@click.command('genome-to-transcripts',
+               short_help="Generate the transcript sequences (with CDS positions) from the genome and the GTF file")
+@click.option('-c', '--config_file', help='Configuration to perform conversion between ENSEMBL Files',
+              default=this_dir + '/../config/ensembl_config.yaml')
+@click.option('-g', '--genome_fasta', help='Path to the genome fasta file')
+@click.option('--gene_annotations_gtf', help='Path to the gene annotations file')
+@click.option('-o', '--output_fasta', default='transcripts.fa',
+              help='Output fasta file, with the same header layout as the cDNA files used by vcf-to-proteindb and dnaseq-to-proteindb (default transcripts.fa)')
+@click.option('--workers', type=int, help="Number of processes, chromosomes are spliced in parallel (default 1)")
+@click.option('--cache_dir',
+              help="Folder where the index and packed copy of the genome are kept (default: next to the genome fasta file)")
+@click.pass_context
+def genome_to_transcripts(ctx, config_file, genome_fasta, gene_annotations_gtf, output_fasta, workers, cache_dir):
+  if genome_fasta is None or gene_annotations_gtf is None:
+    print_help()
+
+  pipeline_arguments = {}
+  if workers:
+    pipeline_arguments[EnsemblDataService.WORKERS] = workers
+  if cache_dir:
+    pipeline_arguments[EnsemblDataService.CACHE_DIR] = cache_dir
+
+  ensembl_data_service = EnsemblDataService(config_file, pipeline_arguments)
+  ensembl_data_service.genome_to_transcripts(genome_fasta, gene_annotations_gtf, output_fasta)
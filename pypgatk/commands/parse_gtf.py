@@ -4,6 +4,7 @@ import click
 
 from pypgatk.commands.utils import print_help
 from pypgatk.ensembl.ensembl import EnsemblDataService
+from pypgatk.ensembl.featuredb import benchmark_featuredb
 
 this_dir, this_filename = os.path.split(__file__)
 
@@ -12,8 +13,17 @@ this_dir, this_filename = os.path.split(__file__)
               default=this_dir + '/../config/ensembl_config.yaml')
 @click.option('-i', '--input_gtf', help='Path to the GTF file')
 @click.option('-o', '--output_db', help='Path to the output DB file')
+@click.option('--builder', type=click.Choice(['fast', 'gffutils']), default='fast',
+              help='Write the DB with the built-in bulk loader (fast) or with gffutils.create_db (gffutils), both DBs are the same (default fast)')
+@click.option('--benchmark', is_flag=True,
+              help='Build the DB with both builders in a temporary folder, report the times and check that the DBs are the same')
 @click.pass_context
 
-def parse_gtf(ctx, config_file, input_gtf, output_db):
+def parse_gtf(ctx, config_file, input_gtf, output_db, builder, benchmark):
+  if benchmark:
+    results = benchmark_featuredb(input_gtf, os.path.dirname(os.path.abspath(output_db)) if output_db else None)
+    print("gffutils: {:.2f}s, fast: {:.2f}s ({:.1f}x), same DB: {}".format(
+      results['gffutils'], results['fast'], results['gffutils'] / results['fast'], results['identical']))
+    return
   ensembl_data_service = EnsemblDataService(config_file, {})
-  ensembl_data_service.parse_gtf(input_gtf, output_db)
\ No newline at end of file
+  ensembl_data_service.parse_gtf(input_gtf, output_db, builder)
\ No newline at end of file
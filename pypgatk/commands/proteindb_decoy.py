@@ -33,17 +33,21 @@ this_dir, this_filename = os.path.split(__file__)
 @click.option('--max_iterations', type=int, help='Set maximum number of times to shuffle a peptide to make it non-target before failing. Default=100', default = 100)
 @click.option('--do_not_shuffle', help='Turn OFF shuffling of decoy peptides that are in the target database. Default=false', is_flag = True, default = False)
 @click.option('--do_not_switch', help='Turn OFF switching of cleavage site with preceding amino acid. Default=false', is_flag = True, default = False)
-@click.option('--temp_file', help='Set temporary file to write decoys prior to shuffling. Default=tmp.fa', default = 'tmp.fa')
+@click.option('--temp_file', help='Set temporary file to write decoys prior to shuffling. Default=a new file in the temporary folder')
+@click.option('--temp_dir', help='Folder of the temporary files. Default=the system temporary folder')
 @click.option('--no_isobaric', help='Do not make decoy peptides isobaric. Default=false', is_flag = True, default = False)
 @click.option('--keep_target_hits', help='Keep peptides duplicate in target and decoy databases', is_flag = True, default = False)
 @click.option('--memory_save', help='Slower but uses less memory (does not store decoy peptide list). Default=false', is_flag = True, default = False)
+@click.option('--bloom_filter_bits', type=int, help='Bits per peptide of a Bloom filter in front of the target peptides, speeds up the membership tests of large databases. Default=0 (no Bloom filter)')
+@click.option('--threads', type=int, help='Number of processes generating the decoys. Default=1')
+@click.option('--seed', type=int, help='Seed of the random shuffles, the decoys are the same for the same seed whatever the number of threads. Default=0')
 @click.option('--use_suffix', help='Use suffix for decoy accession number instead of prefix. Default=false', is_flag = True, default = False)
 @click.pass_context
 def generate_database(ctx, config_file: str, output_database: str, input_database: str, method: str,
                       decoy_prefix: str , decoy_suffix: str, enzyme: str, cleavage_position: str,
                       max_missed_cleavages: int, min_peptide_length: int, max_peptide_length : int,
-                      max_iterations: int, do_not_shuffle: bool , do_not_switch: bool, temp_file: str,
-                      no_isobaric: bool, keep_target_hits: bool, memory_save: bool, use_suffix: bool):
+                      max_iterations: int, do_not_shuffle: bool , do_not_switch: bool, temp_file: str, temp_dir: str,
+                      no_isobaric: bool, keep_target_hits: bool, memory_save: bool, bloom_filter_bits: int, threads: int, seed: int, use_suffix: bool):
   if config_file is None:
     msg = "The config file for the pipeline is missing, please provide one "
     logging.error(msg)
@@ -96,6 +100,9 @@ def generate_database(ctx, config_file: str, output_database: str, input_databas
   if temp_file is not None:
     pipeline_arguments[ProteinDBDecoyService.CONFIG_TEMP_FILE] = temp_file
 
+  if temp_dir is not None:
+    pipeline_arguments[ProteinDBDecoyService.CONFIG_TEMP_DIR] = temp_dir
+
   if no_isobaric is not None:
     pipeline_arguments[ProteinDBDecoyService.CONFIG_NO_ISOBARIC] = no_isobaric
 
@@ -105,6 +112,15 @@ def generate_database(ctx, config_file: str, output_database: str, input_databas
   if memory_save is not None:
     pipeline_arguments[ProteinDBDecoyService.CONFIG_MEMORY_SAVE] = memory_save
 
+  if bloom_filter_bits is not None:
+    pipeline_arguments[ProteinDBDecoyService.CONFIG_BLOOM_FILTER_BITS] = bloom_filter_bits
+
+  if threads is not None:
+    pipeline_arguments[ProteinDBDecoyService.CONFIG_THREADS] = threads
+
+  if seed is not None:
+    pipeline_arguments[ProteinDBDecoyService.CONFIG_SEED] = seed
+
   if use_suffix is not None:
     pipeline_arguments[ProteinDBDecoyService.CONFIG_USE_SUFFIX] = use_suffix
 
@@ -0,0 +1,32 @@
+import click
+
+from pypgatk.commands.utils import print_help
+from pypgatk.proteomics.db.protein_database_merge import merge_protein_databases
+
+
+@click.command('merge-proteindb',
+               short_help='Merge protein databases into a non-redundant database, proteins with the same sequence are written once')
+@click.option('-in', '--input_database', multiple=True,
+              help='Protein database to merge (FASTA, plain or gzip), can be given several times')
+@click.option('-out', '--output_database', default='merged-proteindb.fa',
+              help='Output database, gzip compressed when its name ends with .gz (default merged-proteindb.fa)')
+@click.option('--memory_limit', type=float, default=1024,
+              help='Memory (MB) used by the proteins kept in memory, beyond it they are sorted to temporary files (default 1024)')
+@click.option('--temp_dir', help='Folder of the temporary files (default: the system temporary folder)')
+@click.option('--accession_separator', default=';',
+              help='Separator of the accessions of the proteins merged into one (default ;)')
+@click.pass_context
+def merge_proteindb(ctx, input_database, output_database, memory_limit, temp_dir, accession_separator):
+  if not input_database:
+    print_help()
+
+  stats = merge_protein_databases(input_database, output_database, int(memory_limit * 1024 ** 2), temp_dir,
+                                  accession_separator)
+  print("   total number of input sequences was: {} ({} aminoacids)".format(stats['input_sequences'],
+                                                                          stats['input_residues']))
+  print("   total number of sequences written was: {} ({} aminoacids)".format(stats['output_sequences'],
+                                                                            stats['output_residues']))
+  if stats['input_residues']:
+    print("   size reduction: {:.1f}% of the sequences, {:.1f}% of the aminoacids".format(
+      100 * (1 - stats['output_sequences'] / stats['input_sequences']),
+      100 * (1 - stats['output_residues'] / stats['input_residues'])))
@@ -15,12 +15,28 @@ this_dir, this_filename = os.path.split(__file__)
 @click.option('-in', '--input_fasta', help='input_fasta file to perform the translation')
 @click.option('-t', '--translation_table', help='Translation table default value 1', default='1')
 @click.option('-out', '--output', help='Output File', default="peptide-database.fa")
+@click.option('--packed_sequences', is_flag=True,
+              help="Read the sequences from a memory-mapped 2-bit packed copy of the fasta file, written next to it on the first run")
+@click.option('--num_frames', type=click.Choice(['3', '6']),
+              help="Number of reading frames, with 6 the reverse complement is translated too (default 3)")
+@click.option('--min_orf_length', type=int,
+              help="Split the frames at the stop codons and only write the ORFs of at least this number of amino acids (default 0, whole frames)")
+@click.option('--workers', type=int, help="Number of processes translating the sequences (default 1)")
 @click.pass_context
-def threeframe_translation(ctx, config_file, input_fasta, translation_table, output):
+def threeframe_translation(ctx, config_file, input_fasta, translation_table, output, packed_sequences, num_frames,
+                           min_orf_length, workers):
   if input_fasta is None:
     print_help()
   pipeline_arguments = {EnsemblDataService.TRANSLATION_TABLE: translation_table,
                         EnsemblDataService.PROTEIN_DB_OUTPUT: output}
+  if packed_sequences:
+    pipeline_arguments[EnsemblDataService.PACKED_SEQUENCES] = packed_sequences
+  if num_frames:
+    pipeline_arguments[EnsemblDataService.NUM_FRAMES] = int(num_frames)
+  if min_orf_length is not None:
+    pipeline_arguments[EnsemblDataService.MIN_ORF_LENGTH] = min_orf_length
+  if workers:
+    pipeline_arguments[EnsemblDataService.WORKERS] = workers
 
   ensembl_data_service = EnsemblDataService(config_file, pipeline_arguments)
   ensembl_data_service.three_frame_translation(input_fasta)
@@ -31,9 +31,11 @@ this_dir, this_filename = os.path.split(__file__)
               help="field name in the VCF INFO column to use for filtering on AF, (Default None)")
 @click.option('--af_threshold', help='Minium AF threshold for considering common variants')
 @click.option('--transcript_index', type=int,
-              help='Index of transcript ID in the annotated columns (separated by |)')
+              help='Index of transcript ID in the annotated columns (separated by |), by default the Feature field of the annotation header Format')
 @click.option('--consequence_index', type=int,
-              help='Index of consequence in the annotated columns (separated by |)')
+              help='Index of consequence in the annotated columns (separated by |), by default the Consequence field of the annotation header Format')
+@click.option('--biotype_index', type=int,
+              help='Index of the biotype in the annotated columns (separated by |), when given annotations are filtered with include_biotypes and exclude_biotypes')
 @click.option('--exclude_consequences',
               help="Excluded Consequences")
 @click.option('-s', '--skip_including_all_cds',
@@ -44,13 +46,31 @@ this_dir, this_filename = os.path.split(__file__)
               help="enabling this option causes or variants to be parsed. By default only variants that have not failed any filters will be processed (FILTER column is PASS, None, .) or if the filters are subset of the accepted filters. (default is False)",
               is_flag=True)
 @click.option('--accepted_filters', help="Accepted filters for variant parsing")
+@click.option('--workers', type=int, help="Number of processes used to translate the VCF, the VCF is split by chromosome (default 1)")
+@click.option('--shard_window', type=int,
+              help="Also split chromosomes into genomic windows of this size (bp) when using multiple workers (default 0, by chromosome only)")
+@click.option('--transcript_cache_size', type=int,
+              help="Number of transcripts (sequence, features and reference translation) kept in memory (default 1000)")
+@click.option('--vcf_reader', type=click.Choice(['fast', 'pyvcf']),
+              help="VCF parser: the built-in streaming reader (fast) or PyVCF (pyvcf), plain and bgzipped VCF files are supported (default fast)")
+@click.option('--regions',
+              help="Only translate the variants in these regions: a BED file or comma separated chr, chr:start-end (1-based), bgzipped VCF files with a tabix/CSI index are read by region")
+@click.option('--genes',
+              help="Only translate the variants in these genes, comma separated gene names or IDs from the gene annotations")
+@click.option('--cache_dir',
+              help="Folder where the gene annotation database, transcript model and overlap index are kept and reused by later runs on the same files (default: no cache)")
+@click.option('--cache_max_size', type=float,
+              help="Maximum size of the cache folder in GB, the least recently used files are removed (default 20)")
+@click.option('--packed_sequences', is_flag=True,
+              help="Read the sequences from a memory-mapped 2-bit packed copy of the fasta file, written next to it on the first run")
 @click.pass_context
 def vcf_to_proteindb(ctx, config_file, input_fasta, vcf, gene_annotations_gtf, gene_annotations_db, translation_table,
                      mito_translation_table,
                      var_prefix, report_ref_seq, verbous_debug, output_proteindb, annotation_field_name,
-                     af_field, af_threshold, transcript_index, consequence_index,
+                     af_field, af_threshold, transcript_index, consequence_index, biotype_index,
                      exclude_consequences, skip_including_all_cds, include_consequences,
-                     ignore_filters, accepted_filters):
+                     ignore_filters, accepted_filters, workers, shard_window, transcript_cache_size, vcf_reader,
+                     regions, genes, cache_dir, cache_max_size, packed_sequences):
     if input_fasta is None or vcf is None or gene_annotations_gtf is None:
         print_help()
 
@@ -78,6 +98,8 @@ def vcf_to_proteindb(ctx, config_file, input_fasta, vcf, gene_annotations_gtf, g
         pipeline_arguments[EnsemblDataService.TRANSCRIPT_INDEX] = transcript_index
     if consequence_index:
         pipeline_arguments[EnsemblDataService.CONSEQUENCE_INDEX] = consequence_index
+    if biotype_index is not None:
+        pipeline_arguments[EnsemblDataService.BIOTYPE_INDEX] = biotype_index
     if exclude_consequences:
         pipeline_arguments[EnsemblDataService.EXCLUDE_CONSEQUENCES] = exclude_consequences
     if skip_including_all_cds:
@@ -88,6 +110,24 @@ def vcf_to_proteindb(ctx, config_file, input_fasta, vcf, gene_annotations_gtf, g
         pipeline_arguments[EnsemblDataService.IGNORE_FILTERS] = ignore_filters
     if accepted_filters:
         pipeline_arguments[EnsemblDataService.ACCEPTED_FILTERS] = accepted_filters
+    if workers:
+        pipeline_arguments[EnsemblDataService.WORKERS] = workers
+    if shard_window:
+        pipeline_arguments[EnsemblDataService.SHARD_WINDOW] = shard_window
+    if transcript_cache_size:
+        pipeline_arguments[EnsemblDataService.TRANSCRIPT_CACHE_SIZE] = transcript_cache_size
+    if vcf_reader:
+        pipeline_arguments[EnsemblDataService.VCF_READER] = vcf_reader
+    if regions:
+        pipeline_arguments[EnsemblDataService.REGIONS] = regions
+    if genes:
+        pipeline_arguments[EnsemblDataService.GENES] = genes
+    if cache_dir:
+        pipeline_arguments[EnsemblDataService.CACHE_DIR] = cache_dir
+    if cache_max_size:
+        pipeline_arguments[EnsemblDataService.CACHE_MAX_SIZE] = cache_max_size
+    if packed_sequences:
+        pipeline_arguments[EnsemblDataService.PACKED_SEQUENCES] = packed_sequences
 
     # pipeline_arguments = {EnsemblDataService.MITO_TRANSLATION_TABLE: mito_translation_table,
     #                      EnsemblDataService.TRANSLATION_TABLE: translation_table,
@@ -10,7 +10,8 @@
 import sys
 import getopt
 import re
-from Bio import SeqIO
+
+from pypgatk.toolbox.fasta_index import FastaIndex
 
 
 class EXON(object):
@@ -160,7 +161,7 @@ input_stream.close()
 
 output = open(output_file, 'w')
 
-seq_dic = SeqIO.index(fasta_file, 'fasta')
+seq_dic = FastaIndex(fasta_file)  # persistent index, reused by the next runs on the same fasta
 print("number of unique protein sequences in fasta file", len(seq_dic))
 
 non_mapped_pep = 0
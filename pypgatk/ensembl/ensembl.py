@@ -1,11 +1,53 @@
+import io
+import mmap
 import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import Pool
+
 import gffutils
 import vcf
 from Bio import SeqIO
-from Bio.Seq import Seq
-from pybedtools import BedTool
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+from Bio.Seq import Seq, reverse_complement
 import json
+from pypgatk.ensembl.featuredb import create_featuredb, create_featuredb_gffutils, is_featuredb
+from pypgatk.ensembl.genome_transcripts import write_genome_transcripts
+from pypgatk.ensembl.transcript_model import TranscriptModel, TranscriptContext, TranscriptContextCache, \
+    TranscriptCoordinates
+from pypgatk.ensembl.transcript_overlaps import TranscriptIntervalIndex
 from pypgatk.toolbox.general import ParameterConfiguration
+from pypgatk.toolbox.translation import TranslationTable, find_orfs, reverse_complement_bytes, translate, \
+    translate_frames
+from pypgatk.toolbox.artifact_cache import ArtifactCache
+from pypgatk.toolbox.fasta_index import FastaIndex, build_index, default_index_file, fasta_entries, fasta_sequence, \
+    index_matches, map_fasta
+from pypgatk.toolbox.sequence_store import STORE_SUFFIX, SequenceStore, build_sequence_store, store_matches
+from pypgatk.toolbox.vcf_reader import VcfReader, open_vcf, parse_annotation_format, parse_regions
+
+# service and transcript model shared by the processes of a sharded vcf-to-proteindb or dnaseq-to-proteindb run
+_shard_worker_state = {}
+
+
+def _init_shard_worker(service, transcript_model):
+    _shard_worker_state['service'] = service
+    _shard_worker_state['transcript_model'] = transcript_model
+
+
+def _translate_vcf_shard(vcf_file, input_fasta):
+    return _shard_worker_state['service'].vcf_shard_to_proteindb_file(vcf_file, input_fasta,
+                                                                      _shard_worker_state['transcript_model'])
+
+
+def _init_dnaseq_worker(service):
+    _shard_worker_state['service'] = service
+
+
+def _translate_dnaseq_chunk(records):
+    return _shard_worker_state['service'].dnaseq_records_text(records)
 
 
 class EnsemblDataService(ParameterConfiguration):
@@ -22,6 +64,8 @@ class EnsemblDataService(ParameterConfiguration):
     AF_THRESHOLD = "af_threshold"
     TRANSCRIPT_INDEX = "transcript_index"
     CONSEQUENCE_INDEX = "consequence_index"
+    BIOTYPE_INDEX = "biotype_index"
+    AUTO_INDEX = "auto"
     EXCLUDE_BIOTYPES = "exclude_biotypes"
     EXCLUDE_CONSEQUENCES = "exclude_consequences"
     SKIP_INCLUDING_ALL_CDS = "skip_including_all_cds"
@@ -36,6 +80,24 @@ class EnsemblDataService(ParameterConfiguration):
     EXPRESSION_THRESH = "expression_thresh"
     IGNORE_FILTERS = "ignore_filters"
     ACCEPTED_FILTERS = "accepted_filters"
+    WORKERS = "workers"
+    SHARD_WINDOW = "shard_window"
+    TRANSCRIPT_CACHE_SIZE = "transcript_cache_size"
+    VCF_READER = "vcf_reader"
+    REGIONS = "regions"
+    GENES = "genes"
+    CACHE_DIR = "cache_dir"
+    CACHE_MAX_SIZE = "cache_max_size"
+    PACKED_SEQUENCES = "packed_sequences"
+    INDEX_NEXT_TO_FASTA = "index_next_to_fasta"
+    NUM_FRAMES = "num_frames"
+    MIN_ORF_LENGTH = "min_orf_length"
+    FIND_ORFS = "find_orfs"
+    # counts of check_proteindb
+    CHECK_COUNTS = ('input_sequences', 'written_sequences', 'no_met', 'premature_stops', 'gaps', 'short_sequences')
+    # bases of the records translated together by a worker of three_frame_translation
+    TRANSLATION_CHUNK_SIZE = 4 * 1024 * 1024
+    OUTPUT_BUFFER_SIZE = 1024 * 1024
 
     def __init__(self, config_file, pipeline_arguments):
         """
@@ -86,16 +148,25 @@ class EnsemblDataService(ParameterConfiguration):
         elif self.AF_THRESHOLD in self.get_pipeline_parameters():
             self._af_threshold = self.get_pipeline_parameters()[self.AF_THRESHOLD]
 
+        # the annotation field indexes are resolved from the VCF header by default (see get_annotation_indexes)
+        self._transcript_index = self.AUTO_INDEX
         if self.TRANSCRIPT_INDEX in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
             self._transcript_index = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.TRANSCRIPT_INDEX]
-        elif self.TRANSCRIPT_INDEX in self.get_pipeline_parameters():
+        if self.TRANSCRIPT_INDEX in self.get_pipeline_parameters():
             self._transcript_index = self.get_pipeline_parameters()[self.TRANSCRIPT_INDEX]
 
+        self._consequence_index = self.AUTO_INDEX
         if self.CONSEQUENCE_INDEX in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
             self._consequence_index = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.CONSEQUENCE_INDEX]
-        elif self.CONSEQUENCE_INDEX in self.get_pipeline_parameters():
+        if self.CONSEQUENCE_INDEX in self.get_pipeline_parameters():
             self._consequence_index = self.get_pipeline_parameters()[self.CONSEQUENCE_INDEX]
 
+        self._biotype_index = None
+        if self.BIOTYPE_INDEX in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._biotype_index = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.BIOTYPE_INDEX]
+        if self.BIOTYPE_INDEX in self.get_pipeline_parameters():
+            self._biotype_index = self.get_pipeline_parameters()[self.BIOTYPE_INDEX]
+
         if self.EXCLUDE_BIOTYPES in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
             self._exclude_biotypes = self.get_multiple_options(self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.EXCLUDE_BIOTYPES])
         elif self.EXCLUDE_BIOTYPES in self.get_pipeline_parameters():
@@ -158,28 +229,185 @@ class EnsemblDataService(ParameterConfiguration):
         elif self.ACCEPTED_FILTERS in self.get_pipeline_parameters():
             self._accepted_filters = self.get_multiple_options(self.get_pipeline_parameters()[self.ACCEPTED_FILTERS])
 
+        self._workers = 1
+        if self.WORKERS in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._workers = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.WORKERS]
+        if self.WORKERS in self.get_pipeline_parameters():
+            self._workers = self.get_pipeline_parameters()[self.WORKERS]
+
+        self._shard_window = 0
+        if self.SHARD_WINDOW in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._shard_window = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.SHARD_WINDOW]
+        if self.SHARD_WINDOW in self.get_pipeline_parameters():
+            self._shard_window = self.get_pipeline_parameters()[self.SHARD_WINDOW]
+
+        self._transcript_cache_size = 1000
+        if self.TRANSCRIPT_CACHE_SIZE in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._transcript_cache_size = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][
+                self.TRANSCRIPT_CACHE_SIZE]
+        if self.TRANSCRIPT_CACHE_SIZE in self.get_pipeline_parameters():
+            self._transcript_cache_size = self.get_pipeline_parameters()[self.TRANSCRIPT_CACHE_SIZE]
+
+        self._vcf_reader = 'fast'
+        if self.VCF_READER in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._vcf_reader = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.VCF_READER]
+        if self.VCF_READER in self.get_pipeline_parameters():
+            self._vcf_reader = self.get_pipeline_parameters()[self.VCF_READER]
+
+        self._regions = None
+        if self.REGIONS in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._regions = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.REGIONS]
+        if self.REGIONS in self.get_pipeline_parameters():
+            self._regions = self.get_pipeline_parameters()[self.REGIONS]
+
+        self._genes = None
+        if self.GENES in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._genes = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.GENES]
+        if self.GENES in self.get_pipeline_parameters():
+            self._genes = self.get_pipeline_parameters()[self.GENES]
+
+        cache_dir = None
+        if self.CACHE_DIR in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            cache_dir = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.CACHE_DIR]
+        if self.CACHE_DIR in self.get_pipeline_parameters():
+            cache_dir = self.get_pipeline_parameters()[self.CACHE_DIR]
+
+        cache_max_size = None
+        if self.CACHE_MAX_SIZE in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            cache_max_size = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.CACHE_MAX_SIZE]
+        if self.CACHE_MAX_SIZE in self.get_pipeline_parameters():
+            cache_max_size = self.get_pipeline_parameters()[self.CACHE_MAX_SIZE]
+
+        # artifacts derived from the gene annotations are reused by later runs on the same inputs
+        self._cache = None
+        if cache_dir:
+            self._cache = ArtifactCache(cache_dir, int(float(cache_max_size) * 1024 ** 3) if cache_max_size else None,
+                                        self.get_logger())
+        self._fasta_index_files = {}
+
+        self._packed_sequences = False
+        if self.PACKED_SEQUENCES in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._packed_sequences = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][
+                self.PACKED_SEQUENCES]
+        if self.PACKED_SEQUENCES in self.get_pipeline_parameters():
+            self._packed_sequences = self.get_pipeline_parameters()[self.PACKED_SEQUENCES]
+        self._sequence_store_files = {}
+
+        # without a cache folder, the fasta indexes are written in the temporary folder unless asked next to the fasta
+        self._index_next_to_fasta = False
+        if self.INDEX_NEXT_TO_FASTA in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._index_next_to_fasta = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][
+                self.INDEX_NEXT_TO_FASTA]
+        if self.INDEX_NEXT_TO_FASTA in self.get_pipeline_parameters():
+            self._index_next_to_fasta = self.get_pipeline_parameters()[self.INDEX_NEXT_TO_FASTA]
+
+        self._num_frames = 3
+        if self.NUM_FRAMES in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._num_frames = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.NUM_FRAMES]
+        if self.NUM_FRAMES in self.get_pipeline_parameters():
+            self._num_frames = self.get_pipeline_parameters()[self.NUM_FRAMES]
+        if int(self._num_frames) not in (3, 6):
+            raise ValueError("The number of frames must be 3 or 6, not {}".format(self._num_frames))
+        self._num_frames = int(self._num_frames)
+
+        self._min_orf_length = 0
+        if self.MIN_ORF_LENGTH in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._min_orf_length = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][
+                self.MIN_ORF_LENGTH]
+        if self.MIN_ORF_LENGTH in self.get_pipeline_parameters():
+            self._min_orf_length = self.get_pipeline_parameters()[self.MIN_ORF_LENGTH]
+        self._min_orf_length = int(self._min_orf_length)
+
+        self._find_orfs = False
+        if self.FIND_ORFS in self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF]:
+            self._find_orfs = self.get_default_parameters()[self.CONFIG_KEY_DATA][self.CONFIG_KEY_VCF][self.FIND_ORFS]
+        if self.FIND_ORFS in self.get_pipeline_parameters():
+            self._find_orfs = self.get_pipeline_parameters()[self.FIND_ORFS]
+
     def three_frame_translation(self, input_fasta):
         """
         This function translate a transcriptome into a 3'frame translation protein sequence database
+        (6 frames with num_frames = 6, the frames RF4-RF6 are read from the reverse complement). The records are
+        read in chunks, translated by the configured number of workers and written in input order.
         :param input_fasta: fasta input file
-        :return:
+        :return: output fasta file
         """
+        chunks = self._fasta_chunks(input_fasta)
+        translation_args = (self._translation_table, self._num_frames, self._min_orf_length)
+        with open(self._proteindb_output, 'w', buffering=self.OUTPUT_BUFFER_SIZE) as output_handle:
+            if self._workers <= 1:
+                for chunk in chunks:
+                    output_handle.write(self.translate_frames_records(chunk, *translation_args))
+                return self._proteindb_output
+
+            # only a few chunks are read ahead of the ones being written
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(self.translate_frames_records, chunk, *translation_args))
+                    while len(pending) > 2 * self._workers or (pending and pending[0].done()):
+                        output_handle.write(pending.popleft().result())
+                while pending:
+                    output_handle.write(pending.popleft().result())
+        return self._proteindb_output
 
-        input_handle = open(input_fasta, 'r')
-        output_handle = open(self._proteindb_output, 'w')
-
-        for record in SeqIO.parse(input_handle, 'fasta'):
-            seq = record.seq
-            RF1 = seq.translate(table=self._translation_table)
-            RF2 = seq[1::].translate(table=self._translation_table)
-            RF3 = seq[2::].translate(table=self._translation_table)
+    def _fasta_chunks(self, input_fasta):
+        """
+        (ID, sequence) of the records of a fasta file in chunks of about TRANSLATION_CHUNK_SIZE bases, the
+        records without ID are skipped. With packed sequences the sequences are the bytes decoded from the
+        sequence store, translated without any str copy.
+        """
+        chunk = []
+        chunk_size = 0
+        if self._packed_sequences:
+            source = self.get_fasta_index(input_fasta)
+            records = ((title, source.sequence_bytes(row)) for row, title in source.entries())
+        else:
+            source = open(input_fasta, 'r')
+            records = SimpleFastaParser(source)
+        try:
+            for title, seq in records:
+                words = title.split(None, 1)
+                if not words:
+                    print("skip entries without id", title)
+                    continue
+                chunk.append((words[0], seq))
+                chunk_size += len(seq)
+                if chunk_size >= self.TRANSLATION_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+                    chunk_size = 0
+            if chunk:
+                yield chunk
+        finally:
+            source.close()
 
-            if record.id == "":
-                print("skip entries without id", record.description)
-                continue
-            output_handle.write("%s\n%s\n" % ('>' + record.id + '_RF1', RF1))
-            output_handle.write("%s\n%s\n" % ('>' + record.id + '_RF2', RF2))
-            output_handle.write("%s\n%s\n" % ('>' + record.id + '_RF3', RF3))
+    @staticmethod
+    def translate_frames_records(records, translation_table=1, num_frames=3, min_orf_length=0):
+        """
+        Fasta text of the frame translations of a list of records: >ID_RF1 ... >ID_RF3 (>ID_RF6 with 6 frames).
+        With a minimum ORF length, every frame is split at the stop codons and only the ORFs of at least
+        min_orf_length amino acids are written (>ID_RF1_ORF1, >ID_RF1_ORF2, ...).
+        :param records: list of (ID, DNA sequence as str or bytes)
+        :param translation_table: NCBI translation table ID
+        :param num_frames: 3 or 6
+        :param min_orf_length: minimum ORF length, 0 to write the whole frames
+        :return: fasta text
+        """
+        lines = []
+        for record_id, seq in records:
+            frames = translate_frames(seq, translation_table)
+            if num_frames == 6:
+                reverse_seq = reverse_complement_bytes(seq) if isinstance(seq, bytes) else reverse_complement(seq)
+                frames += translate_frames(reverse_seq, translation_table)
+            for frame_number, protein in enumerate(frames, 1):
+                if not min_orf_length:
+                    lines.append('>{}_RF{}\n{}\n'.format(record_id, frame_number, protein))
+                    continue
+                orfs = [orf for orf in protein.split('*') if len(orf) >= min_orf_length]
+                for orf_number, orf in enumerate(orfs, 1):
+                    lines.append('>{}_RF{}_ORF{}\n{}\n'.format(record_id, frame_number, orf_number, orf))
+        return ''.join(lines)
 
     @staticmethod
     def get_multiple_options(options_str: str):
@@ -191,33 +419,28 @@ class EnsemblDataService(ParameterConfiguration):
         return list(map(lambda x: x.strip(), options_str.split(",")))
 
     @staticmethod
-    def check_overlap(var_start, var_end, features_info=None):
+    def check_overlap(var_start, var_end, features_info=None, coordinates=None):
         """
         This function returns true when the variant overlaps any of the features
         :param var_start: Start location
         :param var_end: End location
         :param features_info: Feature information (default = [[0, 1, 'type']])
+        :param coordinates: TranscriptCoordinates of the features, built from features_info when not given
         :return:
         """
 
-        if features_info is None:
-            features_info = [[0, 1, 'type']]
         if var_start == -1:
             return True
+        if coordinates is None:
+            if features_info is None:
+                features_info = [[0, 1, 'type']]
+            coordinates = TranscriptCoordinates(features_info)
         # check if the var overlaps any of the features
-        for feature_pos in features_info:
-            pep_start = feature_pos[0]
-            pep_end = feature_pos[1]
-            if var_start <= pep_start <= var_end:  # fully contained or partial overlap from the end
-                return True
-            elif var_start <= pep_end <= var_end:  # partial overlap in the begining
-                return True
-            elif pep_start <= var_start and pep_end >= var_end:  # fully covered
-                return True
-        return False
+        return coordinates.overlaps(var_start, var_end)
 
     @staticmethod
-    def get_altseq(ref_seq, ref_allele, var_allele, var_pos, strand, features_info, cds_info=None):
+    def get_altseq(ref_seq, ref_allele, var_allele, var_pos, strand, features_info, cds_info=None,
+                   with_offsets=False, coordinates=None):
         """
         The given sequence in the fasta file represents all exons of the transcript combined.
         for protein coding genes, the CDS is specified therefore the sequence position has to be
@@ -230,63 +453,73 @@ class EnsemblDataService(ParameterConfiguration):
         :param strand:
         :param features_info:
         :param cds_info:
+        :param with_offsets: also return the (start, end) positions of the replaced bases in the coding ref,
+                             alt = ref[:start] + allele + ref[end:] (None when no alt seq is generated)
+        :param coordinates: TranscriptCoordinates of the features, built from features_info when not given
         :return:
         """
         if cds_info is None:
             cds_info = []
-        alt_seq = ""
+        if coordinates is None:
+            coordinates = TranscriptCoordinates(features_info)
         if len(cds_info) == 2:
             start_coding_index = cds_info[0] - 1  # it should be index not pos
             # get end position of the  last cds
             stop_coding_index = cds_info[1]
         else:
             start_coding_index = 0
-            total_len = 0
-            for x in features_info:
-                total_len += x[1] - x[0] + 1
             # the features are sorted by end therefroe the end pos of the last item is the last coding nc
-            stop_coding_index = total_len
-
-        if strand == '-':  # ge the correct orientation, because exons are oredered based on their position
-            ref_seq = ref_seq[
-                ::-1]  # in order to calculate from the first base of the first feature (sorted by genomic coordinates)
-            ref_allele = ref_allele.complement()  # the reverse will be done on return
-            var_allele = var_allele.complement()  # the reverse will be done on return
+            stop_coding_index = coordinates.length
 
-        ref_seq = ref_seq[
-            start_coding_index:stop_coding_index]  # just keep the coding regions (mostly effective in case of protein-coding genes)
-        nc_index = 0
+        # index of the var relative to the position of the overlapping feature in the coding region
+        var_index_in_cds = None
         if len(ref_allele) == len(var_allele) or ref_allele[0] == var_allele[0]:
-            for feature in features_info:  # for every exon, cds or stop codon
-                if var_pos in range(feature[0], feature[
-                        1] + 1):  # get index of the var relative to the position of the overlapping feature in the coding region
-                    var_index_in_cds = nc_index + (var_pos - feature[0])
-                    # modify the coding reference sequence accoding to the var_allele
-                    c = len(ref_allele)
-                    alt_seq = ref_seq[0:var_index_in_cds] + var_allele + ref_seq[
-                        var_index_in_cds + c::]  # variant and ref strand??
-                    if strand == '-':
-                        return ref_seq[::-1], alt_seq[::-1]
-                    else:
-                        return ref_seq, alt_seq
-
-                nc_index += (feature[1] - feature[0] + 1)
-
+            var_index_in_cds = coordinates.to_transcript(var_pos)
+
+        if var_index_in_cds is None:
+            if strand == '-':  # coding region in the orientation of the features (sorted by genomic coordinates)
+                ref_seq = ref_seq[::-1]
+            ref_seq = ref_seq[start_coding_index:stop_coding_index]
+            if with_offsets:
+                return ref_seq, "", None
+            return ref_seq, ""
+
+        c = len(ref_allele)
+        if strand == '-':
+            # the features are sorted by genomic coordinates, on the minus strand the sequence runs from the
+            # last feature to the first, the coding region and the var index are mirrored instead of reversing
+            seq_len = len(ref_seq)
+            ref_seq = ref_seq[max(seq_len - stop_coding_index, 0):max(seq_len - start_coding_index, 0)]
+            var_allele = var_allele.reverse_complement()
+            start = len(ref_seq) - min(var_index_in_cds + c, len(ref_seq))
+            end = len(ref_seq) - min(var_index_in_cds, len(ref_seq))
+        else:
+            ref_seq = ref_seq[start_coding_index:stop_coding_index]
+            start = min(var_index_in_cds, len(ref_seq))
+            end = min(var_index_in_cds + c, len(ref_seq))
+        # modify the coding reference sequence accoding to the var_allele
+        alt_seq = ref_seq[0:start] + var_allele + ref_seq[end:]
+        if with_offsets:
+            return ref_seq, alt_seq, (start, end)
         return ref_seq, alt_seq
 
     @staticmethod
-    def parse_gtf(gene_annotations_gtf, gtf_db_file):
+    def parse_gtf(gene_annotations_gtf, gtf_db_file, builder='fast'):
         """
         Convert GTF file into a FeatureDB
         :param gene_annotations_gtf:
         :param gtf_db_file:
+        :param builder: 'fast' to stream the GTF with bulk inserts (see featuredb.create_featuredb),
+                        'gffutils' to use gffutils.create_db, both write the same database
         :return:
         """
+        # an existing database is reused, unless it was left incomplete by a failed build
+        force = os.path.exists(gtf_db_file) and not is_featuredb(gtf_db_file)
         try:
-            gffutils.create_db(gene_annotations_gtf, gtf_db_file, merge_strategy="create_unique",
-                               keep_order=True, disable_infer_transcripts=True, disable_infer_genes=True,
-                               verbose=True,
-                               force=False)
+            if builder == 'gffutils':
+                create_featuredb_gffutils(gene_annotations_gtf, gtf_db_file, force=force)
+            else:
+                create_featuredb(gene_annotations_gtf, gtf_db_file, force=force)
         except Exception as e:  # already exists, or error
             print(str(e), gtf_db_file)
 
@@ -326,134 +559,325 @@ class EnsemblDataService(ParameterConfiguration):
         return feature.chrom, feature.strand, coding_features
 
     @staticmethod
-    def get_orfs_vcf(ref_seq: str, alt_seq: str, translation_table: int, num_orfs=1):
+    def get_gene_regions(db, genes):
+        """
+        Genomic regions of genes given by name (gene_name) or ID (gene_id, with or without version),
+        spanning the gene and all its transcripts
+        :param db: gffutils FeatureDB
+        :param genes: list of gene names/IDs
+        :return: list of (chrom, start, end) regions (0-based, end exclusive), list of the genes not found
+        """
+        genes = set(genes)
+        spans = {}
+        for seqid, start, end, attributes in db.execute(
+                "SELECT seqid, start, end, attributes FROM features WHERE featuretype IN ('gene', 'transcript')"):
+            attributes = json.loads(attributes)
+            names = set(attributes.get('gene_name', []) + attributes.get('gene_id', []))
+            unversioned_ids = {gene_id.split('.')[0] for gene_id in attributes.get('gene_id', [])}
+            for gene in genes:
+                if gene in names or gene.split('.')[0] in unversioned_ids:
+                    span = spans.get((gene, seqid))
+                    spans[(gene, seqid)] = (start - 1, end) if span is None else (min(span[0], start - 1),
+                                                                                   max(span[1], end))
+        found = {gene for gene, _ in spans}
+        regions = [(seqid, start, end) for (_, seqid), (start, end) in spans.items()]
+        return regions, sorted(genes - found)
+
+    def get_vcf_regions(self, db):
+        """
+        Regions of the VCF to translate from the regions and genes parameters
+        :param db: gffutils FeatureDB, used to find the coordinates of the genes
+        :return: list of (chrom, start, end) regions, None to translate the whole VCF
+        """
+        if not self._regions and not self._genes:
+            return None
+        regions = []
+        if self._regions:
+            regions += parse_regions(str(self._regions))
+        if self._genes:
+            genes = self.get_multiple_options(str(self._genes))
+            gene_regions, not_found = self.get_gene_regions(db, genes)
+            if not_found:
+                self.get_logger().warning("Genes not found in the gene annotations: {}".format(','.join(not_found)))
+            regions += gene_regions
+        return regions
+
+    @staticmethod
+    def get_orfs_vcf(ref_seq: str, alt_seq: str, translation_table: int, num_orfs=1, ref_orfs=None,
+                     alt_offsets=None):
         """
         Translate the coding_ref and the coding_alt into ORFs
         :param ref_seq:
         :param alt_seq:
         :param translation_table:
         :param num_orfs:
+        :param ref_orfs: ORFs of ref_seq translated before, ref_seq is not translated again when given
+        :param alt_offsets: (start, end) of the ref bases replaced in alt_seq as returned by get_altseq, when
+                            given together with ref_orfs only the codons changed by the variant are translated
         :return:
         """
 
-        ref_orfs = []
+        translate_ref = ref_orfs is None
+        if translate_ref:
+            ref_orfs = translate_frames(ref_seq, translation_table, range(num_orfs))
         alt_orfs = []
         for n in range(0, num_orfs):
-            ref_orfs.append(ref_seq[n::].translate(translation_table))
-            alt_orfs.append(alt_seq[n::].translate(translation_table))
+            if translate_ref or alt_offsets is None or alt_offsets[0] < n:
+                alt_orfs.append(translate(alt_seq[n::], translation_table))
+            else:
+                alt_orfs.append(EnsemblDataService.translate_alt_orf(ref_orfs[n], alt_seq[n::],
+                                                                     alt_offsets[0] - n, alt_offsets[1] - n,
+                                                                     len(alt_seq) - len(ref_seq),
+                                                                     translation_table))
 
         return ref_orfs, alt_orfs
 
+    @staticmethod
+    def translate_alt_orf(ref_orf, alt_seq, start, end, length_change, translation_table):
+        """
+        Translate alt_seq reusing the translation of the reference it was derived from. Codons before
+        the variant are taken from ref_orf; for in-frame variants only the codons overlapping the variant
+        are translated and the rest is taken from ref_orf again, frameshifts are translated from the
+        variant codon onwards. The result is the same as alt_seq.translate(translation_table).
+        :param ref_orf: translation of the reference sequence
+        :param alt_seq: alt sequence, ref[:start] + allele + ref[end:]
+        :param start: start of the replaced ref bases
+        :param end: end of the replaced ref bases
+        :param length_change: len(alt_seq) - len(ref)
+        :param translation_table:
+        :return: translation of alt_seq
+        """
+        first_codon = start // 3
+        if length_change % 3:
+            return ref_orf[:first_codon] + translate(alt_seq[first_codon * 3:], translation_table)
+
+        # codons after the variant are shifted by the same number of codons in the ref and alt
+        ref_end_codon = -(-end // 3)
+        alt_end_codon = ref_end_codon + length_change // 3
+        translated_len = min(alt_end_codon * 3, len(alt_seq) - len(alt_seq) % 3)
+        return (ref_orf[:first_codon] + translate(alt_seq[first_codon * 3:translated_len], translation_table) +
+                ref_orf[ref_end_codon:])
+
     @staticmethod
     def get_orfs_dna(ref_seq: str, translation_table: int, num_orfs: int, num_orfs_complement: int, to_stop: bool):
         """
         translate the coding_ref into ORFs
         """
 
-        ref_orfs = []
-        for n in range(0, num_orfs):
-            ref_orfs.append(ref_seq[n::].translate(
-                translation_table, to_stop=to_stop))
+        ref_orfs = translate_frames(ref_seq, translation_table, range(num_orfs), to_stop=to_stop)
 
-        rev_ref_seq = ref_seq.reverse_complement()
-        for n in range(0, num_orfs_complement):
-            ref_orfs.append(rev_ref_seq[n::].translate(
-                translation_table, to_stop=to_stop))
+        if num_orfs_complement:
+            if isinstance(ref_seq, bytes):
+                rev_ref_seq = reverse_complement_bytes(ref_seq)
+            else:
+                rev_ref_seq = ref_seq.reverse_complement()
+            ref_orfs += translate_frames(rev_ref_seq, translation_table, range(num_orfs_complement),
+                                         to_stop=to_stop)
 
         return ref_orfs
 
     def dnaseq_to_proteindb(self, input_fasta):
         """
-        translates DNA sequences to protein sequences
+        translates DNA sequences to protein sequences. The fasta file is read once in file order, the records are
+        filtered on their header before their sequence is read, and translated in chunks by the configured number
+        of workers (the proteins are written in input order).
         :param input_fasta: input fasta file
         :return:
         """
+        chunks = self._dnaseq_chunks(input_fasta)
+        with open(self._proteindb_output, 'w', buffering=self.OUTPUT_BUFFER_SIZE) as prots_fn:
+            if self._workers <= 1:
+                for chunk in chunks:
+                    for record_id, desc, key_values, ref_seq in chunk:
+                        self.write_dnaseq_record(record_id, desc, key_values, ref_seq, prots_fn)
+                return self._proteindb_output
+
+            # only a few chunks are read ahead of the ones being written
+            with Pool(self._workers, _init_dnaseq_worker, (self,)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_translate_dnaseq_chunk, (chunk,)))
+                    while len(pending) > 2 * self._workers or (pending and pending[0].ready()):
+                        prots_fn.write(pending.popleft().get())
+                while pending:
+                    prots_fn.write(pending.popleft().get())
+        return self._proteindb_output
 
-        seq_dict = SeqIO.index(input_fasta, "fasta")
-
-        with open(self._proteindb_output, 'w') as prots_fn:
-            for record_id in seq_dict.keys():
-
-                # get the seq and desc for the record from the fasta of the gtf
-                ref_seq = seq_dict[record_id].seq
-                desc = str(seq_dict[record_id].description)
-
-                key_values = {}  # extract key=value in the desc into a dict
-                sep = ' '
-                if '|' in desc:
-                    sep = '|'
-                for value in desc.split(sep):
-                    if value.split('=')[0] == 'cds' or value.split(':')[0] == 'cds':
-                        value.replace('cds', 'CDS')
-                    if '=' in value:
-                        key_values[value.split('=')[0]] = value.split('=')[1]
-                    elif ':' in value:
-                        key_values[value.split(':')[0]] = value.split(':')[1]
-                    elif value.split('=')[
-                            0] == 'CDS':  # when only it is specified to be a CDS, it means the whole sequence to be used
-                        key_values[value.split(
-                            '=')[0]] = '{}-{}'.format(1, len(ref_seq))
-
-                feature_biotype = ""
-                if self._biotype_str:
-                    try:
-                        feature_biotype = key_values[self._biotype_str]
-                    except KeyError:
-                        msg = "Biotype info was not found in the header using {} for record {} {}".format(self._biotype_str,
-                                                                                                          record_id, desc)
-                        self.get_logger().debug(msg)
-
-                # only include features that have the specified biotypes or they have CDSs info
-                if 'CDS' in key_values.keys() and (
-                        not self._skip_including_all_cds or 'altORFs' in self._include_biotypes):
-                    pass
-                elif self._biotype_str and (feature_biotype == "" or (feature_biotype in self._exclude_biotypes or
-                                                                      (
-                                                                          feature_biotype not in self._include_biotypes and self._include_biotypes != [
-                                                                              'all']))):
+    def _dnaseq_chunks(self, input_fasta):
+        """
+        (record ID, description, header key/values, sequence) of the records of the fasta file that pass the
+        filters, in chunks of about TRANSLATION_CHUNK_SIZE bases. The sequences are bytes, read from the
+        memory-mapped fasta file or decoded from the sequence store with packed sequences.
+        """
+        if self._packed_sequences:
+            source = self.get_fasta_index(input_fasta)
+            entries = ((title, row) for row, title in source.entries())
+        else:
+            source = map_fasta(input_fasta)
+            entries = ((title, (seq_start, seq_end)) for title, seq_start, seq_end in fasta_entries(source))
+        chunk = []
+        chunk_size = 0
+        try:
+            for desc, seq in entries:
+                words = desc.split(None, 1)
+                record_id = words[0] if words else ''
+                key_values = self.dnaseq_header_values(desc)
+                if not self.keep_dnaseq_record(record_id, desc, key_values):
                     continue
+                if self._packed_sequences:
+                    seq = source.sequence_bytes(seq)
+                else:
+                    seq = fasta_sequence(source, *seq)
+                if 'CDS' in key_values and key_values['CDS'] is None:
+                    # when only it is specified to be a CDS, it means the whole sequence to be used
+                    key_values['CDS'] = '{}-{}'.format(1, len(seq))
+                chunk.append((record_id, desc, key_values, seq))
+                chunk_size += len(seq)
+                if chunk_size >= self.TRANSLATION_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+                    chunk_size = 0
+            if chunk:
+                yield chunk
+        finally:
+            if self._packed_sequences or isinstance(source, mmap.mmap):
+                source.close()
 
-                # check wether to filter on expression and if it passes
-                if self._expression_str:
-                    try:
-                        if float(key_values[self._expression_str]) < self._expression_thresh:
-                            continue
-                    except KeyError:
-                        msg = "Expression information not found in the fasta header with expression_str: {} for record {} {}".format(
-                            self._expression_str, record_id, desc)
-                        self.get_logger().debug(msg)
-                        continue
-                    except TypeError:
-                        msg = "Expression value is not of valid type (float) at record: {} {}".format(record_id, key_values[
-                            self._expression_str])
-                        self.get_logger().debug(msg)
-                        continue
-
-                # translate the whole sequences (3 ORFs) for non CDS sequences and not take alt_ORFs for CDSs
-                if 'CDS' not in key_values.keys() or ('CDS' in key_values.keys() and
-                                                      ('altORFs' in self._include_biotypes or
-                                                       self._include_biotypes == ['all'])):
-                    ref_orfs = self.get_orfs_dna(ref_seq, self._translation_table, self._num_orfs,
-                                                 self._num_orfs_complement, to_stop=False)
-                    print(self._header_var_prefix)
-                    self.write_output(seq_id=self._header_var_prefix +
-                                      record_id, desc=desc, seqs=ref_orfs, prots_fn=prots_fn)
-
-                # also allow for direct translation of the CDS, when the cds info exists in the fasta header skip_including_all_cds is false
-                if 'CDS' in key_values.keys() and not self._skip_including_all_cds:
-                    try:
-                        cds_info = [int(x)
-                                    for x in key_values['CDS'].split('-')]
-                        ref_seq = ref_seq[cds_info[0] - 1:cds_info[1]]
-                        ref_orfs = self.get_orfs_dna(
-                            ref_seq, self._translation_table, 1, 0, to_stop=True)
-                        self.write_output(
-                            seq_id=record_id, desc=desc, seqs=ref_orfs, prots_fn=prots_fn)
-                    except (ValueError, IndexError, KeyError):
-                        print(
-                            "Could not extra cds position from fasta header for: ", record_id, desc)
+    @staticmethod
+    def dnaseq_header_values(desc):
+        """
+        key=value (or key:value) pairs of a fasta header, a CDS key without value (the whole sequence is the CDS)
+        is set to None
+        :param desc: fasta header
+        :return: dict
+        """
+        key_values = {}
+        sep = ' '
+        if '|' in desc:
+            sep = '|'
+        for value in desc.split(sep):
+            if '=' in value:
+                key_values[value.split('=')[0]] = value.split('=')[1]
+            elif ':' in value:
+                key_values[value.split(':')[0]] = value.split(':')[1]
+            elif value == 'CDS':
+                key_values[value] = None
+        return key_values
+
+    def keep_dnaseq_record(self, record_id, desc, key_values):
+        """
+        Biotype and expression filters of dnaseq_to_proteindb, applied to the header of a record
+        :param record_id: record ID
+        :param desc: fasta header
+        :param key_values: key/values of the header, see dnaseq_header_values
+        :return: True if the record is translated
+        """
+        feature_biotype = ""
+        if self._biotype_str:
+            try:
+                feature_biotype = key_values[self._biotype_str]
+            except KeyError:
+                msg = "Biotype info was not found in the header using {} for record {} {}".format(self._biotype_str,
+                                                                                                  record_id, desc)
+                self.get_logger().debug(msg)
+
+        # only include features that have the specified biotypes or they have CDSs info
+        if 'CDS' in key_values.keys() and (
+                not self._skip_including_all_cds or 'altORFs' in self._include_biotypes):
+            pass
+        elif self._biotype_str and (feature_biotype == "" or (feature_biotype in self._exclude_biotypes or
+                                                              (
+                                                                  feature_biotype not in self._include_biotypes and self._include_biotypes != [
+                                                                      'all']))):
+            return False
+
+        # check wether to filter on expression and if it passes
+        if self._expression_str:
+            try:
+                if float(key_values[self._expression_str]) < self._expression_thresh:
+                    return False
+            except KeyError:
+                msg = "Expression information not found in the fasta header with expression_str: {} for record {} {}".format(
+                    self._expression_str, record_id, desc)
+                self.get_logger().debug(msg)
+                return False
+            except TypeError:
+                msg = "Expression value is not of valid type (float) at record: {} {}".format(record_id, key_values[
+                    self._expression_str])
+                self.get_logger().debug(msg)
+                return False
+        return True
+
+    def write_dnaseq_record(self, record_id, desc, key_values, ref_seq, prots_fn):
+        """
+        Write the ORFs of a record of dnaseq_to_proteindb
+        :param record_id: record ID
+        :param desc: fasta header
+        :param key_values: key/values of the header, see dnaseq_header_values
+        :param ref_seq: DNA sequence (bytes, str or Seq)
+        :param prots_fn: output file
+        """
+        ref_seq = TranslationTable.as_bytes(ref_seq)
+
+        # translate the whole sequences (3 ORFs) for non CDS sequences and not take alt_ORFs for CDSs
+        if 'CDS' not in key_values.keys() or ('CDS' in key_values.keys() and
+                                              ('altORFs' in self._include_biotypes or
+                                               self._include_biotypes == ['all'])):
+            if self._find_orfs:
+                self.write_found_orfs(self._header_var_prefix + record_id, desc, ref_seq, prots_fn)
+            else:
+                ref_orfs = self.get_orfs_dna(ref_seq, self._translation_table, self._num_orfs,
+                                             self._num_orfs_complement, to_stop=False)
+                self.write_output(seq_id=self._header_var_prefix +
+                                  record_id, desc=desc, seqs=ref_orfs, prots_fn=prots_fn)
 
-        return self._proteindb_output
+        # also allow for direct translation of the CDS, when the cds info exists in the fasta header skip_including_all_cds is false
+        if 'CDS' in key_values.keys() and not self._skip_including_all_cds:
+            try:
+                cds_info = [int(x)
+                            for x in key_values['CDS'].split('-')]
+                ref_seq = ref_seq[cds_info[0] - 1:cds_info[1]]
+                ref_orfs = self.get_orfs_dna(
+                    ref_seq, self._translation_table, 1, 0, to_stop=True)
+                self.write_output(
+                    seq_id=record_id, desc=desc, seqs=ref_orfs, prots_fn=prots_fn)
+            except (ValueError, IndexError, KeyError):
+                print(
+                    "Could not extra cds position from fasta header for: ", record_id, desc)
+
+    def write_found_orfs(self, seq_id, desc, ref_seq, prots_fn):
+        """
+        Write the ORFs (start to stop codon) of at least min_orf_length amino acids found in the num_orfs frames
+        of a sequence and the num_orfs_complement frames of its reverse complement, see translation.find_orfs.
+        The position of the ORF in the sequence (1-based, stop codon included) and its strand are added to the
+        header: >seq_id_ORF1 desc ORF=start-end:+
+        :param seq_id: Sequence Accession
+        :param desc: Sequence Description
+        :param ref_seq: DNA sequence (bytes or Seq)
+        :param prots_fn: output file
+        """
+        orfs = [(start + 1, end, '+', protein) for start, end, protein in
+                find_orfs(ref_seq, self._translation_table, range(self._num_orfs), self._min_orf_length)]
+        if self._num_orfs_complement:
+            seq_length = len(ref_seq)
+            if isinstance(ref_seq, bytes):
+                reverse_seq = reverse_complement_bytes(ref_seq)
+            else:
+                reverse_seq = ref_seq.reverse_complement()
+            orfs += [(seq_length - end + 1, seq_length - start, '-', protein) for start, end, protein in
+                     find_orfs(reverse_seq, self._translation_table,
+                               range(self._num_orfs_complement), self._min_orf_length)]
+        for i, (start, end, strand, protein) in enumerate(orfs):
+            prots_fn.write('>{}_ORF{} {} ORF={}-{}:{}\n{}\n'.format(seq_id, i + 1, desc, start, end, strand, protein))
+
+    def dnaseq_records_text(self, records):
+        """
+        ORFs of a chunk of records of dnaseq_to_proteindb as fasta text, see write_dnaseq_record
+        """
+        prots_fn = io.StringIO()
+        for record_id, desc, key_values, ref_seq in records:
+            self.write_dnaseq_record(record_id, desc, key_values, ref_seq, prots_fn)
+        return prots_fn.getvalue()
 
     @staticmethod
     def get_key(fasta_header):
@@ -467,54 +891,20 @@ class EnsemblDataService(ParameterConfiguration):
                     annotation_str='transcriptOverlaps'):
         """
         intersect vcf and a gtf, add ID of the overlapping transcript to the vcf INFO field
+        and write the annotated vcf (<vcf name>_annotated.vcf in the working directory).
+        vcf_to_proteindb annotates the records while reading the vcf instead, see TranscriptIntervalIndex.
         """
         annotated_vcf = os.path.abspath(
             vcf_file.split('/')[-1].replace('.vcf', ''))
 
-        BedTool(gtf_file).intersect(BedTool(vcf_file),
-                                    wo=True).saveas(annotated_vcf+'_all.bed')
-
-        muts_dict = {}
-        with open(annotated_vcf+'_all.bed', 'r') as an:
-            for line in an.readlines():
-                sl = line.strip().split('\t')
-                if sl[record_type_index].strip() != 'CDS':
-                    continue
-                transcript_id = 'NO_OVERLAP'
-
-                gene_info = sl[gene_info_index].split(gene_info_sep)
-                for info in gene_info:  # extract transcript id from the gtf info column
-                    if info.strip().startswith(transcript_str):
-                        transcript_id = info.strip().split(
-                            transcript_info_sep)[1].strip('"')
-                        continue
-
-                if transcript_id == 'NO_OVERLAP':
-                    continue
-
-                # write the mutation line as a key and set the overlapping transcriptID as its value(s)
-                try:
-                    muts_dict['\t'.join(sl[gene_info_index+1:-1])
-                              ].append(transcript_id)
-                except KeyError:
-                    muts_dict['\t'.join(
-                        sl[gene_info_index+1:-1])] = [transcript_id]
-
-        with open(annotated_vcf+'_annotated.vcf', 'w') as ann, open(vcf_file, 'r') as v:
-            # write vcf headers to the output file
-            for line in v.readlines():
-                if line.startswith('#'):
-                    ann.write(line)
-                else:
-                    # write the mutations and their overlapping transcript to output file
-                    try:
-                        sl = line.strip().split('\t')
-                        sl[vcf_info_field_index] = '{};{}={}'.format(
-                            sl[vcf_info_field_index].strip(), annotation_str,
-                            ','.join(set(muts_dict[line.strip()])))
-                        ann.write('\t'.join(sl) + '\n')
-                    except KeyError:
-                        ann.write(line)
+        interval_index = TranscriptIntervalIndex.from_gtf(gtf_file, record_type_index=record_type_index,
+                                                          gene_info_index=gene_info_index,
+                                                          gene_info_sep=gene_info_sep,
+                                                          transcript_str=transcript_str,
+                                                          transcript_info_sep=transcript_info_sep)
+        with open(annotated_vcf+'_annotated.vcf', 'w') as ann, open_vcf(vcf_file) as v:
+            ann.writelines(interval_index.annotate_vcf_lines(v, vcf_info_field_index=vcf_info_field_index,
+                                                             annotation_str=annotation_str))
 
         return annotated_vcf+'_annotated.vcf'
 
@@ -526,18 +916,330 @@ class EnsemblDataService(ParameterConfiguration):
         exons for non-protein coding genes)
         In case of not annotated variants, it considers all variants overlapping
         transcripts from the selected biotypes.
+        When more than one worker is configured the VCF is split into shards of consecutive records
+        (see split_vcf) that are processed in parallel and merged back in input order, so the
+        output is identical to a serial run.
         :param vcf_file:
         :param input_fasta:
         :param gene_annotations_gtf:
+        :param gene_annotations_db:
         :return:
         """
 
+        # not annotated variants are annotated with the overlapping transcripts while reading the vcf
+        interval_index = None
         if not self._annotation_field_name and gene_annotations_gtf:
-            vcf_file = self.annoate_vcf(vcf_file, gene_annotations_gtf)
+            interval_index = self.get_interval_index(gene_annotations_gtf)
             self._annotation_field_name = 'transcriptOverlaps'
             self._transcript_index = 0
             self._consequence_index = None
 
+        db = self.get_featuredb(gene_annotations_gtf, gene_annotations_db)
+
+        # load all transcripts once, no more queries to the FeatureDB are done per variant
+        transcript_model = self.get_transcript_model(db, gene_annotations_db or gene_annotations_gtf)
+        print("Transcript model: {} transcripts, {} features, {:.1f} MB".format(
+            len(transcript_model), transcript_model.num_features(), transcript_model.memory_usage() / 1024 ** 2))
+
+        # only the records overlapping the regions/genes are read, using the tabix index of the vcf if present
+        regions = self.get_vcf_regions(db)
+        if regions is not None:
+            self.get_logger().debug("Translating the variants of {} regions".format(len(regions)))
+
+        if self._workers > 1:
+            self._vcf_to_proteindb_sharded(vcf_file, input_fasta, transcript_model, interval_index, regions)
+        else:
+            with open(self._proteindb_output, 'w') as prots_fn:
+                self.vcf_shard_to_proteindb(vcf_file, input_fasta, transcript_model, prots_fn, interval_index,
+                                            regions)
+
+        return self._proteindb_output
+
+    def get_featuredb(self, gene_annotations_gtf, gene_annotations_db=None):
+        """
+        FeatureDB of the gene annotations: the given database, the database cached for the GTF file when a
+        cache folder is configured, or otherwise the database written next to the GTF file
+        :param gene_annotations_gtf: GTF file
+        :param gene_annotations_db: FeatureDB of the GTF file, if already built
+        :return: gffutils FeatureDB
+        """
+        if gene_annotations_db:
+            return gffutils.FeatureDB(gene_annotations_db)
+        if self._cache is None:
+            return self.parse_gtf(gene_annotations_gtf, gene_annotations_gtf.replace('.gtf', '.db'))
+        db_file = self._cache.get('featuredb', [gene_annotations_gtf],
+                                  lambda db_file: create_featuredb(gene_annotations_gtf, db_file),
+                                  'annotations.db', validate=is_featuredb)
+        return gffutils.FeatureDB(db_file)
+
+    def get_transcript_model(self, db, annotations_file):
+        """
+        TranscriptModel of a FeatureDB, reused from the cache when a cache folder is configured
+        :param db: gffutils FeatureDB
+        :param annotations_file: GTF or database file the FeatureDB was built from, the key of the cached model
+        :return: TranscriptModel
+        """
+        if self._cache is None:
+            return TranscriptModel.from_db(db)
+        return self._cache.get_object('transcript_model', [annotations_file], lambda: TranscriptModel.from_db(db))
+
+    def get_interval_index(self, gene_annotations_gtf):
+        """
+        TranscriptIntervalIndex of the CDSs of a GTF file, reused from the cache when a cache folder is configured
+        :param gene_annotations_gtf: GTF file
+        :return: TranscriptIntervalIndex
+        """
+        if self._cache is None:
+            return TranscriptIntervalIndex.from_gtf(gene_annotations_gtf)
+        return self._cache.get_object('interval_index', [gene_annotations_gtf],
+                                      lambda: TranscriptIntervalIndex.from_gtf(gene_annotations_gtf),
+                                      params={'feature_type': 'CDS'})
+
+    def fasta_index_file(self, input_fasta):
+        """
+        Persistent index of a fasta file (see toolbox.fasta_index), built once and reused by later runs:
+        kept in the cache folder when one is configured, in the temporary folder (or next to the fasta file with
+        index_next_to_fasta) otherwise
+        :param input_fasta: fasta file
+        :return: index file
+        """
+        index_file = self._fasta_index_files.get(input_fasta)
+        if index_file is None:
+            if self._cache is not None:
+                index_file = self._cache.get('fasta_index', [input_fasta],
+                                             lambda fasta_index: build_index(input_fasta, fasta_index), 'fasta.pgi',
+                                             validate=lambda fasta_index: index_matches(fasta_index, input_fasta))
+            else:
+                index_file = default_index_file(input_fasta, next_to_fasta=self._index_next_to_fasta)
+                if not index_matches(index_file, input_fasta):
+                    build_index(input_fasta, index_file)
+            self._fasta_index_files[input_fasta] = index_file
+        return index_file
+
+    def sequence_store_file(self, input_fasta):
+        """
+        Packed sequences of a fasta file (see toolbox.sequence_store), built once and reused by later runs:
+        kept in the cache folder when one is configured, in the temporary folder (or next to the fasta file with
+        index_next_to_fasta) otherwise
+        :param input_fasta: fasta file
+        :return: store file
+        """
+        store_file = self._sequence_store_files.get(input_fasta)
+        if store_file is None:
+            if self._cache is not None:
+                store_file = self._cache.get('sequence_store', [input_fasta],
+                                             lambda store: build_sequence_store(input_fasta, store), 'sequences.p2b',
+                                             validate=lambda store: store_matches(store, input_fasta))
+            else:
+                store_file = default_index_file(input_fasta, STORE_SUFFIX, next_to_fasta=self._index_next_to_fasta)
+                if not store_matches(store_file, input_fasta):
+                    build_sequence_store(input_fasta, store_file)
+            self._sequence_store_files[input_fasta] = store_file
+        return store_file
+
+    def get_fasta_index(self, input_fasta, by_key=False):
+        """
+        Records of a fasta file by ID, or by transcript ID (see get_key) with by_key. With packed_sequences
+        the sequences are read from the memory-mapped packed store of the fasta file, shared by all the processes.
+        :param input_fasta: fasta file
+        :param by_key: look up the records by transcript ID
+        :return: FastaIndex
+        """
+        sequence_store = SequenceStore(self.sequence_store_file(input_fasta)) if self._packed_sequences else None
+        return FastaIndex(input_fasta, self.fasta_index_file(input_fasta), by_key=by_key, sequence_store=sequence_store)
+
+    def genome_to_transcripts(self, genome_fasta, gene_annotations_gtf, output_fasta):
+        """
+        Write the sequences of the transcripts of a GTF file spliced from the genome, with the CDS position in
+        the header as in the cDNA files used by the other commands (see ensembl.genome_transcripts).
+        Chromosomes are processed in parallel by the configured number of workers.
+        :param genome_fasta: genome fasta file
+        :param gene_annotations_gtf: GTF file
+        :param output_fasta: output fasta file
+        :return: output fasta file
+        """
+        written, skipped = write_genome_transcripts(genome_fasta, self.fasta_index_file(genome_fasta),
+                                                    self.sequence_store_file(genome_fasta), gene_annotations_gtf,
+                                                    output_fasta, self._workers)
+        self.get_logger().debug("{} transcripts written to {}, {} transcripts without exons or chromosome "
+                                "skipped".format(written, output_fasta, skipped))
+        return output_fasta
+
+    @staticmethod
+    def split_vcf(vcf_file, shard_dir, window_size=0, interval_index=None, regions=None):
+        """
+        Split a VCF file into shards of consecutive records from the same chromosome. When window_size
+        is given, dense chromosomes are split further into fixed genomic windows of window_size bp.
+        Shards only ever hold consecutive records, so concatenating their results in order gives
+        back the order of the input file. Each shard keeps the full VCF header.
+        :param vcf_file: input VCF file
+        :param shard_dir: folder where the shards are written
+        :param window_size: size of the genomic windows, 0 to split by chromosome only
+        :param interval_index: TranscriptIntervalIndex used to annotate the records written to the shards
+        :param regions: only write the records overlapping these (chrom, start, end) regions
+        :return: list of shard files in input order
+        """
+        header = []
+        shards = []
+        shard_key = None
+        shard_handle = None
+        with open_vcf(vcf_file, regions) as vcf_handle:
+            lines = vcf_handle if interval_index is None else interval_index.annotate_vcf_lines(vcf_handle)
+            for line in lines:
+                if line.startswith('#'):
+                    header.append(line)
+                    continue
+                fields = line.split('\t', 2)
+                key = fields[0]
+                if window_size:
+                    try:
+                        key = (fields[0], int(fields[1]) // window_size)
+                    except (ValueError, IndexError):
+                        pass
+                if shard_handle is None or key != shard_key:
+                    if shard_handle is not None:
+                        shard_handle.close()
+                    shard_key = key
+                    shards.append(os.path.join(shard_dir, 'shard_{:06d}.vcf'.format(len(shards))))
+                    shard_handle = open(shards[-1], 'w')
+                    shard_handle.writelines(header)
+                shard_handle.write(line)
+        if shard_handle is not None:
+            shard_handle.close()
+        return shards
+
+    def _vcf_to_proteindb_sharded(self, vcf_file, input_fasta, transcript_model, interval_index=None,
+                                  regions=None):
+        """
+        Run vcf_to_proteindb over the shards of the VCF in a pool of worker processes
+        and merge the results of the shards in input order.
+        """
+        shard_dir = tempfile.mkdtemp(prefix='vcf_shards_',
+                                     dir=os.path.dirname(os.path.abspath(self._proteindb_output)))
+        try:
+            shards = self.split_vcf(vcf_file, shard_dir, self._shard_window, interval_index, regions)
+            # the index and packed sequences of the transcripts fasta are built once, before the workers use them
+            self.fasta_index_file(input_fasta)
+            if self._packed_sequences:
+                self.sequence_store_file(input_fasta)
+            self.get_logger().debug("VCF file {} split into {} shards".format(vcf_file, len(shards)))
+            with Pool(self._workers, _init_shard_worker, (self, transcript_model)) as pool:
+                shard_outputs = pool.starmap(_translate_vcf_shard, zip(shards, repeat(input_fasta)))
+            with open(self._proteindb_output, 'w') as prots_fn:
+                for shard_output in shard_outputs:
+                    with open(shard_output, 'r') as shard_fn:
+                        shutil.copyfileobj(shard_fn, prots_fn)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+    def vcf_shard_to_proteindb_file(self, vcf_file, input_fasta, transcript_model):
+        """
+        Translate one VCF shard into a proteindb file written next to the shard
+        :return: path of the shard proteindb
+        """
+        shard_output = os.path.splitext(vcf_file)[0] + '.fa'
+        with open(shard_output, 'w') as prots_fn:
+            self.vcf_shard_to_proteindb(vcf_file, input_fasta, transcript_model, prots_fn)
+        return shard_output
+
+    def get_transcript_context(self, transcript_id, transcripts_dict, transcript_model):
+        """
+        Collect the sequence, CDS positions and features of a transcript
+        :param transcript_id: transcript ID (with version if present in the fasta)
+        :param transcripts_dict: index of the transcripts fasta
+        :param transcript_model: TranscriptModel of the gene annotations
+        :return: TranscriptContext, raises KeyError if the transcript is not in the fasta
+        """
+        row = transcripts_dict[transcript_id]
+        ref_seq = row.seq  # get the seq and desc for the transcript from the fasta of the gtf
+        desc = str(row.description)
+
+        feature_types = ['exon']
+        # check if cds info exists in the fasta header otherwise translate all exons
+        cds_info = []
+        num_orfs = 3
+        if 'CDS=' in desc:
+            try:
+                cds_info = [int(x) for x in desc.split(' ')[
+                    1].split('=')[1].split('-')]
+                feature_types = ['CDS', 'stop_codon']
+                num_orfs = 1
+            except (ValueError, IndexError):
+                msg = "Could not extra cds position from fasta header for: {}".format(
+                    desc)
+                self.get_logger().debug(msg)
+
+        chrom, strand, features_info = transcript_model.get_features(transcript_id, feature_types)
+        return TranscriptContext(transcript_id, ref_seq, desc, cds_info, feature_types, num_orfs, chrom, strand,
+                                 features_info)
+
+    def get_annotation_indexes(self, infos):
+        """
+        Positions of the transcript ID, the consequence and the biotype in the annotation field. The indexes
+        set to 'auto' are looked up in the Format of the annotation field header (VEP CSQ header), e.g.
+        ##INFO=<ID=CSQ,...,Description="... Format: Allele|Consequence|...|Feature|BIOTYPE|...">
+        :param infos: INFO definitions of the VCF header
+        :return: transcript_index, consequence_index, biotype_index (None if not used)
+        """
+        info = infos.get(self._annotation_field_name)
+        field_names = parse_annotation_format(info.desc) if info is not None else None
+        indexes = []
+        for index, field_name, default in [(self._transcript_index, 'Feature', 3),
+                                           (self._consequence_index, 'Consequence', 1),
+                                           (self._biotype_index, 'BIOTYPE', None)]:
+            if index == self.AUTO_INDEX:
+                if field_names is not None and field_name in field_names:
+                    index = field_names.index(field_name)
+                else:
+                    index = default
+                    self.get_logger().warning(
+                        "{} not found in the header of the {} field, using index {}".format(
+                            field_name, self._annotation_field_name, index))
+            indexes.append(index)
+        return indexes
+
+    def get_annotation_filter(self, consequence_index, biotype_index):
+        """
+        Compile the consequence and biotype filters into a single predicate over a split annotation
+        (list of fields), it returns False for annotations that have to be skipped.
+        :param consequence_index: position of the consequence, None to keep all consequences
+        :param biotype_index: position of the biotype, None to keep all biotypes
+        :return: predicate
+        """
+        checks = []
+        for index, include, exclude in [(consequence_index, self._include_consequences, self._exclude_consequences),
+                                        (biotype_index, self._include_biotypes, self._exclude_biotypes)]:
+            if index is None:
+                continue
+            include = None if include == ['all'] else frozenset(include)
+            checks.append((index, include, frozenset(exclude)))
+
+        def accept(transcript_info):
+            try:
+                for index, include, exclude in checks:
+                    value = transcript_info[index]
+                    if value in exclude or (include is not None and value not in include):
+                        return False
+            except IndexError:
+                return False
+            return True
+
+        return accept
+
+    def vcf_shard_to_proteindb(self, vcf_file, input_fasta, transcript_model, prots_fn, interval_index=None,
+                               regions=None):
+        """
+        Translate the variants of a VCF file and write the proteins to prots_fn. The transcripts
+        index is opened here, so each worker process has its own.
+        :param vcf_file: VCF (or VCF shard) file
+        :param input_fasta: transcripts fasta file
+        :param transcript_model: TranscriptModel of the gene annotations
+        :param prots_fn: output handle
+        :param interval_index: TranscriptIntervalIndex to annotate the records with the overlapping transcripts
+        :param regions: only translate the records overlapping these (chrom, start, end) regions
+        :return:
+        """
+
         if self.VERBOUS_DEBUG in self.get_pipeline_parameters():
             verbous = self.get_pipeline_parameters()[self.VERBOUS_DEBUG]
         else:
@@ -546,21 +1248,21 @@ class EnsemblDataService(ParameterConfiguration):
         if (verbous):
             print("Verbous debug output.")
 
-        if gene_annotations_db:
-            db = gffutils.FeatureDB(gene_annotations_db)
-        else:
-            db = self.parse_gtf(gene_annotations_gtf,
-                                gene_annotations_gtf.replace('.gtf', '.db'))
-        # print("This is a modified function for processing the VCF file.")
-
-        transcripts_dict = SeqIO.index(
-            input_fasta, "fasta", key_function=self.get_key)
-        # handle cases where the transcript has version in the GTF but not in the VCF
-        transcript_id_mapping = {
-            k.split('.')[0]: k for k in transcripts_dict.keys()}
-        with open(self._proteindb_output, 'w') as prots_fn:
-            vcf_reader = vcf.Reader(open(vcf_file, 'r'))
-
+        transcripts_dict = self.get_fasta_index(input_fasta, by_key=True)
+        contexts = TranscriptContextCache(
+            lambda transcript_id: self.get_transcript_context(transcript_id, transcripts_dict, transcript_model),
+            self._transcript_cache_size)
+        with open_vcf(vcf_file, regions) as vcf_handle:
+            lines = vcf_handle if interval_index is None else interval_index.annotate_vcf_lines(vcf_handle)
+            if self._vcf_reader == 'pyvcf':
+                vcf_reader = vcf.Reader(lines, compressed=False)
+            else:
+                vcf_reader = VcfReader(lines)
+            transcript_index, consequence_index, biotype_index = self.get_annotation_indexes(vcf_reader.infos)
+            # only split the annotation up to the last field used
+            indexes = [index for index in (transcript_index, consequence_index, biotype_index) if index is not None]
+            max_split = max(indexes) + 1 if min(indexes) >= 0 else -1
+            accept_annotation = self.get_annotation_filter(consequence_index, biotype_index)
             for record in vcf_reader:
                 # msg = "Processing: {}".format(record)
                 # print(msg)
@@ -618,9 +1320,9 @@ class EnsemblDataService(ParameterConfiguration):
                     continue
 
                 for transcript_record in transcript_records:
-                    transcript_info = transcript_record.split('|')
+                    transcript_info = transcript_record.split('|', max_split)
                     try:
-                        consequence = transcript_info[self._consequence_index]
+                        consequence = transcript_info[consequence_index]
                         consequences.append(consequence)
                     except IndexError:
                         if (verbous):
@@ -631,8 +1333,16 @@ class EnsemblDataService(ParameterConfiguration):
                     except TypeError:
                         pass
 
+                    # skip transcripts with unwanted consequences or biotypes before looking them up
+                    if not accept_annotation(transcript_info):
+                        if (verbous):
+                            msg = "Transcript with unwanted consequences, skipping: {}".format(
+                                record)
+                            self.get_logger().debug(msg)
+                        continue
+
                     try:
-                        transcript_id = transcript_info[self._transcript_index]
+                        transcript_id = transcript_info[transcript_index]
                     except IndexError:
                         if (verbous):
                             msg = "Give a valid index for the Transcript ID in the INFO field for: {}".format(
@@ -646,9 +1356,9 @@ class EnsemblDataService(ParameterConfiguration):
                             self.get_logger().debug(msg)
                         continue
 
-                    try:
-                        transcript_id_v = transcript_id_mapping[transcript_id]
-                    except KeyError:
+                    # handle cases where the transcript has version in the GTF but not in the VCF
+                    transcript_id_v = transcripts_dict.versioned_key(transcript_id)
+                    if transcript_id_v is None:
                         if (verbous):
                             msg = "KeyError (Transcript ID key not found): {}".format(
                                 record)
@@ -656,9 +1366,7 @@ class EnsemblDataService(ParameterConfiguration):
                         transcript_id_v = transcript_id
 
                     try:
-                        row = transcripts_dict[transcript_id_v]
-                        ref_seq = row.seq  # get the seq and desc for the transcript from the fasta of the gtf
-                        desc = str(row.description)
+                        context = contexts.get(transcript_id_v, trans_table)
                     except KeyError:
                         if (verbous):
                             msg = "Transcript {} not found in fasta of the GTF file {}".format(
@@ -666,40 +1374,11 @@ class EnsemblDataService(ParameterConfiguration):
                             self.get_logger().debug(msg)
                         continue
 
-                    feature_types = ['exon']
-                    # check if cds info exists in the fasta header otherwise translate all exons
-                    cds_info = []
-                    num_orfs = 3
-                    if 'CDS=' in desc:
-                        try:
-                            cds_info = [int(x) for x in desc.split(' ')[
-                                1].split('=')[1].split('-')]
-                            feature_types = ['CDS', 'stop_codon']
-                            num_orfs = 1
-                        except (ValueError, IndexError):
-                            msg = "Could not extra cds position from fasta header for: {}".format(
-                                desc)
-                            self.get_logger().debug(msg)
-
-                    chrom, strand, features_info = self.get_features(db, transcript_id_v,
-                                                                     self._biotype_str,
-                                                                     feature_types)
-                    if chrom is None:  # the record info was not found
+                    if context.chrom is None:  # the record info was not found
                         msg = "Chrom. info not found, skipping: {}".format(
                             record)
                         self.get_logger().debug(msg)
                         continue
-                    # skip transcripts with unwanted consequences
-                    if self._consequence_index is not None:
-                        if (consequence in self._exclude_consequences or
-                            (consequence not in self._include_consequences and
-                             self._include_consequences != ['all'])):
-
-                            if (verbous):
-                                msg = "Transcript with unwanted consequences, skipping: {}".format(
-                                    record)
-                                self.get_logger().debug(msg)
-                            continue
 
                     for alt in record.ALT:  # in cases of multiple alternative alleles consider all
                         if alt is None:
@@ -723,7 +1402,7 @@ class EnsemblDataService(ParameterConfiguration):
 
                         try:
                             overlap_flag = self.check_overlap(
-                                record.POS, record.POS + len(alt), features_info)
+                                record.POS, record.POS + len(alt), coordinates=context.coordinates)
                         except TypeError:
                             if (verbous):
                                 msg = "Wrong VCF record in {}".format(record)
@@ -733,20 +1412,24 @@ class EnsemblDataService(ParameterConfiguration):
                         #msg = "Passed tests: {}".format(record)
                         # self.get_logger().debug(msg)
 
-                        if (chrom.lstrip("chr") == str(record.CHROM).lstrip("chr") and
+                        if (context.chrom.lstrip("chr") == str(record.CHROM).lstrip("chr") and
                                 overlap_flag):
-                            coding_ref_seq, coding_alt_seq = self.get_altseq(ref_seq, Seq(str(record.REF)),
-                                                                             Seq(str(alt)), int(
-                                                                                 record.POS), strand,
-                                                                             features_info, cds_info)
+                            coding_ref_seq, coding_alt_seq, alt_offsets = self.get_altseq(
+                                context.seq, Seq(str(record.REF)), Seq(str(alt)), int(record.POS), context.strand,
+                                context.features, context.cds_info, with_offsets=True,
+                                coordinates=context.coordinates)
                             #msg = "Coding ref seq: {}".format(coding_ref_seq)
                             # self.get_logger().debug(msg)
                             #msg = "Coding alt seq: {}".format(coding_alt_seq)
                             # self.get_logger().debug(msg)
 
                             if coding_alt_seq != "":
+                                # the coding reference only depends on the transcript, it is translated once
                                 ref_orfs, alt_orfs = self.get_orfs_vcf(coding_ref_seq, coding_alt_seq, trans_table,
-                                                                       num_orfs)
+                                                                       context.num_orfs, ref_orfs=context.ref_orfs,
+                                                                       alt_offsets=alt_offsets)
+                                context.coding_ref_seq = coding_ref_seq
+                                context.ref_orfs = ref_orfs
                                 record_id = ""
                                 if record.ID:
                                     record_id = '_' + str(record.ID)
@@ -757,7 +1440,7 @@ class EnsemblDataService(ParameterConfiguration):
                                 self.write_output(seq_id='_'.join([self._header_var_prefix + str(record_id),
                                                                    '.'.join([str(record.CHROM), str(record.POS),
                                                                              str(record.REF), str(alt)]),
-                                                                   transcript_id_v]),
+                                                                   context.transcript_id]),
                                                   desc='',
                                                   seqs=alt_orfs,
                                                   prots_fn=prots_fn,
@@ -767,90 +1450,140 @@ class EnsemblDataService(ParameterConfiguration):
                                 # self.get_logger().debug(msg)
 
                                 if self._report_reference_seq:
-                                    self.write_output(seq_id=transcript_id_v,
+                                    self.write_output(seq_id=context.transcript_id,
                                                       desc='',
                                                       seqs=ref_orfs,
                                                       prots_fn=prots_fn)
 
-        return self._proteindb_output
+        transcripts_dict.close()
+        self.get_logger().debug("Transcript cache of {}: {} hits, {} misses".format(
+            vcf_file, contexts.hits, contexts.misses))
+
+    def check_proteindb(self, input_fasta: str = None, add_stop_codon: bool = False, num_aa: int = 6,
+                        summary_file: str = None):
+        """
+        Check a protein database for proteins without Met, with premature stop codons or gaps and short proteins,
+        and write the proteins that pass. The database is read in chunks checked by the configured number of
+        workers, the proteins are written in input order and only the counts are kept.
+        :param input_fasta: protein database
+        :param add_stop_codon: write every part of the proteins with stop codons as a protein
+        :param num_aa: minimum number of amino acids of the proteins written (exclusive)
+        :param summary_file: json file the counts are written to
+        :return: counts, see check_protein_records
+        """
+        summary = dict.fromkeys(self.CHECK_COUNTS, 0)
+        with open(input_fasta, 'r') as input_handle, \
+                open(self._proteindb_output, 'w', buffering=self.OUTPUT_BUFFER_SIZE) as output_handle:
+            chunks = self._protein_chunks(input_handle)
+            if self._workers <= 1:
+                results = (self.check_protein_records(chunk, add_stop_codon, num_aa) for chunk in chunks)
+                for text, counts in results:
+                    output_handle.write(text)
+                    for key in summary:
+                        summary[key] += counts[key]
+            else:
+                # only a few chunks are read ahead of the ones being written
+                with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                    pending = deque()
+                    for chunk in chunks:
+                        pending.append(executor.submit(self.check_protein_records, chunk, add_stop_codon, num_aa))
+                        while pending and (len(pending) > 2 * self._workers or pending[0].done()):
+                            text, counts = pending.popleft().result()
+                            output_handle.write(text)
+                            for key in summary:
+                                summary[key] += counts[key]
+                    while pending:
+                        text, counts = pending.popleft().result()
+                        output_handle.write(text)
+                        for key in summary:
+                            summary[key] += counts[key]
+
+        print("   translations that do not start with Met:", summary['no_met'])
+        print("   translations that have premature stop codons:", summary['premature_stops'])
+        print("   translations that contain gaps:", summary['gaps'])
+        print("   total number of input sequences was:", summary['input_sequences'])
+        print("   total number of sequences written was:", summary['written_sequences'])
+        print("   total number of proteins less than {} aminoacids: {}".format(
+            num_aa, summary['short_sequences']))
+        if summary_file:
+            with open(summary_file, 'w') as summary_handle:
+                json.dump(dict(summary, input_fasta=input_fasta, output_fasta=self._proteindb_output,
+                               num_aa=num_aa, add_stop_codon=add_stop_codon), summary_handle, indent=2)
+        return summary
+
+    def _protein_chunks(self, input_handle):
+        """
+        (title, sequence) of the records of a protein fasta file, in chunks of about TRANSLATION_CHUNK_SIZE
+        amino acids
+        """
+        chunk = []
+        chunk_size = 0
+        for title, seq in SimpleFastaParser(input_handle):
+            chunk.append((title, seq))
+            chunk_size += len(seq)
+            if chunk_size >= self.TRANSLATION_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            yield chunk
 
     @staticmethod
-    def add_protein_to_map(seq: str, new_desc_string: str, protein_id: str, proteins, output_handle):
-        protein = {'description': new_desc_string,
-                   'sequence': seq, 'accession': protein_id}
-        proteins.append(protein)
-        output_handle.write(">{}\t{}\n{}\n".format(
-            protein_id, new_desc_string, seq))
-        return proteins
-
-    def check_proteindb(self, input_fasta: str = None, add_stop_codon: bool = False, num_aa: int = 6):
-
-        input_handle = open(input_fasta, 'r')
-        output_handle = open(self._proteindb_output, 'w')
-        proteins = []
-        pcount = 0
-        stop_count = 0
-        gap_count = 0
-        no_met = 0
-        less = 0
-
-        for record in SeqIO.parse(input_handle, 'fasta'):
-
-            seq = str(record.seq)
-            pcount += 1
+    def check_protein_records(records, add_stop_codon=False, num_aa=6):
+        """
+        Check a chunk of proteins, see check_proteindb
+        :param records: list of (title, sequence)
+        :param add_stop_codon: write every part of the proteins with stop codons as a protein
+        :param num_aa: minimum number of amino acids of the proteins written (exclusive)
+        :return: fasta text of the proteins written, counts (CHECK_COUNTS)
+        """
+        lines = []
+        counts = dict.fromkeys(EnsemblDataService.CHECK_COUNTS, 0)
+        for title, seq in records:
+            words = title.split(None, 1)
+            record_id = words[0] if words else ''
+            counts['input_sequences'] += 1
 
             # parse the description string into a dictionary
-            new_desc_string = record.description
+            new_desc_string = title
             new_desc_string = new_desc_string[new_desc_string.find(' ') + 1:]
             # test for odd amino acids, stop codons, gaps
             if not seq.startswith('M'):
-                no_met += 1
+                counts['no_met'] += 1
             if seq.endswith('*'):
                 seq = seq[:-1]
             if '-' in seq:
-                gap_count += 1
+                counts['gaps'] += 1
                 new_desc_string = new_desc_string + ' (Contains gaps)'
             if '*' in seq:
-                stop_count += 1
+                counts['premature_stops'] += 1
                 if add_stop_codon:
                     seq_list = seq.split("*")
                     codon_index = 1
                     for codon in seq_list:
                         codon_description = new_desc_string + \
                             ' codon ' + str(codon_index)
-                        protein_id = record.id + '_codon_' + str(codon_index)
+                        protein_id = record_id + '_codon_' + str(codon_index)
                         seq = codon
                         if len(seq) > num_aa:
-                            proteins = self.add_protein_to_map(
-                                seq, codon_description, protein_id, proteins, output_handle)
+                            lines.append(">{}\t{}\n{}\n".format(protein_id, codon_description, seq))
                         codon_index = codon_index + 1
                 else:
                     cut = seq.index('*')
                     string = ' (Premature stop %s/%s)' % (cut, len(seq))
                     new_desc_string = new_desc_string + string
                     seq = seq[:cut]
-                    # save the protein in list
                     if len(seq) > num_aa:
-                        protein_id = record.id
-                        proteins = self.add_protein_to_map(
-                            seq, new_desc_string, protein_id, proteins, output_handle)
+                        lines.append(">{}\t{}\n{}\n".format(record_id, new_desc_string, seq))
                     else:
-                        less += 1
+                        counts['short_sequences'] += 1
             else:
                 if len(seq) > num_aa:
-                    protein_id = record.id
-                    proteins = self.add_protein_to_map(
-                        seq, new_desc_string, protein_id, proteins, output_handle)
+                    lines.append(">{}\t{}\n{}\n".format(record_id, new_desc_string, seq))
                 else:
-                    less += 1
-
-        print("   translations that do not start with Met:", no_met)
-        print("   translations that have premature stop codons:", stop_count)
-        print("   translations that contain gaps:", gap_count)
-        print("   total number of input sequences was:", pcount)
-        print("   total number of sequences written was:", len(proteins))
-        print("   total number of proteins less than {} aminoacids: {}".format(
-            num_aa, less))
+                    counts['short_sequences'] += 1
+        counts['written_sequences'] = len(lines)
+        return ''.join(lines), counts
 
     @staticmethod
     def write_output(seq_id, desc, seqs, prots_fn, seqs_filter=None):
@@ -0,0 +1,361 @@
+"""
+This module builds gffutils FeatureDB files from GTF files. The GTF is streamed once and written with bulk inserts
+in large transactions, the secondary indexes are only created at the end. The database is the same as the one
+written by gffutils.create_db(gtf, db, merge_strategy="create_unique", disable_infer_transcripts=True,
+disable_infer_genes=True): same tables, IDs, attributes and relations, so it can be opened with gffutils.FeatureDB.
+The equivalence has only been validated for the gffutils versions in VALIDATED_GFFUTILS_VERSIONS, the other versions
+fall back to gffutils.create_db.
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict, defaultdict
+
+import gffutils
+from gffutils import bins, constants, iterators, version
+
+GENE_KEY = 'gene_id'
+TRANSCRIPT_KEY = 'transcript_id'
+ID_SPEC = {'gene': GENE_KEY, 'transcript': TRANSCRIPT_KEY}
+
+# the pragmas used while loading, the database is only usable once fully written
+BULK_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "OFF",
+    "main.page_size": 4096,
+    "main.cache_size": -262144,
+}
+
+INSERT_RELATION = "INSERT OR IGNORE INTO relations (parent, child, level) VALUES (?, ?, ?)"
+
+FEATURE_TABLES = ('features', 'relations', 'meta', 'directives', 'autoincrements', 'duplicates')
+
+# gffutils versions (major.minor) whose create_db gives the same database as create_featuredb
+VALIDATED_GFFUTILS_VERSIONS = ('0.10', '0.14')
+# gffutils versions that parse the attributes with the rules of gffutils 0.10, see _attributes_parser
+LEGACY_ATTRIBUTES_VERSIONS = ('0.10',)
+
+# copies of gffutils.GFF_KEYS and gffutils.INSERT_FEATURE
+GFF_KEYS = ('seqid', 'source', 'featuretype', 'start', 'end', 'score', 'strand', 'frame', 'attributes')
+INSERT_FEATURE = ("INSERT INTO features (id, seqid, source, featuretype, start, end, score, strand, frame, attributes, "
+                  "extra, bin) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)")
+
+# attribute separators that are not inside double quotes, as gffutils.parser.quoted_semicolon_patterns
+QUOTED_SEMICOLON_PATTERNS = {separator: re.compile(re.escape(separator) + r'(?=(?:[^"]|"[^"]*")*$)')
+                             for separator in (' ; ', '; ', ';')}
+
+
+def _major_minor(gffutils_version):
+    return '.'.join(gffutils_version.split('.')[:2])
+
+
+def is_validated_gffutils(gffutils_version=version.version):
+    """
+    Check that create_featuredb has been validated against a gffutils version
+    :param gffutils_version: gffutils version
+    :return: True if create_featuredb gives the same database as gffutils.create_db
+    """
+    return _major_minor(gffutils_version) in VALIDATED_GFFUTILS_VERSIONS
+
+
+def _open_gtf(gtf_file):
+    if gtf_file.endswith('.gz'):
+        return gzip.open(gtf_file, 'rt')
+    return open(gtf_file, 'r')
+
+
+def _gtf_features(gtf_file):
+    """
+    Feature lines of a GTF file split in fields, skipping comments and directives as gffutils does
+    """
+    with _open_gtf(gtf_file) as gtf_handle:
+        for line in gtf_handle:
+            line = line.rstrip('\n\r')
+            if line == '##FASTA' or line.startswith('>'):
+                return
+            if not line or line.startswith('#'):
+                continue
+            yield line.split('\t')
+
+
+def _attributes_parser(dialect, gffutils_version=version.version):
+    """
+    Parser of the attributes column for a known dialect, gives the same attributes as
+    gffutils.parser._split_keyvals(attributes, dialect) of the gffutils version as an OrderedDict. gffutils 0.10 splits
+    the values on every comma, strips one pair of quotes and has no semicolons in quotes nor repeated keys dialects.
+    """
+    trailing_semicolon = dialect['trailing semicolon']
+    leading_semicolon = dialect['leading semicolon']
+    field_separator = dialect['field separator']
+    semicolon_pattern = (QUOTED_SEMICOLON_PATTERNS[field_separator]
+                         if dialect.get('semicolon in quotes') else None)
+    keyval_separator = dialect['keyval separator']
+    quoted_values = dialect['quoted GFF2 values']
+    repeated_keys = dialect.get('repeated keys')
+
+    def parse_legacy(keyval_str):
+        attributes = OrderedDict()
+        if not keyval_str:
+            return attributes
+        if trailing_semicolon:
+            keyval_str = keyval_str.rstrip(';')
+        for i, part in enumerate(keyval_str.split(field_separator)):
+            if i == 0 and leading_semicolon:
+                part = part[1:]
+            key, _, val = part.strip().partition(keyval_separator)
+            values = attributes.setdefault(key, [])
+            if quoted_values and val and val[0] == '"' and val[-1] == '"':
+                val = val[1:-1]
+            if val:
+                values.extend(val.split(','))
+        return attributes
+
+    def parse(keyval_str):
+        attributes = OrderedDict()
+        if not keyval_str:
+            return attributes
+        if trailing_semicolon:
+            keyval_str = keyval_str.rstrip(';')
+        if leading_semicolon:
+            keyval_str = keyval_str.lstrip(';')
+        parts = semicolon_pattern.split(keyval_str) if semicolon_pattern else keyval_str.split(field_separator)
+        for part in parts:
+            key, _, val = part.partition(keyval_separator)
+            values = attributes.setdefault(key, [])
+            if quoted_values and val:
+                val = val.strip('"')
+            if val:
+                if repeated_keys or ', ' in val:
+                    values.append(val)
+                else:
+                    values.extend(val.split(','))
+        return attributes
+
+    if _major_minor(gffutils_version) in LEGACY_ATTRIBUTES_VERSIONS:
+        return parse_legacy
+    return parse
+
+
+_jsonify = json.JSONEncoder(separators=(',', ':')).encode
+
+
+class _FeatureIds:
+    """
+    Feature IDs assigned as gffutils does for GTF files: genes and transcripts use their gene_id/transcript_id,
+    any other feature an autoincrement <featuretype>_<n> and a duplicated ID <id>_<n> (merge_strategy="create_unique").
+    Only the IDs taken from the attributes are kept, the autoincrement IDs <key>_1 ... <key>_<n> are known from the
+    counters, so the memory used does not grow with the number of exons/CDSs.
+    """
+
+    def __init__(self):
+        self.autoincrements = defaultdict(int)
+        self.named_ids = set()
+        self.skipped_ids = set()  # autoincrement IDs that were already taken, they were not used
+
+    def _autoincrement(self, key):
+        self.autoincrements[key] += 1
+        return "%s_%s" % (key, self.autoincrements[key])
+
+    def _used(self, feature_id):
+        if feature_id in self.named_ids:
+            return True
+        key, separator, number = feature_id.rpartition('_')
+        # only the ASCII digits, str.isdigit also accepts the other Unicode digits
+        return (bool(separator) and number != '' and not number.strip('0123456789') and number[0] != '0' and
+                int(number) <= self.autoincrements.get(key, 0) and feature_id not in self.skipped_ids)
+
+    def assign(self, featuretype, attributes):
+        id_key = ID_SPEC.get(featuretype)
+        feature_id = None
+        if id_key is not None:
+            values = attributes.get(id_key)
+            if values is not None and len(values) > 1:
+                raise ValueError("The ID field {} has more than one value but a single value is required for a "
+                                 "primary key in the database.".format(id_key))
+            if values:
+                feature_id = values[0]
+
+        if feature_id is None:
+            feature_id = self._autoincrement(featuretype)
+            # autoincrement IDs of different keys never collide
+            if feature_id not in self.named_ids:
+                return feature_id
+            self.skipped_ids.add(feature_id)
+        elif not self._used(feature_id):
+            self.named_ids.add(feature_id)
+            return feature_id
+
+        feature_id = self._autoincrement(feature_id)
+        if feature_id in self.named_ids:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: features.id")
+        self.named_ids.add(feature_id)
+        return feature_id
+
+
+def create_featuredb(gtf_file, db_file, force=False, batch_size=100000):
+    """
+    Write the gffutils FeatureDB of a GTF file, with gffutils.create_db if the installed gffutils version has not
+    been validated (see VALIDATED_GFFUTILS_VERSIONS)
+    :param gtf_file: GTF file (plain or gzip)
+    :param db_file: output database
+    :param force: overwrite the database if it exists
+    :param batch_size: number of rows inserted per statement
+    :return: gffutils FeatureDB
+    """
+    if os.path.exists(db_file):
+        if not force:
+            raise ValueError("Database {} already exists, use force to overwrite it".format(db_file))
+        os.unlink(db_file)
+    if not is_validated_gffutils():
+        return create_featuredb_gffutils(gtf_file, db_file)
+
+    # the dialect is inferred from the first lines, as gffutils does
+    data_iterator = iterators.DataIterator(gtf_file, checklines=10)
+    dialect = data_iterator.dialect
+    if dialect['fmt'] != 'gtf':
+        raise ValueError("{} is not a GTF file".format(gtf_file))
+    directives = list(data_iterator.directives)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.executescript(";\n".join(["PRAGMA %s=%s" % pragma for pragma in BULK_PRAGMAS.items()]))
+        conn.executescript(constants.SCHEMA)
+
+        parse_attributes = _attributes_parser(dialect)
+        feature_ids = _FeatureIds()
+        features = []
+        relations = []
+        num_features = 0
+        for fields in _gtf_features(gtf_file):
+            attributes = parse_attributes(fields[8] if len(fields) > 8 else '')
+            values = dict(zip(GFF_KEYS, fields))
+            featuretype = values.get('featuretype', '.')
+            start = values.get('start', '.')
+            start = None if start in ('.', '') else int(start)
+            end = values.get('end', '.')
+            end = None if end in ('.', '') else int(end)
+            try:
+                feature_bin = bins.bins(start, end, one=True)
+            except TypeError:
+                feature_bin = None
+
+            feature_id = feature_ids.assign(featuretype, attributes)
+            features.append((feature_id, values.get('seqid', '.'), values.get('source', '.'), featuretype, start, end,
+                             values.get('score', '.'), values.get('strand', '.'), values.get('frame', '.'),
+                             _jsonify(attributes), _jsonify(fields[9:]) if len(fields) > 9 else '[]', feature_bin))
+
+            # relations repeated in the file (transcript-gene) are only inserted once, see INSERT_RELATION
+            parent = None
+            transcript_ids = attributes.get(TRANSCRIPT_KEY)
+            if transcript_ids:
+                parent = transcript_ids[0]
+                relations.append((parent, feature_id, 1))
+            gene_ids = attributes.get(GENE_KEY)
+            if gene_ids:
+                relations.append((gene_ids[0], feature_id, 2))
+                if parent is not None:
+                    relations.append((gene_ids[0], parent, 1))
+
+            num_features += 1
+            if len(features) >= batch_size:
+                conn.executemany(INSERT_FEATURE, features)
+                conn.executemany(INSERT_RELATION, relations)
+                features = []
+                relations = []
+        if num_features == 0:
+            raise ValueError("No lines parsed -- was an empty file provided?")
+        conn.executemany(INSERT_FEATURE, features)
+        conn.executemany(INSERT_RELATION, relations)
+
+        conn.executemany("INSERT INTO directives VALUES (?)", ((directive,) for directive in directives))
+        conn.execute("INSERT INTO meta (version, dialect) VALUES (?, ?)",
+                     (version.version, _jsonify(dialect)))
+        conn.executemany("INSERT OR REPLACE INTO autoincrements VALUES (?, ?)",
+                         list(feature_ids.autoincrements.items()))
+        conn.execute("CREATE INDEX relationsparent ON relations (parent)")
+        conn.execute("CREATE INDEX relationschild ON relations (child)")
+        conn.execute("CREATE INDEX featuretype ON features (featuretype)")
+        conn.execute("CREATE INDEX seqidstartend ON features (seqid, start, end)")
+        conn.execute("CREATE INDEX seqidstartendstrand ON features (seqid, start, end, strand)")
+        conn.execute("ANALYZE features")
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.unlink(db_file)
+        raise
+    conn.close()
+    return gffutils.FeatureDB(db_file)
+
+
+def is_featuredb(db_file):
+    """
+    Check that a file is a complete FeatureDB: the meta data is only written once all the features are loaded
+    :param db_file: database
+    :return: True if the database can be used
+    """
+    if not os.path.isfile(db_file):
+        return False
+    try:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(db_file), uri=True)
+        try:
+            return (conn.execute("SELECT count(*) FROM meta").fetchone()[0] == 1 and
+                    conn.execute("SELECT 1 FROM features LIMIT 1").fetchone() is not None)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+
+def create_featuredb_gffutils(gtf_file, db_file, force=False):
+    """
+    Write the FeatureDB of a GTF file with gffutils.create_db
+    :param gtf_file: GTF file
+    :param db_file: output database
+    :param force: overwrite the database if it exists
+    :return: gffutils FeatureDB
+    """
+    return gffutils.create_db(gtf_file, db_file, merge_strategy="create_unique", keep_order=True,
+                              disable_infer_transcripts=True, disable_infer_genes=True, verbose=True, force=force)
+
+
+def featuredb_tables(db_file):
+    """
+    Content of the tables of a FeatureDB, in row order
+    :param db_file: database
+    :return: dict table -> list of rows
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        return {table: conn.execute("SELECT * FROM {} ORDER BY rowid".format(table)).fetchall()
+                for table in FEATURE_TABLES}
+    finally:
+        conn.close()
+
+
+def benchmark_featuredb(gtf_file, work_dir=None):
+    """
+    Build the FeatureDB of a GTF file with gffutils.create_db and with create_featuredb, and compare them
+    :param gtf_file: GTF file
+    :param work_dir: folder for the temporary databases
+    :return: dict with the build times (seconds) of both builders and whether the databases are equal
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='featuredb_', dir=work_dir)
+    try:
+        results = {}
+        for name, builder in (('gffutils', create_featuredb_gffutils), ('fast', create_featuredb)):
+            db_file = os.path.join(tmp_dir, name + '.db')
+            start_time = time.perf_counter()
+            builder(gtf_file, db_file)
+            results[name] = time.perf_counter() - start_time
+        gffutils_tables = featuredb_tables(os.path.join(tmp_dir, 'gffutils.db'))
+        fast_tables = featuredb_tables(os.path.join(tmp_dir, 'fast.db'))
+        results['identical'] = gffutils_tables == fast_tables
+        return results
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
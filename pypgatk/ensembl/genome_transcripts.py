@@ -0,0 +1,264 @@
+"""
+This module builds the sequences of the transcripts of a GTF file from the genome, in place of the cDNA/ncRNA
+FASTA files of a release. The GTF file is read once and its transcripts are spliced one chromosome at a time from
+the memory-mapped packed genome (see toolbox.sequence_store), chromosomes can be processed in parallel.
+Records are written as gffread -F -w does, the header holds the CDS position (including the stop codon) and the
+attributes of the transcript: >transcript_id CDS=start-end key=value ...
+"""
+
+import gzip
+import re
+from collections import deque
+from multiprocessing import Pool
+
+from Bio.Seq import reverse_complement
+
+from pypgatk.toolbox.fasta_index import FastaIndex
+from pypgatk.toolbox.sequence_store import SequenceStore
+
+# attributes of the GTF file that are not written to the header, the exon attributes are used when the GTF file
+# has no transcript lines
+HEADER_EXCLUDED_KEYS = ('gene_id', 'transcript_id', 'gene_name', 'exon_number', 'exon_id', 'exon_version')
+CODING_FEATURES = ('CDS', 'stop_codon')
+LINE_WIDTH = 70
+
+_ATTRIBUTE = re.compile(r'\s*([^\s;]+)\s+(?:"([^"]*)"|([^;]*?))\s*(?:;|$)')
+
+# genome opened by a worker process, reused for all its chromosomes
+_genome_state = {}
+
+
+def gtf_attributes(attributes_str):
+    """
+    Attributes of a GTF line in order, repeated keys (tag) keep their first position and their last value
+    :param attributes_str: attributes column
+    :return: dict
+    """
+    attributes = {}
+    for match in _ATTRIBUTE.finditer(attributes_str):
+        key, quoted_value, value = match.groups()
+        attributes[key] = quoted_value if quoted_value is not None else value
+    return attributes
+
+
+def open_gtf(gtf_file):
+    """
+    Open a plain or gzip compressed GTF file in text mode, the compression is detected from the file content
+    """
+    with open(gtf_file, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(gtf_file, 'rt')
+    return open(gtf_file, 'r')
+
+
+def chromosome_transcripts(gtf_file):
+    """
+    Transcripts of a GTF file grouped by chromosome, the GTF file is expected to list the chromosomes one after
+    the other (as Ensembl and GENCODE GTF files do)
+    :param gtf_file: GTF file (plain or gzip)
+    :return: generator of (chromosome, list of transcripts), a transcript is a dict with its strand, attributes,
+             exons and coding features (CDS, stop codon) as lists of (start, end)
+    """
+    chrom = None
+    transcripts = {}
+    done = set()
+    with open_gtf(gtf_file) as gtf_handle:
+        for line in gtf_handle:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                continue
+            feature_type = fields[2]
+            if feature_type not in ('transcript', 'exon') and feature_type not in CODING_FEATURES:
+                continue
+            if fields[0] != chrom:
+                if transcripts:
+                    yield chrom, list(transcripts.values())
+                    done.update(transcripts)
+                chrom = fields[0]
+                transcripts = {}
+            attributes = gtf_attributes(fields[8])
+            transcript_id = attributes.get('transcript_id')
+            if transcript_id is None:
+                continue
+            transcript = transcripts.get(transcript_id)
+            if transcript is None:
+                if transcript_id in done:
+                    raise ValueError("The features of transcript {} are not grouped by chromosome in {}".format(
+                        transcript_id, gtf_file))
+                transcript = {'id': transcript_id, 'strand': fields[6], 'attributes': None, 'exons': [],
+                              'coding': [], 'protein_id': None}
+                transcripts[transcript_id] = transcript
+            if feature_type == 'transcript':
+                transcript['attributes'] = attributes
+            elif feature_type == 'exon':
+                transcript['exons'].append((int(fields[3]), int(fields[4])))
+                if transcript['attributes'] is None:
+                    transcript['attributes'] = attributes
+            else:
+                transcript['coding'].append((int(fields[3]), int(fields[4])))
+                if transcript['protein_id'] is None:
+                    transcript['protein_id'] = attributes.get('protein_id')
+    if transcripts:
+        yield chrom, list(transcripts.values())
+
+
+def transcript_header(transcript, cds=None):
+    """
+    FASTA header of a transcript
+    :param transcript: transcript, see chromosome_transcripts
+    :param cds: (start, end) of the CDS in the transcript (1-based)
+    :return: header without >
+    """
+    attributes = dict(transcript['attributes'] or {})
+    if transcript['protein_id'] is not None and 'protein_id' not in attributes:
+        attributes['protein_id'] = transcript['protein_id']
+    fields = [transcript['id']]
+    if cds is not None:
+        fields.append('CDS={}-{}'.format(*cds))
+    for key, value in attributes.items():
+        if key in HEADER_EXCLUDED_KEYS:
+            continue
+        fields.append('{}="{}"'.format(key, value) if ' ' in value else '{}={}'.format(key, value))
+    return ' '.join(fields)
+
+
+def splice_transcript(transcript, chrom_sequence):
+    """
+    Sequence of a transcript and position of its CDS
+    :param transcript: transcript, see chromosome_transcripts
+    :param chrom_sequence: function returning the bases [start, end) of the chromosome
+    :return: sequence (str), (start, end) of the CDS in the sequence (1-based) or None
+    """
+    exons = sorted(transcript['exons'])
+    if transcript['strand'] == '-':
+        exons.reverse()
+    offsets = []
+    length = 0
+    parts = []
+    for start, end in exons:
+        offsets.append(length)
+        exon_sequence = chrom_sequence(start - 1, end)
+        parts.append(exon_sequence)
+        length += len(exon_sequence)
+    if transcript['strand'] == '-':
+        sequence = reverse_complement(''.join(reversed(parts)))
+    else:
+        sequence = ''.join(parts)
+
+    def to_transcript(pos):
+        for (start, end), offset in zip(exons, offsets):
+            if start <= pos <= end:
+                return offset + (pos - start if transcript['strand'] != '-' else end - pos) + 1
+        return None
+
+    cds = None
+    if transcript['coding']:
+        coding_start = min(start for start, _ in transcript['coding'])
+        coding_end = max(end for _, end in transcript['coding'])
+        if transcript['strand'] == '-':
+            coding_start, coding_end = coding_end, coding_start
+        cds = (to_transcript(coding_start), to_transcript(coding_end))
+        if None in cds:
+            cds = None
+    return sequence, cds
+
+
+def _genome_record(genome_index, chrom):
+    """
+    Record of a chromosome in the genome, with or without the chr prefix (MT is chrM)
+    """
+    names = [chrom]
+    if chrom.startswith('chr'):
+        names += [chrom[3:], 'MT' if chrom == 'chrM' else chrom[3:]]
+    else:
+        names += ['chr' + chrom, 'chrM' if chrom == 'MT' else 'chr' + chrom]
+    for name in names:
+        row = genome_index.row(name)
+        if row is not None:
+            return row
+    return None
+
+
+def chromosome_records(genome_fasta, index_file, store_file, chrom, transcripts):
+    """
+    FASTA records of the transcripts of a chromosome
+    :param genome_fasta: genome FASTA file
+    :param index_file: index of the genome (see toolbox.fasta_index)
+    :param store_file: packed genome (see toolbox.sequence_store)
+    :param chrom: chromosome
+    :param transcripts: transcripts of the chromosome, see chromosome_transcripts
+    :return: (FASTA text, number of transcripts written, number of transcripts skipped)
+    """
+    genome = _genome_state.get((genome_fasta, index_file, store_file))
+    if genome is None:
+        store = SequenceStore(store_file)
+        genome = (FastaIndex(genome_fasta, index_file), store)
+        _genome_state.clear()
+        _genome_state[(genome_fasta, index_file, store_file)] = genome
+    genome_index, store = genome
+    row = _genome_record(genome_index, chrom)
+    if row is None:
+        return '', 0, len(transcripts)
+
+    chrom_length = store.sequence_length(row)
+
+    # the soft-masked (lowercase) repeats of the genome are written uppercase, as in the cDNA files
+    def chrom_sequence(start, end):
+        return store.decode(row, max(start, 0), min(end, chrom_length)).decode('latin-1').upper()
+
+    lines = []
+    skipped = 0
+    for transcript in transcripts:
+        if not transcript['exons']:
+            skipped += 1
+            continue
+        sequence, cds = splice_transcript(transcript, chrom_sequence)
+        lines.append('>' + transcript_header(transcript, cds) + '\n')
+        for start in range(0, len(sequence), LINE_WIDTH):
+            lines.append(sequence[start:start + LINE_WIDTH] + '\n')
+    return ''.join(lines), len(transcripts) - skipped, skipped
+
+
+def write_genome_transcripts(genome_fasta, index_file, store_file, gtf_file, output_file, workers=1):
+    """
+    Write the sequences of the transcripts of a GTF file, in GTF order
+    :param genome_fasta: genome FASTA file
+    :param index_file: index of the genome (see toolbox.fasta_index)
+    :param store_file: packed genome (see toolbox.sequence_store)
+    :param gtf_file: GTF file
+    :param output_file: output FASTA file
+    :param workers: number of processes, chromosomes are spliced in parallel
+    :return: (number of transcripts written, number of transcripts skipped)
+    """
+    written = 0
+    skipped = 0
+    with open(output_file, 'w') as output_handle:
+        if workers <= 1:
+            for chrom, transcripts in chromosome_transcripts(gtf_file):
+                records, chrom_written, chrom_skipped = chromosome_records(genome_fasta, index_file, store_file,
+                                                                           chrom, transcripts)
+                output_handle.write(records)
+                written += chrom_written
+                skipped += chrom_skipped
+            return written, skipped
+
+        # only a few chromosomes are read ahead of the ones being written
+        with Pool(workers) as pool:
+            pending = deque()
+            for chrom, transcripts in chromosome_transcripts(gtf_file):
+                pending.append(pool.apply_async(chromosome_records, (genome_fasta, index_file, store_file, chrom,
+                                                                     transcripts)))
+                while len(pending) > 2 * workers or (pending and pending[0].ready()):
+                    records, chrom_written, chrom_skipped = pending.popleft().get()
+                    output_handle.write(records)
+                    written += chrom_written
+                    skipped += chrom_skipped
+            while pending:
+                records, chrom_written, chrom_skipped = pending.popleft().get()
+                output_handle.write(records)
+                written += chrom_written
+                skipped += chrom_skipped
+    return written, skipped
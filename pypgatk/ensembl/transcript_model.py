@@ -0,0 +1,240 @@
+"""
+This module contains a compact, in-memory model of the transcripts of a gene annotation (GTF) FeatureDB.
+The model is built once from the FeatureDB with a single query and replaces the per-variant gffutils
+lookups done by vcf-to-proteindb. The per-transcript data derived while translating variants is kept
+in a LRU cache of transcript contexts, the feature coordinates of a transcript are mapped to positions
+in its sequence with bisections over a cumulative offsets table.
+"""
+
+import sys
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TranscriptModel:
+    """
+    Array-backed transcript model. For every transcript it keeps the chromosome, the strand and the
+    exon/CDS/stop_codon coordinates sorted by end position (the order returned by
+    FeatureDB.children(..., order_by='end')). Features of all transcripts are stored contiguously
+    in numpy arrays, a transcript is only a [first, last) range of rows in them.
+    """
+
+    FEATURE_TYPES = ('exon', 'CDS', 'stop_codon')
+
+    def __init__(self, transcript_ids, chroms, chrom_index, strands, offsets, starts, ends, types):
+        self._index = {transcript_id: row for row, transcript_id in enumerate(transcript_ids)}
+        self._chroms = chroms
+        self._chrom_index = chrom_index
+        self._strands = strands
+        self._offsets = offsets
+        self._starts = starts
+        self._ends = ends
+        self._types = types
+
+    @classmethod
+    def from_db(cls, db):
+        """
+        Build the model from a gffutils FeatureDB
+        :param db: gffutils FeatureDB
+        :return: TranscriptModel
+        """
+        transcript_ids = []
+        rows = {}
+        chroms = []
+        chrom_rows = {}
+        chrom_index = []
+        strands = []
+        for transcript_id, seqid, strand in db.execute(
+                "SELECT id, seqid, strand FROM features WHERE featuretype = 'transcript' ORDER BY id"):
+            rows[transcript_id] = len(transcript_ids)
+            transcript_ids.append(transcript_id)
+            if seqid not in chrom_rows:
+                chrom_rows[seqid] = len(chroms)
+                chroms.append(seqid)
+            chrom_index.append(chrom_rows[seqid])
+            strands.append(strand)
+
+        type_codes = {feature_type: code for code, feature_type in enumerate(cls.FEATURE_TYPES)}
+        query = """
+        SELECT DISTINCT relations.parent, features.id, features.featuretype, features.start, features.end
+        FROM relations JOIN features ON relations.child = features.id
+        WHERE features.featuretype IN ({})
+        AND relations.parent IN (SELECT id FROM features WHERE featuretype = 'transcript')
+        ORDER BY relations.parent, features.end
+        """.format(','.join("'{}'".format(feature_type) for feature_type in cls.FEATURE_TYPES))
+
+        counts = [0] * len(transcript_ids)
+        starts = []
+        ends = []
+        types = []
+        for parent, _, featuretype, start, end in db.execute(query):
+            counts[rows[parent]] += 1
+            starts.append(start)
+            ends.append(end)
+            types.append(type_codes[featuretype])
+
+        offsets = np.zeros(len(transcript_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(transcript_ids, chroms, np.array(chrom_index, dtype=np.int32),
+                   ''.join(strands).encode(), offsets, np.array(starts, dtype=np.int32),
+                   np.array(ends, dtype=np.int32), np.array(types, dtype=np.uint8))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, transcript_id):
+        return transcript_id in self._index or transcript_id.split('.')[0] in self._index
+
+    def get_features(self, transcript_id, feature_types=None):
+        """
+        Get chr, strand and the genomic positions of the elements (exons/cds&stop_codon) of a transcript,
+        in the same layout as EnsemblDataService.get_features. The version number is removed from the
+        ID when the versioned ID is not found.
+        :param transcript_id: transcript ID
+        :param feature_types: feature types to report (default = ['exon'])
+        :return: chrom, strand, [[start, end, type], ...] or None, None, None if not found
+        """
+        if feature_types is None:
+            feature_types = ['exon']
+        row = self._index.get(transcript_id)
+        if row is None:
+            row = self._index.get(transcript_id.split('.')[0])
+            if row is None:
+                return None, None, None
+
+        first, last = self._offsets[row], self._offsets[row + 1]
+        codes = {self.FEATURE_TYPES.index(feature_type) for feature_type in feature_types
+                 if feature_type in self.FEATURE_TYPES}
+        features = [[start, end, self.FEATURE_TYPES[code]] for start, end, code in
+                    zip(self._starts[first:last].tolist(), self._ends[first:last].tolist(),
+                        self._types[first:last].tolist()) if code in codes]
+        return self._chroms[self._chrom_index[row]], chr(self._strands[row]), features
+
+    def memory_usage(self):
+        """
+        Approximate memory footprint of the model in bytes (arrays plus the transcript ID index)
+        :return: size in bytes
+        """
+        size = sum(array.nbytes for array in (self._chrom_index, self._offsets, self._starts,
+                                              self._ends, self._types))
+        size += sys.getsizeof(self._strands) + sys.getsizeof(self._index)
+        size += sum(sys.getsizeof(transcript_id) for transcript_id in self._index)
+        size += sum(sys.getsizeof(chrom) for chrom in self._chroms)
+        return size
+
+    def num_features(self):
+        return len(self._starts)
+
+
+class TranscriptCoordinates:
+    """
+    Cumulative offsets table of the features of a transcript (sorted by end, as returned by get_features).
+    Feature i covers the genomic positions [starts[i], ends[i]] and the positions
+    [offsets[i], offsets[i] + ends[i] - starts[i]] of the concatenated features, so overlap tests and
+    genomic to transcript coordinates are bisections instead of scans over the features.
+    """
+
+    __slots__ = ('starts', 'ends', 'offsets', 'min_starts', 'length')
+
+    def __init__(self, features_info):
+        """
+        :param features_info: [[start, end, type], ...] sorted by end
+        """
+        self.starts = [feature[0] for feature in features_info]
+        self.ends = [feature[1] for feature in features_info]
+        self.offsets = []
+        length = 0
+        for start, end in zip(self.starts, self.ends):
+            self.offsets.append(length)
+            length += end - start + 1
+        self.length = length
+        # minimum start of the features from i on, the features are sorted by end but may overlap
+        self.min_starts = list(self.starts)
+        for i in range(len(self.min_starts) - 2, -1, -1):
+            self.min_starts[i] = min(self.min_starts[i], self.min_starts[i + 1])
+
+    def overlaps(self, var_start, var_end):
+        """
+        True when any feature overlaps [var_start, var_end] (both included)
+        """
+        i = bisect_left(self.ends, var_start)
+        return i < len(self.ends) and self.min_starts[i] <= var_end
+
+    def to_transcript(self, pos):
+        """
+        Position in the concatenated features of a genomic position, using the first feature that contains it
+        :param pos: genomic position
+        :return: 0-based index, None when no feature contains the position
+        """
+        for i in range(bisect_left(self.ends, pos), len(self.ends)):
+            if self.min_starts[i] > pos:
+                break
+            if self.starts[i] <= pos:
+                return self.offsets[i] + pos - self.starts[i]
+        return None
+
+
+class TranscriptContext:
+    """
+    Everything vcf-to-proteindb derives from a transcript, independent of the variant: the sequence and
+    header from the transcripts fasta, the CDS positions parsed from the header, the features of the
+    transcript with their coordinates table and, once the first variant has been translated, the reference coding sequence and ORFs.
+    """
+
+    __slots__ = ('transcript_id', 'seq', 'description', 'cds_info', 'feature_types', 'num_orfs',
+                 'chrom', 'strand', 'features', 'coordinates', 'coding_ref_seq', 'ref_orfs')
+
+    def __init__(self, transcript_id, seq, description, cds_info, feature_types, num_orfs, chrom, strand,
+                 features):
+        self.transcript_id = transcript_id
+        self.seq = seq
+        self.description = description
+        self.cds_info = cds_info
+        self.feature_types = feature_types
+        self.num_orfs = num_orfs
+        self.chrom = chrom
+        self.strand = strand
+        self.features = features
+        self.coordinates = TranscriptCoordinates(features) if features is not None else None
+        self.coding_ref_seq = None
+        self.ref_orfs = None
+
+
+class TranscriptContextCache:
+    """
+    Bounded LRU cache of TranscriptContext objects keyed by transcript ID and translation table. Contexts
+    are created by the given loader on a miss, which is cheap to keep at a high hit rate because the
+    variants of a sorted VCF come transcript after transcript.
+    """
+
+    def __init__(self, loader, max_size=1000):
+        """
+        :param loader: function creating the TranscriptContext of a transcript ID, raises KeyError
+                       when the transcript is unknown
+        :param max_size: maximum number of contexts kept
+        """
+        self._loader = loader
+        self._max_size = max_size
+        self._contexts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, transcript_id, translation_table):
+        key = (transcript_id, translation_table)
+        context = self._contexts.get(key)
+        if context is not None:
+            self.hits += 1
+            self._contexts.move_to_end(key)
+            return context
+
+        self.misses += 1
+        context = self._loader(transcript_id)
+        self._contexts[key] = context
+        if len(self._contexts) > self._max_size:
+            self._contexts.popitem(last=False)
+        return context
+
+    def __len__(self):
+        return len(self._contexts)
@@ -0,0 +1,122 @@
+"""
+This module annotates VCF records with the transcripts overlapping them. The CDS features of a GTF file are
+kept in sorted arrays per chromosome and the VCF is annotated line by line while it is read, so no intermediate
+files are written and the memory used only depends on the size of the GTF file.
+"""
+
+import numpy as np
+
+from pypgatk.ensembl.genome_transcripts import open_gtf
+
+
+class TranscriptIntervalIndex:
+    """
+    Interval index of the features of a GTF file. The features of every chromosome are sorted by start;
+    a query only scans the features starting between (query start - longest feature) and the query end.
+    Coordinates follow bedtools: GTF features cover [start - 1, end) and a VCF record [POS - 1, POS - 1 + len(REF)).
+    """
+
+    def __init__(self, transcript_ids, chrom_intervals):
+        """
+        :param transcript_ids: transcript ID of every feature, in GTF order
+        :param chrom_intervals: chrom -> (starts, ends, feature rows, longest feature) sorted by start
+        """
+        self._transcript_ids = transcript_ids
+        self._chrom_intervals = chrom_intervals
+
+    @classmethod
+    def from_gtf(cls, gtf_file, feature_type='CDS', record_type_index=2, gene_info_index=8, gene_info_sep=';',
+                 transcript_str='transcript_id', transcript_info_sep=' '):
+        """
+        Build the index from the features of a GTF file that have a transcript ID
+        :param gtf_file: GTF file (plain or gzip)
+        :param feature_type: type of the features indexed
+        :return: TranscriptIntervalIndex
+        """
+        transcript_ids = []
+        chrom_features = {}
+        with open_gtf(gtf_file) as gtf_handle:
+            for line in gtf_handle:
+                if line.startswith('#'):
+                    continue
+                sl = line.strip().split('\t')
+                if len(sl) <= gene_info_index or sl[record_type_index].strip() != feature_type:
+                    continue
+
+                transcript_id = None
+                for info in sl[gene_info_index].split(gene_info_sep):  # extract transcript id from the gtf info column
+                    if info.strip().startswith(transcript_str):
+                        transcript_id = info.strip().split(transcript_info_sep)[1].strip('"')
+                if transcript_id is None:
+                    continue
+
+                features = chrom_features.setdefault(sl[0], ([], [], []))
+                features[0].append(int(sl[3]) - 1)
+                features[1].append(int(sl[4]))
+                features[2].append(len(transcript_ids))
+                transcript_ids.append(transcript_id)
+
+        chrom_intervals = {}
+        for chrom, (starts, ends, rows) in chrom_features.items():
+            starts = np.array(starts, dtype=np.int64)
+            ends = np.array(ends, dtype=np.int64)
+            order = np.argsort(starts, kind='stable')
+            chrom_intervals[chrom] = (starts[order], ends[order], np.array(rows, dtype=np.int64)[order],
+                                      int((ends - starts).max()))
+        return cls(transcript_ids, chrom_intervals)
+
+    def __len__(self):
+        return len(self._transcript_ids)
+
+    def overlapping_transcripts(self, chrom, start, end):
+        """
+        IDs of the transcripts with a feature overlapping [start, end), once per transcript and in GTF order
+        :param chrom: chromosome
+        :param start: 0-based start
+        :param end: end (exclusive)
+        :return: list of transcript IDs
+        """
+        try:
+            starts, ends, rows, longest = self._chrom_intervals[chrom]
+        except KeyError:
+            return []
+        first = np.searchsorted(starts, start - longest, side='right')
+        last = np.searchsorted(starts, end, side='left')
+        if first >= last:
+            return []
+        hits = rows[first:last][ends[first:last] > start]
+        hits.sort()
+        transcript_ids = []
+        seen = set()
+        for row in hits.tolist():
+            transcript_id = self._transcript_ids[row]
+            if transcript_id not in seen:
+                seen.add(transcript_id)
+                transcript_ids.append(transcript_id)
+        return transcript_ids
+
+    def annotate_vcf_lines(self, lines, vcf_info_field_index=7, annotation_str='transcriptOverlaps'):
+        """
+        Add the IDs of the overlapping transcripts to the INFO column of the VCF records
+        (annotation_str=ID1,ID2,...), header lines and records without overlaps are returned unchanged.
+        :param lines: lines of a VCF file
+        :param vcf_info_field_index: index of the INFO column
+        :param annotation_str: name of the INFO field added
+        :return: generator of VCF lines
+        """
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                yield line
+                continue
+            sl = line.strip().split('\t')
+            try:
+                start = int(sl[1]) - 1
+                transcript_ids = self.overlapping_transcripts(sl[0], start, start + len(sl[3]))
+            except (ValueError, IndexError):
+                transcript_ids = []
+            if not transcript_ids:
+                yield line
+                continue
+            sl[vcf_info_field_index] = '{};{}={}'.format(sl[vcf_info_field_index].strip(), annotation_str,
+                                                        ','.join(transcript_ids))
+            yield '\t'.join(sl) + '\n'
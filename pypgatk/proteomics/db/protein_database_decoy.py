@@ -2,15 +2,33 @@
 
 import random
 import os
+import shutil
+import tempfile
+from collections import deque
+from multiprocessing import Pool
+
 from Bio import SeqIO
 from Bio.SeqIO.FastaIO import SimpleFastaParser
 from pyteomics.fasta import decoy_sequence
-from pyteomics.parser import cleave
 
+from pypgatk.proteomics.digestion import enzyme_cleavage_rule
 from pypgatk.proteomics.models import PYGPATK_ENZYMES, PYGPATK_ALPHABET
+from pypgatk.proteomics.peptide_set import PeptideSet
 from pypgatk.toolbox.exceptions import AppException
 from pypgatk.toolbox.general import ParameterConfiguration
 
+# service and read-only arguments (target peptides, alternatives) of a worker process, set once per process
+_decoy_worker_state = {}
+
+
+def _init_decoy_worker(service, shared_arguments):
+  _decoy_worker_state['service'] = service
+  _decoy_worker_state['shared_arguments'] = shared_arguments
+
+
+def _decoy_chunk(function_name, chunk):
+  return getattr(_decoy_worker_state['service'], function_name)(chunk, **_decoy_worker_state['shared_arguments'])
+
 
 class ProteinDBDecoyService(ParameterConfiguration):
   CONFIG_KEY_PROTEINDB_DECOY = 'proteindb_decoy'
@@ -29,20 +47,37 @@ class ProteinDBDecoyService(ParameterConfiguration):
   CONFIG_DECOY_PREFIX = 'decoy_prefix'
   CONFIG_DECOY_SUFFIX = 'decoy_suffix'
   CONFIG_TEMP_FILE = 'temp_file'
+  CONFIG_TEMP_DIR = 'temp_dir'
   CONFIG_NO_ISOBARIC = 'no_isobaric'
   CONFIG_MEMORY_SAVE = 'memory_save'
   CONFIG_USE_SUFFIX = 'use_suffix'
   CONFIG_KEEP_TARGET_HITS = 'keep_target_hits'
+  CONFIG_BLOOM_FILTER_BITS = 'bloom_filter_bits'
+  CONFIG_THREADS = 'threads'
+  CONFIG_SEED = 'seed'
+
+  # residues of the proteins processed together by a worker process
+  DECOY_CHUNK_SIZE = 1024 * 1024
+  # buffer of the copy of the target proteins (bytes)
+  COPY_BUFFER_SIZE = 1024 * 1024
 
   def __init__(self, config_file, pipeline_arguments):
     super(ProteinDBDecoyService, self).__init__(self.CONFIG_KEY_PROTEINDB_DECOY, config_file,
                                                 pipeline_arguments)
 
+    # a new file of the temporary folder when no temporary file is set
+    self._temp_file = None
     if self.CONFIG_TEMP_FILE in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
       self._temp_file = self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY][self.CONFIG_TEMP_FILE]
     elif self.CONFIG_TEMP_FILE in self.get_pipeline_parameters():
       self._temp_file = self.get_pipeline_parameters()[self.CONFIG_TEMP_FILE]
 
+    self._temp_dir = None
+    if self.CONFIG_TEMP_DIR in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
+      self._temp_dir = self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY][self.CONFIG_TEMP_DIR]
+    if self.CONFIG_TEMP_DIR in self.get_pipeline_parameters():
+      self._temp_dir = self.get_pipeline_parameters()[self.CONFIG_TEMP_DIR]
+
     self._input_fasta = self.get_pipeline_parameters()[self.CONFIG_INPUT_FILE]
 
     if self.CONFIG_NO_ISOBARIC in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
@@ -130,6 +165,27 @@ class ProteinDBDecoyService(ParameterConfiguration):
     if self.CONFIG_KEEP_TARGET_HITS in self.get_pipeline_parameters():
       self._keep_target_hits = self.get_pipeline_parameters()[self.CONFIG_KEEP_TARGET_HITS]
 
+    self._bloom_filter_bits = 0
+    if self.CONFIG_BLOOM_FILTER_BITS in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
+      self._bloom_filter_bits = self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY][self.CONFIG_BLOOM_FILTER_BITS]
+    if self.CONFIG_BLOOM_FILTER_BITS in self.get_pipeline_parameters():
+      self._bloom_filter_bits = self.get_pipeline_parameters()[self.CONFIG_BLOOM_FILTER_BITS]
+
+    self._threads = 1
+    if self.CONFIG_THREADS in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
+      self._threads = self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY][self.CONFIG_THREADS]
+    if self.CONFIG_THREADS in self.get_pipeline_parameters():
+      self._threads = self.get_pipeline_parameters()[self.CONFIG_THREADS]
+
+    self._seed = 0
+    if self.CONFIG_SEED in self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY]:
+      self._seed = self.get_default_parameters()[self.CONFIG_KEY_PROTEINDB_DECOY][self.CONFIG_SEED]
+    if self.CONFIG_SEED in self.get_pipeline_parameters():
+      self._seed = self.get_pipeline_parameters()[self.CONFIG_SEED]
+
+    # shuffled alternatives of the decoy peptides found in the target peptides ('' if none), see pgdbdeep_alternative
+    self._alternatives = {}
+
   @staticmethod
   def revswitch(protein, noswitch, sites):
     """
@@ -156,10 +212,11 @@ class ProteinDBDecoyService(ParameterConfiguration):
     return ''.join(revseq)
 
   @staticmethod
-  def shuffle(peptide):
+  def shuffle(peptide, rng=random):
     """
     shuffle peptide without moving c-terminal amino acid cleavage site.
     :param peptide sequence
+    :param rng: random number generator (default the random module)
     :return new shuffle peptide.
     """
 
@@ -167,10 +224,72 @@ class ProteinDBDecoyService(ParameterConfiguration):
     s = peptide[-1]
     # convert peptide to list (remove K/R) and shuffle the list
     l = list(peptide[:-1])
-    random.shuffle(l)
+    rng.shuffle(l)
     # return new peptide
     return ''.join(l) + s
 
+  def random_stream(self, key):
+    """
+    Random number generator of a protein (key: its index in the input) or of a peptide (key: its sequence), seeded
+    from the seed of the run so that the decoys are the same whatever the number of threads
+    """
+    return random.Random('{}:{}'.format(self._seed, key))
+
+  def _fasta_chunks(self, fasta_file):
+    """
+    (index, title, sequence) of the proteins of a FASTA file in chunks of about DECOY_CHUNK_SIZE residues, the index
+    is the position of the protein in the file
+    """
+    chunk = []
+    chunk_size = 0
+    with open(fasta_file) as handle:
+      for index, (title, seq) in enumerate(SimpleFastaParser(handle)):
+        chunk.append((index, title, seq))
+        chunk_size += len(seq)
+        if chunk_size >= self.DECOY_CHUNK_SIZE:
+          yield chunk
+          chunk = []
+          chunk_size = 0
+    if chunk:
+      yield chunk
+
+  def _line_chunks(self, fasta_file):
+    """
+    Lines of a FASTA file in chunks of about DECOY_CHUNK_SIZE characters
+    """
+    chunk = []
+    chunk_size = 0
+    with open(fasta_file) as handle:
+      for line in handle:
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= self.DECOY_CHUNK_SIZE:
+          yield chunk
+          chunk = []
+          chunk_size = 0
+    if chunk:
+      yield chunk
+
+  def _map_chunks(self, function, chunks, **shared_arguments):
+    """
+    Results of function(chunk, **shared_arguments) for the chunks, in order. The chunks are processed by the
+    configured number of worker processes, the shared arguments (read-only) are sent once to each of them.
+    """
+    if self._threads <= 1:
+      for chunk in chunks:
+        yield function(chunk, **shared_arguments)
+      return
+
+    # only a few chunks are read ahead of the results being used
+    with Pool(self._threads, _init_decoy_worker, (self, shared_arguments)) as pool:
+      pending = deque()
+      for chunk in chunks:
+        pending.append(pool.apply_async(_decoy_chunk, (function.__name__, chunk)))
+        while len(pending) > 2 * self._threads or (pending and pending[0].ready()):
+          yield pending.popleft().get()
+      while pending:
+        yield pending.popleft().get()
+
   def protein_database_decoy(self, method='reverse'):
     """
     The protein decoy function will generate the decoy with two default methods:
@@ -184,22 +303,36 @@ class ProteinDBDecoyService(ParameterConfiguration):
     :param method the method used to compute the decoy
     :return:
     """
-    fasta = SeqIO.parse(self._input_fasta, 'fasta')
     with open(self._output_file, "wt") as output_file:
-      for record in fasta:
-        #print(record)
-        seq = str(record.seq)
-        decoy_seq = decoy_sequence(seq, mode=method)
+      for text in self._map_chunks(self.protein_decoy_records, self._fasta_chunks(self._input_fasta), method=method):
+        output_file.write(text)
 
-        output_file.write('>' + record.id + " " + record.description + '\n')
-        output_file.write(str(record.seq) + '\n')
-        if (self._use_suffix):
-          output_file.write('>' + record.id + self._decoy_suffix + '\n')
-        else: 
-          output_file.write('>' + self._decoy_prefix + record.id + '\n')
-        output_file.write(decoy_seq + '\n')
+  def protein_decoy_records(self, records, method='reverse'):
+    """
+    Target and decoy FASTA records of proteins, see protein_database_decoy
+    :param records: (index, title, sequence) of the proteins
+    :param method: reverse or shuffle
+    :return: FASTA text
+    """
+    lines = []
+    for index, title, seq in records:
+      words = title.split(None, 1)
+      record_id = words[0] if words else ''
+      if method == 'shuffle':
+        decoy_seq = list(seq)
+        self.random_stream(index).shuffle(decoy_seq)
+        decoy_seq = ''.join(decoy_seq)
+      else:
+        decoy_seq = decoy_sequence(seq, mode=method)
 
-    output_file.close()
+      lines.append('>' + record_id + " " + title + '\n')
+      lines.append(seq + '\n')
+      if (self._use_suffix):
+        lines.append('>' + record_id + self._decoy_suffix + '\n')
+      else:
+        lines.append('>' + self._decoy_prefix + record_id + '\n')
+      lines.append(decoy_seq + '\n')
+    return ''.join(lines)
 
   @staticmethod
   def count_aa_in_dictionary(aa_dict: dict, sequence: str):
@@ -236,13 +369,14 @@ class ProteinDBDecoyService(ParameterConfiguration):
     target_sequence = ''
     decoy_sequence = ''
 
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
     fasta = SeqIO.parse(self._output_file, 'fasta')
     target_peptides = {}
     decoy_peptides = {}
     pep_count_in_both = 0
     for record in fasta:
-      peptides = cleave(sequence=str(record.seq), rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'],
-                        missed_cleavages=self._max_missed_cleavages, min_length=self._min_peptide_length)
+      peptides = cleavage_rule.cleave(str(record.seq), missed_cleavages=self._max_missed_cleavages,
+                                      min_length=self._min_peptide_length)
       if self._use_suffix and self._decoy_suffix in record.id:
         decoy_sequence = decoy_sequence + str(record.seq)
       if self._decoy_prefix in record.id:
@@ -279,83 +413,38 @@ class ProteinDBDecoyService(ParameterConfiguration):
     :return:
     """
 
-    # Create empty sets to add all target and decoy peptides
-    upeps = set()
-    dpeps = set()
+    # Create empty sets to add all target and decoy peptides, peptides are kept as hashes (see PeptideSet)
+    upeps = PeptideSet(bloom_filter_bits=self._bloom_filter_bits)
+    dpeps = PeptideSet()
 
     # Counter for number of decoy sequences
     dcount = 0
 
-    # Open FASTA file using first cmd line argument
-    # fasta = SeqIO.parse(self._input_fasta, 'fasta')
-
-    with open(self._input_fasta) as handle:
-      # open temporary decoy FASTA file
-      with open(self._temp_file, 'w') as outfa:
-
-        # loop each seq in the file
-        for value in SimpleFastaParser(handle):
-          seq = value[1]
-          description = value[0]
-          dcount += 1
-          # make sequence isobaric (check args for switch off)
-          if not self._isobaric:
-            seq = seq.replace('I', 'L')
-
-          # digest sequence add peptides to set
-          upeps.update(
-            cleave(sequence=seq, rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'], missed_cleavages=0,
-                   min_length=self._min_peptide_length))
-
-          # reverse and switch protein sequence
-          decoyseq = self.revswitch(seq, self._no_switch, PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage sites'])
-
-          # do not store decoy peptide set in reduced memory mode
-          if not self._memory_save:
-            # update decoy peptide set
-            dpeps.update(
-              cleave(sequence=decoyseq, rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'], missed_cleavages=0,
-                     min_length=self._min_peptide_length))
-
-          # generate new accession in the header
-          # write decoy protein accession to file
-          if "|" in description:
-            split = description.split('|', 2)
-            if self._use_suffix:
-              new_description = split[0] + '|' + split[1] + self._decoy_suffix
-            else:
-              new_description = split[0] + '|' + self._decoy_prefix + split[1]
-            if len(split) > 2:
-              new_description += "|" + split[2]
-            outfa.write('>' + new_description + '\n')
-          else:
-            if self._use_suffix:
-              outfa.write('>' + description + self._decoy_suffix + '\n')
-            else:
-              outfa.write('>' + self._decoy_prefix + description + '\n')
-
-          # write sequence to file
-          outfa.write(decoyseq + '\n')
+    # temporary decoy FASTA file, a new file of the temporary folder unless a temporary file is set
+    temp_file = self._temp_file
+    if temp_file is None:
+      temp_handle, temp_file = tempfile.mkstemp(prefix='decoypyrat_', suffix='.fa', dir=self._temp_dir)
+      os.close(temp_handle)
+
+    # open temporary decoy FASTA file, the proteins are digested and reversed in chunks by the worker processes
+    with open(temp_file, 'w') as outfa:
+      for text, count, target_peptides, decoy_peptides in self._map_chunks(self.decoypyrat_records,
+                                                                           self._fasta_chunks(self._input_fasta)):
+        dcount += count
+        upeps.update(target_peptides)
+        dpeps.update(decoy_peptides)
+        outfa.write(text)
 
     # Summarise the numbers of target and decoy peptides and their intersection
-    nonDecoys = set()
+    nonDecoys = PeptideSet()
     print("proteins:" + str(dcount))
     print("target peptides:" + str(len(upeps)))
 
     # Reloop decoy file in reduced memory mode to store only intersecting decoys
     if self._memory_save:
-      # open temp decoys
-      with open(self._temp_file, "rt") as fin:
-        for line in fin:
-          # if line is not accession
-          if line[0] != '>':
-            # digest protein
-            for p in cleave(sequence=line.rstrip(), rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'],
-                            missed_cleavages=0, min_length=self._min_peptide_length):
-              # check if in target peptides if true then add to nonDecoys
-              if p in upeps:
-                nonDecoys.add(p)
-      fin.close()
+      for target_hits in self._map_chunks(self.decoypyrat_target_hits, self._line_chunks(temp_file),
+                                          target_peptides=upeps):
+        nonDecoys.update(target_hits)
       print("decoy peptides: !Memory Saving Made!")
     else:
       # can only report total number in normal memory mode
@@ -376,6 +465,8 @@ class ProteinDBDecoyService(ParameterConfiguration):
       for dPep in dAlternative:
         i = 0
         aPep = dPep
+        # the shuffles of a peptide do not depend on the order of the peptides
+        rng = self.random_stream(dPep)
 
         # shuffle until aPep is not in target set (maximum of 10 iterations)
         while aPep in upeps and i < self._max_iterations:
@@ -384,7 +475,7 @@ class ProteinDBDecoyService(ParameterConfiguration):
           i += 1
 
           # shuffle peptide
-          aPep = self.shuffle(dPep)
+          aPep = self.shuffle(dPep, rng)
 
           # check if shuffling has an effect if not end iterations
           if aPep == dPep:
@@ -407,44 +498,126 @@ class ProteinDBDecoyService(ParameterConfiguration):
       dpeps.clear()
 
       # open second decoy file
-      with open(self._output_file, "wt") as fout:
-
-        # Attach the target sequences to the database
-        # fasta = SeqIO.parse(self._input_fasta, 'fasta')
-        with open(self._input_fasta) as handle:
-          for value in SimpleFastaParser(handle):
-            description = value[0]
-            seq = value[1]
-            fout.write('>' + description + '\n')
-            fout.write(seq + '\n')
-
-        # open original decoy file
-        with open(self._temp_file, "rt") as fin:
-          # loop each line of original decoy fasta
-          for line in fin:
-            # if line is not accession replace peptides in dictionary with alternatives
-            if line[0] != '>':
-              # digest decoy sequence
-              for p in cleave(sequence=line.rstrip(), rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'],
-                              missed_cleavages=0, min_length=self._min_peptide_length):
-                # store decoy peptide for final count
-                dpeps.add(p)
-
-                # if decoy peptide is in dictionary replace with alternative
-                if p in dAlternative:
-                  line = line.replace(p, dAlternative[p])
-
-            fout.write(line)
-        fin.close()
-      fout.close()
+      with open(self._output_file, "wb") as fout:
+
+        # Attach the target sequences to the database, copied as they are
+        with open(self._input_fasta, 'rb') as handle:
+          shutil.copyfileobj(handle, fout, self.COPY_BUFFER_SIZE)
+          if handle.tell() > 0:
+            handle.seek(-1, os.SEEK_END)
+            if handle.read(1) != b'\n':
+              fout.write(b'\n')
+
+        # replace the peptides of the original decoys with their alternatives
+        for text, decoy_peptides in self._map_chunks(self.decoypyrat_replace_peptides,
+                                                     self._line_chunks(temp_file), alternatives=dAlternative):
+          # store decoy peptides for final count
+          dpeps.update(decoy_peptides)
+          fout.write(text.encode())
 
       # delete temporary file
-      os.remove(self._temp_file)
+      os.remove(temp_file)
     else:
-      os.rename(self._temp_file, self._output_file)
+      shutil.move(temp_file, self._output_file)
 
     print("final decoy peptides:" + str(len(dpeps)))
 
+  def decoypyrat_records(self, records):
+    """
+    Reversed and switched decoys of proteins and their peptides, see generate_decoypyrat_database
+    :param records: (index, title, sequence) of the proteins
+    :return: decoy FASTA text, number of proteins, target peptides, decoy peptides (none in reduced memory mode)
+    """
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
+    lines = []
+    target_peptides = set()
+    decoy_peptides = set()
+    for _, description, seq in records:
+      # make sequence isobaric (check args for switch off)
+      if not self._isobaric:
+        seq = seq.replace('I', 'L')
+
+      # digest sequence add peptides to set
+      target_peptides.update(cleavage_rule.cleave(seq, missed_cleavages=0, min_length=self._min_peptide_length))
+
+      # reverse and switch protein sequence
+      decoyseq = self.revswitch(seq, self._no_switch, PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage sites'])
+
+      # do not store decoy peptide set in reduced memory mode
+      if not self._memory_save:
+        # update decoy peptide set
+        decoy_peptides.update(cleavage_rule.cleave(decoyseq, missed_cleavages=0, min_length=self._min_peptide_length))
+
+      # generate new accession in the header
+      # write decoy protein accession to file
+      if "|" in description:
+        split = description.split('|', 2)
+        if self._use_suffix:
+          new_description = split[0] + '|' + split[1] + self._decoy_suffix
+        else:
+          new_description = split[0] + '|' + self._decoy_prefix + split[1]
+        if len(split) > 2:
+          new_description += "|" + split[2]
+        lines.append('>' + new_description + '\n')
+      else:
+        if self._use_suffix:
+          lines.append('>' + description + self._decoy_suffix + '\n')
+        else:
+          lines.append('>' + self._decoy_prefix + description + '\n')
+
+      # write sequence to file
+      lines.append(decoyseq + '\n')
+    return ''.join(lines), len(records), list(target_peptides), list(decoy_peptides)
+
+  def decoypyrat_target_hits(self, lines, target_peptides):
+    """
+    Peptides of decoy proteins found in the target peptides
+    :param lines: lines of the decoy FASTA file
+    :param target_peptides: PeptideSet of the target peptides
+    :return: list of peptides
+    """
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
+    peptides = []
+    for line in lines:
+      # if line is not accession
+      if line[0] != '>':
+        # digest protein
+        peptides += cleavage_rule.cleave(line.rstrip(), missed_cleavages=0, min_length=self._min_peptide_length)
+    # check if in target peptides if true then add to the hits (one lookup for all the proteins of the chunk)
+    return [p for p, in_target in zip(peptides, target_peptides.contains(peptides).tolist()) if in_target]
+
+  def decoypyrat_replace_peptides(self, lines, alternatives):
+    """
+    Replace the peptides of decoy proteins with their alternatives, at the offsets of the peptides in the decoy
+    :param lines: lines of the decoy FASTA file
+    :param alternatives: dict of the alternative of each decoy peptide found in the target peptides
+    :return: FASTA text, decoy peptides
+    """
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
+    decoy_peptides = set()
+    text = []
+    for line in lines:
+      # if line is not accession replace peptides in dictionary with alternatives
+      if line[0] != '>':
+        # digest decoy sequence, the peptides without missed cleavages follow each other in the sequence
+        seq = line.rstrip()
+        starts, ends = cleavage_rule.peptide_bounds(seq, missed_cleavages=0, min_length=self._min_peptide_length)
+        parts = []
+        position = 0
+        for start, end in zip(starts.tolist(), ends.tolist()):
+          p = seq[start:end]
+          decoy_peptides.add(p)
+          # if decoy peptide is in dictionary replace with alternative
+          if p in alternatives:
+            parts.append(seq[position:start])
+            parts.append(alternatives[p])
+            position = end
+        if parts:
+          parts.append(line[position:])
+          line = ''.join(parts)
+      text.append(line)
+    return ''.join(text), list(decoy_peptides)
+
   def pypgatk_decoy_database(self):
     """
     Create a decoy database from a proteomics database
@@ -457,112 +630,184 @@ class ProteinDBDecoyService(ParameterConfiguration):
      - peptides with a match are shuffled for max_iterations, if a non-target
        peptide was found then written otherwise the peptide is skipped unless
       the _keep_target_hits option is true.
+    The input is read twice, the decoys are written as the proteins are read: only the target peptides and the
+    alternatives of the decoy peptides found in them are kept in memory.
      :return:
     """
 
     # Create empty sets to add all target and decoy peptides
-    upeps = set()
-    noAlternative = set()
-    # Open FASTA file using first cmd line argument
-    fasta = SeqIO.parse(self._input_fasta, 'fasta')
-    # loop each seq in the file
-    for record in fasta:
-      seq = str(record.seq)
+    upeps = PeptideSet(bloom_filter_bits=self._bloom_filter_bits)
+    # peptides without alternative, in the order they were found
+    noAlternative = []
+    seen_no_alternative = set()
+    self._alternatives = {}
+    for target_peptides in self._map_chunks(self.pgdbdeep_target_peptides, self._fasta_chunks(self._input_fasta)):
+      upeps.update(target_peptides)
+    upeps.compact()
+
+    # open orary decoy FASTA file
+    target_length = 0
+    decoy_length = 0
+    with open(self._output_file, 'w') as outfa:
+      for text, no_alternative, chunk_target_length, chunk_decoy_length in self._map_chunks(
+          self.pgdbdeep_records, self._fasta_chunks(self._input_fasta), target_peptides=upeps):
+        for decoy_pep in no_alternative:
+          if decoy_pep not in seen_no_alternative:
+            seen_no_alternative.add(decoy_pep)
+            noAlternative.append(decoy_pep)
+        target_length += chunk_target_length
+        decoy_length += chunk_decoy_length
+        outfa.write(text)
+
+      with open(self._output_file.replace('.fa', '') + '_noAlternative.fa', 'w') as noAlternative_outfa:
+        noAlternative_outfa.write('\n'.join(noAlternative) + '\n')
+      print('Number of skipped tryptic peptides in decoy db (no alternatives): {}'.
+            format(len(noAlternative)))
+      print('Total number of amino acids in target and decoy databases: ', target_length, decoy_length)
+
+  def pgdbdeep_target_peptides(self, records):
+    """
+    Target peptides of proteins, see pypgatk_decoy_database
+    :param records: (index, title, sequence) of the proteins
+    :return: list of peptides
+    """
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
+    target_peptides = set()
+    for _, _, seq in records:
       if not self._isobaric:
         seq = seq.replace('I', 'L')
 
         # digest sequence add peptides to the target set
-        upeps.update(
-          cleave(sequence=seq, rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'],
-                 missed_cleavages=self._max_missed_cleavages,
-                 min_length=self._min_peptide_length))
+        target_peptides.update(
+          cleavage_rule.cleave(seq, missed_cleavages=self._max_missed_cleavages, min_length=self._min_peptide_length))
+    return list(target_peptides)
 
-    # open orary decoy FASTA file
-    with open(self._output_file, 'w') as outfa:
-      fasta = SeqIO.parse(self._input_fasta, 'fasta')
-      targets = []
-      decoys = []
-      for i, record in enumerate(fasta):
-        protseq = str(record.seq)
-        targets.append(protseq)
-        revprotseq = []
-
-        # output target protein
-        seq = str(record.seq)
-        id_protein = record.id
-        description = record.description
-        outfa.write('>' + id_protein + ' ' + description + '\n')
-        outfa.write(seq + '\n')
-
-        for seq in protseq.split('*'):
-          if not seq:
+  def pgdbdeep_alternative(self, decoy_pep, target_peptides):
+    """
+    Shuffled alternative of a decoy peptide found in the target peptides, see pypgatk_decoy_database. The shuffles
+    of a peptide do not depend on the protein, the alternatives are memoized per process.
+    :param decoy_pep: decoy peptide
+    :param target_peptides: PeptideSet of the target peptides
+    :return: alternative peptide, '' if there is no alternative
+    """
+    aPep = self._alternatives.get(decoy_pep)
+    if aPep is not None:
+      return aPep
+
+    aPep = decoy_pep
+    rng = self.random_stream(decoy_pep)
+    # shuffle until aPep is not in target set (maximum of 10 iterations)
+    i = 0
+    while aPep in target_peptides and i < self._max_iterations:
+      # increment iteration counter
+      i += 1
+      # shuffle peptide
+      aPep = self.shuffle(aPep, rng)
+
+      # check if shuffling has an effect if not end iterations
+      if aPep == decoy_pep:
+        i = self._max_iterations
+
+      # no suitable alternative
+      if i == self._max_iterations:
+        aPep = ''
+    self._alternatives[decoy_pep] = aPep
+    return aPep
+
+  def pgdbdeep_records(self, records, target_peptides):
+    """
+    Target and decoy FASTA records of proteins, see pypgatk_decoy_database
+    :param records: (index, title, sequence) of the proteins
+    :param target_peptides: PeptideSet of the target peptides
+    :return: FASTA text, decoy peptides without alternative, number of target and decoy residues
+    """
+    cleavage_rule = enzyme_cleavage_rule(self._enzyme)
+    upeps = target_peptides
+    # peptides without alternative, in the order they were found
+    noAlternative = []
+    seen_no_alternative = set()
+    # decoy peptides of every protein segment, digested first so that the peptides of the whole chunk are looked up
+    # in the targets at once
+    record_decoy_peps = []
+    chunk_peps = []
+    seen_chunk_peps = set()
+    for _, _, protseq in records:
+      segment_decoy_peps = []
+      for seq in protseq.split('*'):
+        if not seq:
+          continue
+        if not self._isobaric:
+          seq = seq.replace('I', 'L')
+
+        # reverse and switch protein sequence
+        decoyseq = self.revswitch(seq, self._no_switch, PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage sites'])
+
+        # unique peptides in the order of the decoy protein (a set would depend on the hash seed of the process)
+        decoy_peps = []
+        seen_decoy_peps = set()
+        for decoy_pep in cleavage_rule.peptides(decoyseq, missed_cleavages=0, min_length=0):
+          if decoy_pep not in seen_decoy_peps:
+            seen_decoy_peps.add(decoy_pep)
+            decoy_peps.append(decoy_pep)
+            if len(decoy_pep) >= self._min_peptide_length and decoy_pep not in seen_chunk_peps:
+              seen_chunk_peps.add(decoy_pep)
+              chunk_peps.append(decoy_pep)
+        segment_decoy_peps.append(decoy_peps)
+      record_decoy_peps.append(segment_decoy_peps)
+    in_target = set(pep for pep, pep_in_target in zip(chunk_peps, upeps.contains(chunk_peps).tolist())
+                    if pep_in_target)
+
+    lines = []
+    target_length = 0
+    decoy_length = 0
+    for (_, description, protseq), segment_decoy_peps in zip(records, record_decoy_peps):
+      words = description.split(None, 1)
+      id_protein = words[0] if words else ''
+      target_length += len(protseq)
+      revprotseq = []
+
+      # output target protein
+      lines.append('>' + id_protein + ' ' + description + '\n')
+      lines.append(protseq + '\n')
+
+      for decoy_peps in segment_decoy_peps:
+        # if any of the digested peptides are found in the targets (upeps) then shuffle
+        checked_decoy_peps = []
+        for decoy_pep in decoy_peps:
+          if len(decoy_pep) < self._min_peptide_length:
+            checked_decoy_peps.append(decoy_pep)
             continue
-          if not self._isobaric:
-            seq = seq.replace('I', 'L')
-
-          # reverse and switch protein sequence
-          decoyseq = self.revswitch(seq, self._no_switch, PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage sites'])
-
-          decoy_peps = cleave(sequence=decoyseq, rule=PYGPATK_ENZYMES.enzymes[self._enzyme]['cleavage rule'],
-                              missed_cleavages=0, min_length=0)
 
-          # if any of the digested peptides are found in the targets (upeps) then shuffle
-          checked_decoy_peps = []
-          for decoy_pep in decoy_peps:
-            if len(decoy_pep) < self._min_peptide_length:
-              checked_decoy_peps.append(decoy_pep)
-              continue
+          found_in_target = False
+          aPep = ''
+          if decoy_pep in in_target:
+            found_in_target = True
+          else:
+            checked_decoy_peps.append(decoy_pep)
+            continue
 
-            found_in_target = False
-            aPep = ''
-            if decoy_pep in upeps:
-              found_in_target = True
-            else:
+          if found_in_target and not self._no_suffle:
+            aPep = self.pgdbdeep_alternative(decoy_pep, upeps)
+            # warn if peptide has no suitable alternative, add to removal list
+            if not aPep and decoy_pep not in seen_no_alternative:
+              seen_no_alternative.add(decoy_pep)
+              noAlternative.append(decoy_pep)
+          # if decoy is generated then add to the list of peptides
+          if aPep:
+            checked_decoy_peps.append(aPep)
+          else:
+            if self._keep_target_hits:
               checked_decoy_peps.append(decoy_pep)
-              continue
-
-            if found_in_target and not self._no_suffle and decoy_pep not in noAlternative:
-              aPep = decoy_pep
-              # shuffle until aPep is not in target set (maximum of 10 iterations)
-              i = 0
-              while aPep in upeps and i < self._max_iterations:
-                # increment iteration counter
-                i += 1
-                # shuffle peptide
-                aPep = self.shuffle(aPep)
-
-                # check if shuffling has an effect if not end iterations
-                if aPep == decoy_pep:
-                  i = self._max_iterations
-
-                # warn if peptide has no suitable alternative, add to removal list
-                if i == self._max_iterations:
-                  noAlternative.add(decoy_pep)
-                  aPep = ''
-            # if decoy is generated then add to the list of peptides
-            if aPep:
-              checked_decoy_peps.append(aPep)
-            else:
-              if self._keep_target_hits:
-                checked_decoy_peps.append(decoy_pep)
-          # finally join the peptides to generate protein decoy
-          if checked_decoy_peps:
-            revprotseq.append(''.join(checked_decoy_peps))
-
-        if (self._use_suffix):
-          outfa.write(
-            '>{}\n{}\n'.format(str(record.id) + self._decoy_suffix + ' ' + record.description, '*'.join(revprotseq)))
-        else :
-          outfa.write(
-            '>{}\n{}\n'.format(self._decoy_prefix + str(record.id) + ' ' + record.description, '*'.join(revprotseq)))
-        decoys.append('*'.join(revprotseq))
-
-      with open(self._output_file.replace('.fa', '') + '_noAlternative.fa', 'w') as noAlternative_outfa:
-        noAlternative_outfa.write('\n'.join(noAlternative) + '\n')
-      print('Number of skipped tryptic peptides in decoy db (no alternatives): {}'.
-            format(len(noAlternative)))
-      print('Total number of amino acids in target and decoy databases: ',
-            len(''.join(targets)), len(''.join(decoys)))
+        # finally join the peptides to generate protein decoy
+        if checked_decoy_peps:
+          revprotseq.append(''.join(checked_decoy_peps))
+
+      if (self._use_suffix):
+        lines.append('>{}\n{}\n'.format(id_protein + self._decoy_suffix + ' ' + description, '*'.join(revprotseq)))
+      else :
+        lines.append('>{}\n{}\n'.format(self._decoy_prefix + id_protein + ' ' + description, '*'.join(revprotseq)))
+      decoy_length += len('*'.join(revprotseq))
+    return ''.join(lines), noAlternative, target_length, decoy_length
 
   def decoy_database(self):
     """
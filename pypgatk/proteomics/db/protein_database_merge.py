@@ -0,0 +1,200 @@
+"""
+This module merges protein databases into a non-redundant database: the proteins with the same sequence are written
+once, under the accessions of all of them. Proteins are grouped by a hash of their sequence in memory; when the
+proteins read exceed the memory budget they are written to sorted runs on disk, merged at the end. The merged
+proteins are written in the order of their first occurrence in the input databases.
+"""
+
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from itertools import groupby
+
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+# memory used by a protein besides its sequence and header (bytes, estimate)
+ENTRY_OVERHEAD = 300
+
+
+def open_fasta(fasta_file, mode='r'):
+  """
+  Open a plain or gzip compressed FASTA file in text mode. Input compression is detected from the file content,
+  output files are compressed when their name ends with .gz
+  """
+  if mode.startswith('w'):
+    return gzip.open(fasta_file, 'wt') if fasta_file.endswith('.gz') else open(fasta_file, 'w')
+  with open(fasta_file, 'rb') as handle:
+    magic = handle.read(2)
+  if magic == b'\x1f\x8b':
+    return gzip.open(fasta_file, 'rt')
+  return open(fasta_file, 'r')
+
+
+def sequence_digest(seq):
+  return hashlib.md5(seq.encode()).hexdigest()
+
+
+def _write_run(entries, run_file):
+  """
+  Write entries (one json list per line) to a run file
+  """
+  with open(run_file, 'w') as run_handle:
+    for entry in entries:
+      run_handle.write(json.dumps(entry, separators=(',', ':')))
+      run_handle.write('\n')
+  return run_file
+
+
+def _read_run(run_file):
+  with open(run_file, 'r') as run_handle:
+    for line in run_handle:
+      yield json.loads(line)
+
+
+class ProteinMerger:
+  """
+  Non-redundant merge of protein databases. A merged protein is kept as [digest, first index, sequence,
+  headers], the index being the position of its first occurrence in the input databases.
+  """
+
+  def __init__(self, memory_limit=1024 ** 3, temp_dir=None, accession_separator=';'):
+    """
+    :param memory_limit: memory used by the proteins kept in memory (bytes) before they are written to disk
+    :param temp_dir: folder of the temporary runs
+    :param accession_separator: separator of the accessions of the proteins merged into one
+    """
+    self._memory_limit = memory_limit
+    self._temp_dir = temp_dir
+    self._accession_separator = accession_separator
+    self._proteins = {}
+    self._memory = 0
+    self._runs = []
+    self._work_dir = None
+    self.stats = {'input_sequences': 0, 'input_residues': 0, 'output_sequences': 0, 'output_residues': 0,
+                  'spilled_runs': 0}
+
+  def _run_file(self, prefix):
+    if self._work_dir is None:
+      self._work_dir = tempfile.mkdtemp(prefix='merge_proteindb_', dir=self._temp_dir)
+    return os.path.join(self._work_dir, '{}_{:06d}.jsonl'.format(prefix, len(os.listdir(self._work_dir))))
+
+  def add_fasta(self, fasta_file):
+    """
+    Add the proteins of a FASTA file (plain or gzip)
+    """
+    with open_fasta(fasta_file) as fasta_handle:
+      for title, seq in SimpleFastaParser(fasta_handle):
+        self.add(title, seq)
+
+  def add(self, header, seq):
+    """
+    Add a protein
+    :param header: FASTA header without >
+    :param seq: protein sequence
+    """
+    protein = self._proteins.get(seq)
+    if protein is None:
+      self._proteins[seq] = [self.stats['input_sequences'], [header]]
+      self._memory += len(seq) + len(header) + ENTRY_OVERHEAD
+    else:
+      protein[1].append(header)
+      self._memory += len(header) + ENTRY_OVERHEAD // 4
+    self.stats['input_sequences'] += 1
+    self.stats['input_residues'] += len(seq)
+    if self._memory > self._memory_limit:
+      self._spill()
+
+  def _spill(self):
+    """
+    Write the proteins in memory to a run sorted by sequence digest
+    """
+    entries = sorted(([sequence_digest(seq), index, seq, headers] for seq, (index, headers) in self._proteins.items()),
+                     key=lambda entry: (entry[0], entry[2]))
+    self._runs.append(_write_run(entries, self._run_file('digest')))
+    self.stats['spilled_runs'] += 1
+    self._proteins = {}
+    self._memory = 0
+
+  def _merged_proteins(self):
+    """
+    Merged proteins ([digest, first index, sequence, headers]) in first occurrence order
+    """
+    if not self._runs:
+      # the dict order is not the insertion order before Python 3.7
+      for seq, (index, headers) in sorted(self._proteins.items(), key=lambda item: item[1][0]):
+        yield [None, index, seq, headers]
+      return
+
+    self._spill()
+    # the same sequence from several runs: the headers are merged in input order
+    merged = heapq.merge(*[_read_run(run) for run in self._runs], key=lambda entry: (entry[0], entry[2]))
+    index_runs = []
+    batch = []
+    batch_memory = 0
+    for _, parts in groupby(merged, key=lambda entry: (entry[0], entry[2])):
+      parts = sorted(parts, key=lambda entry: entry[1])
+      protein = [parts[0][0], parts[0][1], parts[0][2], [header for part in parts for header in part[3]]]
+      batch.append(protein)
+      batch_memory += len(protein[2]) + sum(len(header) for header in protein[3]) + ENTRY_OVERHEAD
+      if batch_memory > self._memory_limit:
+        index_runs.append(_write_run(sorted(batch, key=lambda entry: entry[1]), self._run_file('index')))
+        batch = []
+        batch_memory = 0
+    batch.sort(key=lambda entry: entry[1])
+    yield from heapq.merge(*[_read_run(run) for run in index_runs], batch, key=lambda entry: entry[1])
+
+  def merged_header(self, headers):
+    """
+    Header of a merged protein: the accessions of the proteins (once each, in input order) and the description
+    of the first one
+    """
+    accessions = []
+    seen = set()
+    for header in headers:
+      accession = header.split(None, 1)[0] if header.strip() else ''
+      if accession not in seen:
+        seen.add(accession)
+        accessions.append(accession)
+    words = headers[0].split(None, 1)
+    description = words[1] if len(words) > 1 else ''
+    header = self._accession_separator.join(accessions)
+    return header + ' ' + description if description else header
+
+  def write(self, output_file):
+    """
+    Write the merged database (gzip compressed when the name ends with .gz)
+    :param output_file: output FASTA file
+    :return: statistics of the merge
+    """
+    try:
+      with open_fasta(output_file, 'w') as output_handle:
+        for _, _, seq, headers in self._merged_proteins():
+          output_handle.write('>{}\n{}\n'.format(self.merged_header(headers), seq))
+          self.stats['output_sequences'] += 1
+          self.stats['output_residues'] += len(seq)
+    finally:
+      if self._work_dir is not None:
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+        self._work_dir = None
+    return self.stats
+
+
+def merge_protein_databases(input_files, output_file, memory_limit=1024 ** 3, temp_dir=None,
+                            accession_separator=';'):
+  """
+  Merge protein databases into a non-redundant database, see ProteinMerger
+  :param input_files: FASTA files (plain or gzip)
+  :param output_file: output FASTA file (gzip compressed when the name ends with .gz)
+  :param memory_limit: memory used by the proteins kept in memory (bytes) before they are written to disk
+  :param temp_dir: folder of the temporary files (default: the system temporary folder)
+  :param accession_separator: separator of the accessions of the proteins merged into one
+  :return: statistics of the merge (number of sequences and residues of the input and output databases)
+  """
+  merger = ProteinMerger(memory_limit, temp_dir, accession_separator)
+  for input_file in input_files:
+    merger.add_fasta(input_file)
+  return merger.write(output_file)
@@ -0,0 +1,189 @@
+"""
+This module implements the enzymatic digestion of proteins. The cleavage rules of the Enzymes table are regular
+expressions made of lookarounds, e.g. '(?<=[KRX])(?!P)' for Trypsin; each rule is compiled once into lookup
+tables of the residues, and the cleavage sites of a protein are found with NumPy instead of a regular expression
+scan. Peptides are described by their start/end offsets and only sliced from the protein when needed.
+The peptides are the same as the ones of pyteomics.parser.cleave(sequence, rule, missed_cleavages, min_length,
+max_length), and cleave returns them as a set built in the same order.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from pypgatk.proteomics.models import PYGPATK_ENZYMES
+
+_LOOKAROUND = re.compile(r'\(\?(<=|=|!)((?:\[[^\]\[]+\]|[A-Za-z])+)\)')
+_ATOM = re.compile(r'\[([^\]]+)\]|([A-Za-z])')
+
+
+def _residue_table(residues):
+  """
+  Lookup table of the residues of a character class, e.g. 'KRX' or 'A-Z'
+  """
+  table = np.zeros(256, dtype=bool)
+  i = 0
+  while i < len(residues):
+    if i + 2 < len(residues) and residues[i + 1] == '-':
+      table[ord(residues[i]):ord(residues[i + 2]) + 1] = True
+      i += 3
+    else:
+      table[ord(residues[i])] = True
+      i += 1
+  return table
+
+
+def _split_alternatives(rule):
+  """
+  Alternatives of a rule split at the | outside parentheses, without their enclosing parentheses
+  """
+  alternatives = []
+  depth = 0
+  start = 0
+  for i, char in enumerate(rule + '|'):
+    if char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+    elif char == '|' and depth == 0:
+      alternative = rule[start:i]
+      while alternative.startswith('((') and alternative.endswith('))') and \
+          _LOOKAROUND.fullmatch(alternative[1:-1]):
+        alternative = alternative[1:-1]
+      alternatives.append(alternative)
+      start = i + 1
+  return alternatives
+
+
+def _compile_rule(rule):
+  """
+  Lookarounds of a rule: list of alternatives, an alternative being a list of (kind, residue tables) with kind
+  '<=' (lookbehind), '=' (lookahead) or '!' (negative lookahead). None if the rule is not made of lookarounds.
+  """
+  alternatives = []
+  for alternative in _split_alternatives(rule):
+    lookarounds = []
+    position = 0
+    for match in _LOOKAROUND.finditer(alternative):
+      if match.start() != position:
+        return None
+      position = match.end()
+      tables = [_residue_table(residues if residues else residue)
+                for residues, residue in _ATOM.findall(match.group(2))]
+      lookarounds.append((match.group(1), tables))
+    if position != len(alternative) or not lookarounds:
+      return None
+    alternatives.append(lookarounds)
+  return alternatives
+
+
+class CleavageRule:
+  """
+  Compiled cleavage rule, rules that are not made of lookarounds are scanned with their regular expression.
+  """
+
+  def __init__(self, rule):
+    self.rule = rule
+    self._pattern = re.compile(rule)
+    self._alternatives = _compile_rule(rule)
+
+  def _site_mask(self, residues, lookarounds):
+    length = len(residues)
+    mask = np.ones(length + 1, dtype=bool)
+    for kind, tables in lookarounds:
+      width = len(tables)
+      if width > length:
+        if kind != '!':
+          mask[:] = False
+        continue
+      matches = np.ones(length - width + 1, dtype=bool)
+      for i, table in enumerate(tables):
+        matches &= table[residues[i:length - width + 1 + i]]
+      if kind == '<=':
+        mask[:width] = False
+        mask[width:] &= matches
+      elif kind == '=':
+        mask[:length - width + 1] &= matches
+        mask[length - width + 1:] = False
+      else:
+        mask[:length - width + 1] &= ~matches
+    return mask
+
+  def cleavage_sites(self, sequence):
+    """
+    Cleavage sites of a protein, the offsets where the rule matches (as the ends of re.finditer(rule, sequence))
+    :param sequence: protein sequence
+    :return: numpy array of offsets
+    """
+    if self._alternatives is not None:
+      try:
+        residues = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+      except UnicodeEncodeError:
+        residues = None
+      if residues is not None:
+        mask = self._site_mask(residues, self._alternatives[0])
+        for lookarounds in self._alternatives[1:]:
+          mask |= self._site_mask(residues, lookarounds)
+        return np.flatnonzero(mask)
+    return np.array([match.end() for match in self._pattern.finditer(sequence)], dtype=np.int64)
+
+  def peptide_bounds(self, sequence, missed_cleavages=0, min_length=None, max_length=None):
+    """
+    Offsets of the peptides of a protein, in the order of pyteomics.parser.icleave (by end, then by start)
+    :param sequence: protein sequence
+    :param missed_cleavages: maximum number of missed cleavages
+    :param min_length: minimum peptide length (default 1)
+    :param max_length: maximum peptide length (default the protein length)
+    :return: numpy arrays of the starts and ends of the peptides
+    """
+    if min_length is None:
+      min_length = 1
+    if max_length is None:
+      max_length = len(sequence)
+    bounds = np.concatenate(([0], self.cleavage_sites(sequence), [len(sequence)]))
+    ends = np.arange(1, len(bounds))[:, None]
+    starts = ends - np.arange(missed_cleavages + 1, 0, -1)[None, :]
+    valid = starts >= 0
+    starts = bounds[np.where(valid, starts, 0)]
+    ends = np.broadcast_to(bounds[ends], starts.shape)
+    lengths = ends - starts
+    valid &= (lengths > 0) & (lengths >= min_length) & (lengths <= max_length)
+    return starts[valid], ends[valid]
+
+  def peptides(self, sequence, missed_cleavages=0, min_length=None, max_length=None):
+    """
+    Peptides of a protein in the order of pyteomics.parser.icleave, a peptide found at several offsets is
+    repeated
+    :return: list of peptides
+    """
+    starts, ends = self.peptide_bounds(sequence, missed_cleavages, min_length, max_length)
+    return [sequence[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+  def cleave(self, sequence, missed_cleavages=0, min_length=None, max_length=None):
+    """
+    Set of the peptides of a protein, same as pyteomics.parser.cleave
+    :param sequence: protein sequence
+    :param missed_cleavages: maximum number of missed cleavages
+    :param min_length: minimum peptide length (default 1)
+    :param max_length: maximum peptide length (default the protein length)
+    :return: set of peptides
+    """
+    return set(self.peptides(sequence, missed_cleavages, min_length, max_length))
+
+
+@lru_cache(maxsize=None)
+def get_cleavage_rule(rule):
+  """
+  Compiled cleavage rule, each rule is compiled once per process
+  """
+  return CleavageRule(rule)
+
+
+def enzyme_cleavage_rule(enzyme):
+  """
+  Compiled cleavage rule of an enzyme of the Enzymes table
+  :param enzyme: enzyme name, e.g. 'Trypsin'
+  :return: CleavageRule
+  """
+  return get_cleavage_rule(PYGPATK_ENZYMES.enzymes[enzyme]['cleavage rule'])
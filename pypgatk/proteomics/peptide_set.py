@@ -0,0 +1,273 @@
+"""
+This module implements a compact set of peptides for the target/decoy membership tests of the decoy generation.
+Peptides are kept as 64-bit hashes in a sorted NumPy array, next to the offsets of the peptides in one bytes
+buffer (each peptide followed by a new line); a hash found in the set is always verified against the peptide, so
+membership is exact even when two peptides share a hash. A peptide costs 12 bytes plus its length, instead of
+about 100 bytes in a Python set of str. The peptides added are buffered in a Python set and merged into the sorted
+hashes every buffer_size peptides. An optional Bloom filter in front of the hashes rejects most of the peptides
+that are not in the set. Iteration follows the hash order, which does not depend on the order the peptides were
+added in.
+"""
+
+import math
+
+import numpy as np
+
+DEFAULT_BUFFER_SIZE = 500000
+# peptides hashed at once (memory of the hashing: about 10 bytes per residue)
+HASH_BLOCK_SIZE = 65536
+
+_HASH_BASE = 0x100000001b3
+_MASK = (1 << 64) - 1
+# powers of the hash base, extended to the longest peptide hashed
+_hash_powers = np.ones(1, dtype=np.uint64)
+
+
+def _mix(h):
+  """
+  splitmix64 finalizer of a hash (numpy uint64 array)
+  """
+  h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+  h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+  return h ^ (h >> np.uint64(31))
+
+
+def peptide_hash(peptide):
+  """
+  64-bit hash of an encoded peptide, the same as peptide_hashes and in every process (unlike hash())
+  """
+  h = 0
+  power = 1
+  for code in peptide + b'\n':
+    h = (h + code * power) & _MASK
+    power = (power * _HASH_BASE) & _MASK
+  h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+  h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _MASK
+  return h ^ (h >> 31)
+
+
+def _powers(length):
+  global _hash_powers
+  if len(_hash_powers) < length:
+    _hash_powers = np.ones(max(length, 2 * len(_hash_powers)), dtype=np.uint64)
+    _hash_powers[1:] = np.cumprod(np.full(len(_hash_powers) - 1, _HASH_BASE, dtype=np.uint64))
+  return _hash_powers
+
+
+def peptide_hashes(data, starts):
+  """
+  64-bit hashes of the peptides of a buffer, a polynomial hash of the residues of each peptide
+  :param data: peptides, each one followed by a new line
+  :param starts: offsets of the peptides in data (numpy array, increasing)
+  :return: numpy array (uint64)
+  """
+  codes = np.frombuffer(data, dtype=np.uint8)
+  hashes = np.empty(len(starts), dtype=np.uint64)
+  for block in range(0, len(starts), HASH_BLOCK_SIZE):
+    block_starts = starts[block:block + HASH_BLOCK_SIZE]
+    block_end = starts[block + HASH_BLOCK_SIZE] if block + HASH_BLOCK_SIZE < len(starts) else len(codes)
+    lengths = np.diff(np.append(block_starts, block_end))
+    local = np.arange(block_starts[0], block_end) - np.repeat(block_starts, lengths)
+    weighted = codes[block_starts[0]:block_end].astype(np.uint64) * _powers(lengths.max())[local]
+    hashes[block:block + HASH_BLOCK_SIZE] = np.add.reduceat(weighted, block_starts - block_starts[0])
+  return _mix(hashes)
+
+
+class PeptideSet:
+  """
+  Set of peptides (str) supporting add, update, in, len, iteration and intersection
+  """
+
+  def __init__(self, peptides=None, bloom_filter_bits=0, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    :param peptides: peptides added to the set
+    :param bloom_filter_bits: bits of the Bloom filter per peptide, 0 for no Bloom filter
+    :param buffer_size: number of peptides buffered before they are merged into the sorted hashes
+    """
+    self._bloom_filter_bits = bloom_filter_bits
+    self._buffer_size = buffer_size
+    self.clear()
+    if peptides is not None:
+      self.update(peptides)
+
+  def clear(self):
+    self._pending = set()
+    self._hashes = np.zeros(0, dtype=np.uint64)
+    self._starts = np.zeros(0, dtype=np.uint32)
+    self._data = bytearray()
+    self._bloom = None
+    self._bloom_capacity = 0
+    self._bloom_hashes = max(1, round(self._bloom_filter_bits * math.log(2)))
+
+  @property
+  def nbytes(self):
+    """
+    Memory used by the merged peptides (bytes), without the peptides still buffered
+    """
+    bloom_bytes = 0 if self._bloom is None else self._bloom.nbytes
+    return self._hashes.nbytes + self._starts.nbytes + len(self._data) + bloom_bytes
+
+  def add(self, peptide):
+    self._pending.add(peptide)
+    if len(self._pending) >= self._buffer_size:
+      self.compact()
+
+  def update(self, peptides):
+    self._pending.update(peptides)
+    if len(self._pending) >= self._buffer_size:
+      self.compact()
+
+  def _matches(self, position, peptide):
+    start = int(self._starts[position])
+    return self._data.startswith(peptide, start) and self._data[start + len(peptide)] == 10
+
+  def _peptide(self, position):
+    start = int(self._starts[position])
+    return self._data[start:self._data.index(10, start)].decode()
+
+  def _find(self, hashes, peptides):
+    """
+    Membership of encoded peptides in the merged hashes
+    :return: numpy array of booleans
+    """
+    found = np.zeros(len(peptides), dtype=bool)
+    if not len(self._hashes):
+      return found
+    candidates = np.arange(len(peptides))
+    if self._bloom is not None:
+      candidates = candidates[self._bloom_contains(hashes)]
+    positions = np.searchsorted(self._hashes, hashes[candidates])
+    hits = positions < len(self._hashes)
+    candidates, positions = candidates[hits], positions[hits]
+    hits = self._hashes[positions] == hashes[candidates]
+    for i, position in zip(candidates[hits].tolist(), positions[hits].tolist()):
+      h = self._hashes[position]
+      while position < len(self._hashes) and self._hashes[position] == h:
+        if self._matches(position, peptides[i]):
+          found[i] = True
+          break
+        position += 1
+    return found
+
+  def _bloom_positions(self, hashes):
+    h1 = hashes & np.uint64(0xffffffff)
+    h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+    steps = np.arange(self._bloom_hashes, dtype=np.uint64)
+    return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(len(self._bloom) * 8)
+
+  def _bloom_contains(self, hashes):
+    contained = np.empty(len(hashes), dtype=bool)
+    for block in range(0, len(hashes), HASH_BLOCK_SIZE):
+      positions = self._bloom_positions(hashes[block:block + HASH_BLOCK_SIZE])
+      bits = self._bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)
+      contained[block:block + HASH_BLOCK_SIZE] = (bits & 1).all(axis=1)
+    return contained
+
+  def _bloom_add(self, hashes):
+    """
+    Add hashes to the Bloom filter, the filter is rebuilt twice as large when it is full
+    """
+    if not self._bloom_filter_bits:
+      return
+    if len(self._hashes) > self._bloom_capacity:
+      self._bloom_capacity = max(2 * len(self._hashes), 1024)
+      self._bloom = np.zeros((self._bloom_capacity * self._bloom_filter_bits + 7) // 8, dtype=np.uint8)
+      hashes = self._hashes
+    for block in range(0, len(hashes), HASH_BLOCK_SIZE):
+      positions = self._bloom_positions(hashes[block:block + HASH_BLOCK_SIZE]).ravel()
+      np.bitwise_or.at(self._bloom, positions >> np.uint64(3),
+                       np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8)))
+
+  def _contains_hash(self, peptide, h):
+    if self._bloom is not None:
+      h1 = h & 0xffffffff
+      h2 = (h >> 32) | 1
+      bits = len(self._bloom) * 8
+      for step in range(self._bloom_hashes):
+        position = (h1 + step * h2) % bits
+        if not (self._bloom[position >> 3] >> (position & 7)) & 1:
+          return False
+    h = np.uint64(h)
+    position = int(self._hashes.searchsorted(h))
+    while position < len(self._hashes) and self._hashes[position] == h:
+      if self._matches(position, peptide):
+        return True
+      position += 1
+    return False
+
+  def compact(self):
+    """
+    Merge the buffered peptides into the sorted hashes
+    """
+    if not self._pending:
+      return
+    peptides = [peptide.encode() for peptide in self._pending]
+    self._pending = set()
+    lengths = np.fromiter(map(len, peptides), dtype=np.int64, count=len(peptides)) + 1
+    hashes = peptide_hashes(b'\n'.join(peptides) + b'\n', np.cumsum(lengths) - lengths)
+    new = ~self._find(hashes, peptides)
+    peptides = [peptide for peptide, is_new in zip(peptides, new.tolist()) if is_new]
+    hashes, lengths = hashes[new], lengths[new]
+    starts = len(self._data) + np.cumsum(lengths) - lengths
+    self._data += b'\n'.join(peptides) + b'\n' if peptides else b''
+    if len(self._data) > np.iinfo(self._starts.dtype).max:
+      self._starts = self._starts.astype(np.uint64)
+    order = np.argsort(hashes)
+    hashes = hashes[order]
+    positions = np.searchsorted(self._hashes, hashes)
+    self._hashes = np.insert(self._hashes, positions, hashes)
+    self._starts = np.insert(self._starts, positions, starts[order].astype(self._starts.dtype))
+    self._bloom_add(hashes)
+
+  def __len__(self):
+    self.compact()
+    return len(self._hashes)
+
+  def __contains__(self, peptide):
+    if peptide in self._pending:
+      return True
+    if not len(self._hashes):
+      return False
+    encoded = peptide.encode()
+    return self._contains_hash(encoded, peptide_hash(encoded))
+
+  def contains(self, peptides):
+    """
+    Membership of several peptides, the buffered peptides are merged first
+    :param peptides: list of peptides
+    :return: numpy array of booleans
+    """
+    self.compact()
+    if not peptides or not len(self._hashes):
+      return np.zeros(len(peptides), dtype=bool)
+    encoded = [peptide.encode() for peptide in peptides]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)) + 1
+    return self._find(peptide_hashes(b'\n'.join(encoded) + b'\n', np.cumsum(lengths) - lengths), encoded)
+
+  def __iter__(self):
+    self.compact()
+    for position in range(len(self._hashes)):
+      yield self._peptide(position)
+
+  def intersection(self, peptides):
+    """
+    Peptides of the set that are also in peptides
+    :param peptides: PeptideSet or iterable of peptides
+    :return: PeptideSet
+    """
+    if isinstance(peptides, PeptideSet):
+      self.compact()
+      peptides.compact()
+      if len(peptides) > len(self):
+        return peptides.intersection(self)
+      if not len(peptides):
+        return PeptideSet(buffer_size=self._buffer_size)
+      # only the peptides with a hash in both sets are compared
+      positions = np.minimum(np.searchsorted(self._hashes, peptides._hashes), len(self._hashes) - 1)
+      candidates = np.flatnonzero(self._hashes[positions] == peptides._hashes)
+      peptides = [peptides._peptide(position) for position in candidates.tolist()]
+    else:
+      peptides = list(peptides)
+    common = self.contains(peptides)
+    return PeptideSet((peptide for peptide, is_common in zip(peptides, common.tolist()) if is_common),
+                      buffer_size=self._buffer_size)
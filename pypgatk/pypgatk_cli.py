@@ -19,6 +19,8 @@ from pypgatk.commands import parse_gtf as parse_gtf_cmd
 from pypgatk.commands import vcf_to_proteindb as vcf_to_proteindb_cmd
 from pypgatk.commands import dnaseq_to_proteindb as dnase_to_proteindb_cmd
 from pypgatk.commands import proteindb_decoy as proteindb_decoy_cmd
+from pypgatk.commands import genome_to_transcripts as genome_to_transcripts_cmd
+from pypgatk.commands import proteindb_merge as proteindb_merge_cmd
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -40,6 +42,8 @@ cli.add_command(parse_gtf_cmd.parse_gtf)
 cli.add_command(vcf_to_proteindb_cmd.vcf_to_proteindb)
 cli.add_command(dnase_to_proteindb_cmd.dnaseq_to_proteindb)
 cli.add_command(proteindb_decoy_cmd.generate_database)
+cli.add_command(genome_to_transcripts_cmd.genome_to_transcripts)
+cli.add_command(proteindb_merge_cmd.merge_proteindb)
 
 
 
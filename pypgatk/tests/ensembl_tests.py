@@ -1,15 +1,441 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
+import gffutils
+import pysam
+import vcf
+import yaml
+from Bio import SeqIO
+from Bio.Seq import Seq
 from pyteomics.parser import cleave
 
+from pypgatk.ensembl.ensembl import EnsemblDataService
+from pypgatk.ensembl.featuredb import _attributes_parser, create_featuredb, create_featuredb_gffutils, \
+  featuredb_tables, is_featuredb, is_validated_gffutils
+from pypgatk.ensembl.genome_transcripts import chromosome_transcripts, transcript_header
+from pypgatk.ensembl.transcript_model import TranscriptModel, TranscriptContextCache, TranscriptCoordinates
+from pypgatk.ensembl.transcript_overlaps import TranscriptIntervalIndex
+from pypgatk.proteomics.db.protein_database_decoy import ProteinDBDecoyService
+from pypgatk.proteomics.db.protein_database_merge import merge_protein_databases
+from pypgatk.proteomics.digestion import enzyme_cleavage_rule
 from pypgatk.proteomics.models import PYGPATK_ENZYMES
+from pypgatk.proteomics.peptide_set import PeptideSet
+from pypgatk.toolbox.artifact_cache import ArtifactCache
+from pypgatk.toolbox.fasta_index import FastaIndex, default_index_file, index_matches
+from pypgatk.toolbox.sequence_store import SequenceStore, build_sequence_store, pack_sequence
+from pypgatk.toolbox.translation import find_orfs, reverse_complement_bytes, translate, translate_frames
+from pypgatk.toolbox.vcf_reader import VcfReader, open_vcf, parse_regions
 
 
 class MyTestCase(unittest.TestCase):
 
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
   def test_something(self):
     self.assertEqual(True, True)
 
+  def test_transcript_model(self):
+    db = gffutils.FeatureDB('testdata/test.db')
+    transcript_model = TranscriptModel.from_db(db)
+    self.assertEqual(len(transcript_model), 22)
+    for transcript in db.features_of_type('transcript'):
+      for feature_types in (['exon'], ['CDS', 'stop_codon']):
+        self.assertEqual(EnsemblDataService.get_features(db, transcript.id, '', feature_types),
+                         transcript_model.get_features(transcript.id, feature_types))
+    self.assertEqual(transcript_model.get_features('ENST_NOT_FOUND'), (None, None, None))
+
+  def test_transcript_context_cache(self):
+    loaded = []
+
+    def loader(transcript_id):
+      if transcript_id == 'ENST_NOT_FOUND':
+        raise KeyError(transcript_id)
+      loaded.append(transcript_id)
+      return transcript_id
+
+    contexts = TranscriptContextCache(loader, max_size=2)
+    for transcript_id in ['T1', 'T1', 'T2', 'T1', 'T3', 'T1', 'T2']:
+      self.assertEqual(contexts.get(transcript_id, 1), transcript_id)
+    # T2 was the least recently used transcript when T3 was added
+    self.assertEqual(loaded, ['T1', 'T2', 'T3', 'T2'])
+    self.assertEqual((contexts.hits, contexts.misses), (3, 4))
+    self.assertEqual(len(contexts), 2)
+    self.assertRaises(KeyError, contexts.get, 'ENST_NOT_FOUND', 1)
+
+  def test_translate_alt_orf(self):
+    ref_seq = Seq('ATGGCTTGGAAACCCGGGTTTTAACTGCAT')
+    ref_orf = ref_seq.translate()
+    # SNV, in-frame deletion, in-frame insertion and frameshift
+    for start, end, allele in [(4, 5, 'G'), (9, 12, ''), (10, 11, 'CTTTA'), (6, 7, 'TA'), (28, 30, 'A')]:
+      alt_seq = ref_seq[:start] + allele + ref_seq[end:]
+      self.assertEqual(str(EnsemblDataService.translate_alt_orf(ref_orf, alt_seq, start, end,
+                                                                len(alt_seq) - len(ref_seq), 1)),
+                       str(alt_seq.translate()))
+
+  def test_transcript_coordinates(self):
+    features = [[10, 19, 'CDS'], [30, 34, 'CDS'], [40, 42, 'stop_codon']]
+    coordinates = TranscriptCoordinates(features)
+    self.assertEqual(coordinates.length, 18)
+    self.assertEqual([coordinates.to_transcript(pos) for pos in (9, 10, 19, 25, 30, 34, 42, 43)],
+                     [None, 0, 9, None, 10, 14, 17, None])
+    for var_start, var_end in [(0, 9), (0, 10), (20, 29), (20, 30), (35, 39), (42, 50), (43, 50), (11, 12)]:
+      self.assertEqual(coordinates.overlaps(var_start, var_end),
+                       any(start <= var_end and var_start <= end for start, end, _ in features))
+
+    seq = Seq('AAAAACCCCCGGGGGTTT')
+    ref_seq, alt_seq, offsets = EnsemblDataService.get_altseq(seq, Seq('G'), Seq('T'), 31, '-', features,
+                                                              with_offsets=True)
+    # position 31 is the 12th base of the features, counted on the reverse of the minus strand sequence
+    reverse_seq = str(seq)[::-1]
+    self.assertEqual((str(ref_seq), str(alt_seq), offsets),
+                     (str(seq), (reverse_seq[:11] + 'A' + reverse_seq[12:])[::-1], (6, 7)))
+
+  def test_translation_engine(self):
+    for seq in ['ATGGCTTGGAAACCCGGGTTTTAACTGCAT', 'atgNNNTARGCYtgaAGA', 'ATGAGATGA', 'AT', '']:
+      for table in [1, 2, 11]:
+        self.assertEqual(translate_frames(seq, table),
+                         [str(Seq(seq)[frame:].translate(table=table)) for frame in range(3)])
+        self.assertEqual(translate(Seq(seq), table, to_stop=True), str(Seq(seq).translate(table=table, to_stop=True)))
+    # the invalid codons after the first stop codon are not translated
+    for seq in ['ATGTAAJ?QGCT', 'ATGTRAJ?Q', 'ATGNNNtagJ?Q']:
+      self.assertEqual(translate(seq, to_stop=True), str(Seq(seq).translate(to_stop=True)))
+
+  def test_three_frame_translation(self):
+    records = [(record.id, str(record.seq)) for record in SeqIO.parse('testdata/test.fa', 'fasta')]
+    six_frames = SeqIO.to_dict(SeqIO.parse(io.StringIO(EnsemblDataService.translate_frames_records(
+      records, num_frames=6)), 'fasta'))
+    orfs = EnsemblDataService.translate_frames_records(records, num_frames=6, min_orf_length=20)
+    for record_id, seq in records:
+      frames = [Seq(seq)[frame:] for frame in range(3)] + [Seq(seq).reverse_complement()[frame:] for frame in range(3)]
+      for frame_number, frame in enumerate(frames, 1):
+        protein = str(frame[:len(frame) // 3 * 3].translate())
+        self.assertEqual(str(six_frames['{}_RF{}'.format(record_id, frame_number)].seq), protein)
+        for orf in protein.split('*'):
+          self.assertEqual('\n' + orf + '\n' in orfs, len(orf) >= 20)
+
+    # the chunks translated by several workers are written in input order
+    outputs = []
+    for workers in [1, 2]:
+      ensembl_data_service = EnsemblDataService('config/ensembl_config.yaml', {EnsemblDataService.WORKERS: workers})
+      ensembl_data_service._proteindb_output = os.path.join(self.tmp_dir, 'threeframe_{}.fa'.format(workers))
+      ensembl_data_service.TRANSLATION_CHUNK_SIZE = 10000
+      with open(ensembl_data_service.three_frame_translation('testdata/test.fa'), 'r') as output_handle:
+        outputs.append(output_handle.read())
+    self.assertEqual(outputs[0], outputs[1])
+    self.assertEqual(outputs[0].count('>'), 3 * len(records))
+
+  def test_dnaseq_to_proteindb(self):
+    self.assertEqual(EnsemblDataService.dnaseq_header_values('t1 CDS=10-20 transcript_biotype=protein_coding'),
+                     {'CDS': '10-20', 'transcript_biotype': 'protein_coding'})
+    self.assertEqual(EnsemblDataService.dnaseq_header_values('t2|CDS|biotype:lncRNA'),
+                     {'CDS': None, 'biotype': 'lncRNA'})
+
+    # the same proteins are written by several workers, and from the packed sequences
+    outputs = []
+    for workers, packed_sequences in [(1, False), (2, False), (1, True), (2, True)]:
+      ensembl_data_service = EnsemblDataService('config/ensembl_config.yaml',
+                                                {EnsemblDataService.WORKERS: workers,
+                                                 EnsemblDataService.INCLUDE_BIOTYPES: 'all',
+                                                 EnsemblDataService.PACKED_SEQUENCES: packed_sequences})
+      ensembl_data_service._proteindb_output = os.path.join(self.tmp_dir, 'dnaseq_{}_{}.fa'.format(
+        workers, packed_sequences))
+      ensembl_data_service.TRANSLATION_CHUNK_SIZE = 10000
+      with open(ensembl_data_service.dnaseq_to_proteindb('testdata/test.fa'), 'r') as output_handle:
+        outputs.append(output_handle.read())
+    self.assertEqual(outputs[1:], outputs[:1] * 3)
+    self.assertTrue(outputs[0].startswith('>'))
+
+  def test_find_orfs(self):
+    for record in SeqIO.parse('testdata/test.fa', 'fasta'):
+      expected = []
+      for frame in range(3):
+        protein = str(record.seq[frame:frame + (len(record.seq) - frame) // 3 * 3].translate())
+        start = None
+        for i, amino_acid in enumerate(protein):
+          if start is None and str(record.seq[frame + 3 * i:frame + 3 * i + 3]) == 'ATG':
+            start = i
+          elif start is not None and amino_acid == '*':
+            if i - start >= 20:
+              expected.append((frame + 3 * start, frame + 3 * i + 3, protein[start:i]))
+            start = None
+      self.assertEqual(find_orfs(record.seq, min_length=20), expected)
+
+  def test_check_proteindb(self):
+    records = [('p1 protein one', 'MKLVAAGGR*'), ('p2', 'KLVAAGGR*PEPTIDEK'), ('p3 gap', 'MKL-VAAGGR'), ('p4', 'MKL')]
+    text, counts = EnsemblDataService.check_protein_records(records, num_aa=6)
+    self.assertEqual(text, '>p1\tprotein one\nMKLVAAGGR\n>p2\tp2 (Premature stop 8/17)\nKLVAAGGR\n'
+                           '>p3\tgap (Contains gaps)\nMKL-VAAGGR\n')
+    self.assertEqual(counts, {'input_sequences': 4, 'written_sequences': 3, 'no_met': 1, 'premature_stops': 1,
+                              'gaps': 1, 'short_sequences': 1})
+    text, counts = EnsemblDataService.check_protein_records(records, add_stop_codon=True, num_aa=6)
+    self.assertIn('>p2_codon_2\tp2 codon 2\nPEPTIDEK\n', text)
+    self.assertEqual(counts['written_sequences'], 4)
+
+  def test_vcf_reader(self):
+    for vcf_file in ['testdata/test.vcf', 'testdata/test_gnomad.vcf',
+                     'testdata/meleagris_gallopavo_incl_consequences.vcf.gz']:
+      with open_vcf(vcf_file) as pyvcf_handle, open_vcf(vcf_file) as handle:
+        records = list(VcfReader(handle))
+        pyvcf_records = list(vcf.Reader(pyvcf_handle, compressed=False))
+      self.assertEqual(len(records), len(pyvcf_records))
+      for record, pyvcf_record in zip(records, pyvcf_records):
+        self.assertEqual((record.CHROM, record.POS, record.ID, record.REF, record.FILTER),
+                         (pyvcf_record.CHROM, pyvcf_record.POS, pyvcf_record.ID, pyvcf_record.REF, pyvcf_record.FILTER))
+        self.assertEqual([str(alt) for alt in record.ALT], [str(alt) for alt in pyvcf_record.ALT])
+        for key in pyvcf_record.INFO:
+          self.assertEqual(record.INFO[key], pyvcf_record.INFO[key])
+
+  def test_annotation_indexes(self):
+    service = EnsemblDataService('config/ensembl_config.yaml',
+                                 {EnsemblDataService.BIOTYPE_INDEX: EnsemblDataService.AUTO_INDEX})
+    # Format=Allele|Consequence|Feature_type|Feature|Amino_acids|SIFT, no biotype
+    with open_vcf('testdata/test.vcf') as handle:
+      indexes = service.get_annotation_indexes(VcfReader(handle).infos)
+    self.assertEqual(indexes, [3, 1, None])
+
+    accept_annotation = service.get_annotation_filter(1, 7)
+    self.assertTrue(accept_annotation('A|missense_variant|M|G|ENSG|Transcript|ENST|protein_coding'.split('|')))
+    self.assertFalse(accept_annotation('A|intron_variant|M|G|ENSG|Transcript|ENST|protein_coding'.split('|')))
+    self.assertFalse(accept_annotation('A|missense_variant|M|G|ENSG|Transcript|ENST|lncRNA'.split('|')))
+    self.assertFalse(accept_annotation('A|missense_variant'.split('|')))
+
+  def test_transcript_interval_index(self):
+    interval_index = TranscriptIntervalIndex.from_gtf('testdata/test.gtf')
+    cds = []
+    with open('testdata/test.gtf') as gtf:
+      for line in gtf:
+        fields = line.split('\t')
+        if not line.startswith('#') and fields[2] == 'CDS':
+          cds.append((fields[0], int(fields[3]) - 1, int(fields[4]), fields[8].split('transcript_id "')[1].split('"')[0]))
+    self.assertEqual(len(interval_index), len(cds))
+    for chrom, start, end, _ in cds[::10]:
+      for query_start, query_end in [(start - 1, start), (start - 1, start + 1), (end - 1, end + 5), (end, end + 1)]:
+        expected = []
+        for cds_chrom, cds_start, cds_end, transcript_id in cds:
+          if cds_chrom == chrom and cds_start < query_end and query_start < cds_end and transcript_id not in expected:
+            expected.append(transcript_id)
+        self.assertEqual(interval_index.overlapping_transcripts(chrom, query_start, query_end), expected)
+    self.assertEqual(interval_index.overlapping_transcripts('NOT_A_CHROM', 0, 10), [])
+
+    # gzip compressed GTF files are read as the plain ones
+    gtf_gz = os.path.join(self.tmp_dir, 'test.gtf.gz')
+    with open('testdata/test.gtf', 'rb') as gtf, gzip.open(gtf_gz, 'wb') as gtf_gz_handle:
+      shutil.copyfileobj(gtf, gtf_gz_handle)
+    gz_index = TranscriptIntervalIndex.from_gtf(gtf_gz)
+    self.assertEqual(len(gz_index), len(cds))
+    for chrom, start, end, _ in cds[::10]:
+      self.assertEqual(gz_index.overlapping_transcripts(chrom, start, end),
+                       interval_index.overlapping_transcripts(chrom, start, end))
+
+  def test_vcf_regions(self):
+    self.assertEqual(parse_regions('1:100-200,2,chr3:5'), [('1', 99, 200), ('2', 0, None), ('chr3', 4, None)])
+    vcf_file = os.path.join(self.tmp_dir, 'variants.vcf.gz')
+    shutil.copy('testdata/meleagris_gallopavo_incl_consequences.vcf.gz', vcf_file)
+    pysam.tabix_index(vcf_file, preset='vcf', keep_original=True)
+    with gzip.open(vcf_file, 'rt') as handle:
+      records = [line.split('\t') for line in handle if not line.startswith('#')]
+    regions = [('1', 0, 400000), ('1', 300000, 2000000), ('10', 0, None), ('chr2', 100000, 900000)]
+    expected = [record for record in records
+                if any(record[0] == chrom.replace('chr', '') and int(record[1]) - 1 + len(record[3]) > start and
+                       (end is None or int(record[1]) - 1 < end) for chrom, start, end in regions)]
+    self.assertTrue(expected)
+    # indexed (tabix) and sequential reads return the same records, once and in file order
+    with open_vcf(vcf_file, regions) as handle:
+      lines = list(handle)
+    self.assertEqual([line.split('\t') for line in lines if not line.startswith('#')], expected)
+    self.assertTrue(lines[0].startswith('##fileformat'))
+    os.remove(vcf_file + '.tbi')
+    with open_vcf(vcf_file, regions) as handle:
+      self.assertEqual([line.split('\t') for line in handle if not line.startswith('#')], expected)
+
+  def test_gene_regions(self):
+    db = gffutils.FeatureDB('testdata/test.db')
+    regions, not_found = EnsemblDataService.get_gene_regions(db, ['OR11H1', 'ENSG00000130538.5', 'NOT_A_GENE'])
+    self.assertEqual(not_found, ['NOT_A_GENE'])
+    gene = db['ENSG00000130538']
+    self.assertEqual(sorted(set(regions)), [(gene.chrom, gene.start - 1, gene.end)])
+
+  def test_featuredb_builder(self):
+    for gtf_file in ['testdata/test.gtf', 'testdata/test_gencode.gtf']:
+      fast_db = os.path.join(self.tmp_dir, 'fast.db')
+      gffutils_db = os.path.join(self.tmp_dir, 'gffutils.db')
+      db = create_featuredb(gtf_file, fast_db)
+      create_featuredb_gffutils(gtf_file, gffutils_db)
+      self.assertEqual(featuredb_tables(fast_db), featuredb_tables(gffutils_db))
+      transcript = next(db.features_of_type('transcript'))
+      self.assertTrue(list(db.children(transcript, featuretype='exon')))
+      with self.assertRaises(ValueError):
+        create_featuredb(gtf_file, fast_db)
+      os.remove(fast_db)
+      os.remove(gffutils_db)
+    self.assertTrue(is_validated_gffutils('0.10.1'))
+    self.assertFalse(is_validated_gffutils('0.12.0'))
+    # the attributes are parsed with the rules of the gffutils version
+    dialect = {'trailing semicolon': True, 'leading semicolon': False, 'field separator': '; ',
+               'keyval separator': ' ', 'quoted GFF2 values': True, 'semicolon in quotes': True,
+               'repeated keys': True}
+    attributes = 'gene_name "kinase, subunit 1"; note "a; b"; db "x,y"; db "z";'
+    self.assertEqual(dict(_attributes_parser(dialect, '0.10.1')(attributes)),
+                     {'gene_name': ['kinase', ' subunit 1'], 'note': ['"a'], 'b"': [], 'db': ['x', 'y', 'z']})
+    self.assertEqual(dict(_attributes_parser(dialect, '0.14.0')(attributes)),
+                     {'gene_name': ['kinase, subunit 1'], 'note': ['a; b'], 'db': ['x,y', 'z']})
+
+  def test_artifact_cache(self):
+    builds = []
+
+    def build(db_file):
+      builds.append(db_file)
+      create_featuredb('testdata/test.gtf', db_file)
+
+    cache = ArtifactCache(os.path.join(self.tmp_dir, 'cache'))
+    db_file = cache.get('featuredb', ['testdata/test.gtf'], build, 'annotations.db', validate=is_featuredb)
+    self.assertEqual(cache.get('featuredb', ['testdata/test.gtf'], build, 'annotations.db', validate=is_featuredb),
+                     db_file)
+    self.assertEqual(len(builds), 1)
+    # an artifact that is not valid anymore is built again
+    with open(db_file, 'r+b') as db_handle:
+      db_handle.write(b'\0' * 100)
+    self.assertFalse(is_featuredb(db_file))
+    cache.get('featuredb', ['testdata/test.gtf'], build, 'annotations.db', validate=is_featuredb)
+    self.assertEqual(len(builds), 2)
+    self.assertTrue(is_featuredb(db_file))
+
+    db = gffutils.FeatureDB(db_file)
+    model = cache.get_object('transcript_model', ['testdata/test.gtf'], lambda: TranscriptModel.from_db(db))
+    cached_model = cache.get_object('transcript_model', ['testdata/test.gtf'], lambda: None)
+    transcript_id = next(db.features_of_type('transcript')).id
+    self.assertEqual(cached_model.get_features(transcript_id), model.get_features(transcript_id))
+
+    # the least recently used artifacts are removed first
+    small_cache = ArtifactCache(os.path.join(self.tmp_dir, 'cache'), max_size=os.path.getsize(db_file) - 1)
+    small_cache.get_object('interval_index', ['testdata/test.gtf'],
+                           lambda: TranscriptIntervalIndex.from_gtf('testdata/test.gtf'))
+    kinds = sorted(os.path.basename(os.path.dirname(entry_dir)) for _, _, entry_dir in small_cache.entries())
+    self.assertNotIn('featuredb', kinds)
+    self.assertIn('interval_index', kinds)
+
+  def test_fasta_index(self):
+    for fasta_file in ['testdata/test.fa', 'testdata/test_gencode.fa']:
+      index_file = os.path.join(self.tmp_dir, os.path.basename(fasta_file) + '.pgi')
+      for by_key in [False, True]:
+        seq_dict = SeqIO.index(fasta_file, 'fasta', key_function=EnsemblDataService.get_key if by_key else None)
+        with FastaIndex(fasta_file, index_file, by_key=by_key) as fasta_index:
+          self.assertTrue(index_matches(index_file, fasta_file))
+          self.assertEqual(list(fasta_index.keys()), list(seq_dict.keys()))
+          for key, record in zip(fasta_index.keys(), fasta_index.records()):
+            self.assertEqual((record.id, record.description, str(record.seq)),
+                             (seq_dict[key].id, seq_dict[key].description, str(seq_dict[key].seq)))
+          self.assertNotIn('not_a_transcript', fasta_index)
+          if by_key:
+            for key in seq_dict.keys():
+              self.assertEqual(fasta_index.versioned_key(key.split('.')[0]), key)
+    # the indexes are not written next to the inputs unless asked
+    self.assertEqual(os.path.dirname(default_index_file('testdata/test.fa')), tempfile.gettempdir())
+    self.assertEqual(default_index_file('testdata/test.fa', next_to_fasta=True), 'testdata/test.fa.pgi')
+
+  def test_sequence_store(self):
+    packed, exceptions, mask = pack_sequence(b'ACGTNNacgtRYA')
+    self.assertEqual(len(packed), 4)
+    self.assertEqual([list(run) for run in exceptions], [[4, 10, 11], [6, 11, 12], [ord('N'), ord('R'), ord('Y')]])
+    self.assertEqual([list(run) for run in mask], [[6], [10]])
+
+    fasta_file = os.path.join(self.tmp_dir, 'test.fa')
+    with open(fasta_file, 'w') as fasta_handle:
+      fasta_handle.write('>t1 desc\nACGTNNNNacgtnnRY\nGGA\n>t2\n\n>t3\nTTTAAACCCGGG\n')
+    store_file = build_sequence_store(fasta_file, os.path.join(self.tmp_dir, 'test.p2b'))
+    seq_dict = SeqIO.index(fasta_file, 'fasta')
+    with FastaIndex(fasta_file, os.path.join(self.tmp_dir, 'test.pgi'),
+                    sequence_store=SequenceStore(store_file)) as fasta_index:
+      for key in seq_dict.keys():
+        seq = str(seq_dict[key].seq)
+        packed_seq = fasta_index[key].seq
+        self.assertEqual(str(packed_seq), seq)
+        for start in range(len(seq) + 1):
+          self.assertEqual(str(packed_seq[start:start + 5]), seq[start:start + 5])
+        self.assertEqual(str(packed_seq.reverse_complement()), str(seq_dict[key].seq.reverse_complement()))
+        self.assertEqual(translate(packed_seq), translate(seq_dict[key].seq))
+      # the byte ranges translated by the packed three frame and dnaseq paths
+      for row, title in fasta_index.entries():
+        seq = str(seq_dict[title.split()[0]].seq)
+        self.assertEqual(fasta_index.sequence_bytes(row), seq.encode())
+        for start in range(len(seq) + 1):
+          self.assertEqual(fasta_index.sequence_bytes(row, start, start + 5), seq[start:start + 5].encode())
+        self.assertEqual(reverse_complement_bytes(fasta_index.sequence_bytes(row)),
+                         str(seq_dict[title.split()[0]].seq.reverse_complement()).encode())
+
+  def test_genome_to_transcripts(self):
+    """
+    Transcripts spliced from a genome holding the exons of the cDNA records must be the same as the cDNA records
+    """
+    for fasta_file, gtf_file in [('testdata/test.fa', 'testdata/test.gtf'),
+                                 ('testdata/test_gencode.fa', 'testdata/test_gencode.gtf')]:
+      transcripts = {record.id: str(record.seq) for record in SeqIO.parse(fasta_file, 'fasta')}
+      genome_fasta = os.path.join(self.tmp_dir, os.path.basename(gtf_file) + '.genome.fa')
+      with open(genome_fasta, 'w') as genome_handle:
+        for chrom, chrom_transcripts in chromosome_transcripts(gtf_file):
+          genome = bytearray(b'N' * (max(end for transcript in chrom_transcripts
+                                         for _, end in transcript['exons']) + 10))
+          for transcript in chrom_transcripts:
+            seq = transcripts[transcript['id']]
+            if transcript['strand'] == '-':
+              seq = str(Seq(seq).reverse_complement())
+            offset = 0
+            for start, end in sorted(transcript['exons']):
+              genome[start - 1:end] = seq[offset:offset + end - start + 1].encode()
+              offset += end - start + 1
+          # the genome uses the chr prefix when the GTF does not, and is soft-masked (dna_sm) in places
+          genome_handle.write('>{} dna:chromosome\n{}\n'.format(
+            chrom if chrom.startswith('chr') else 'chr' + chrom,
+            ''.join(genome[i:i + 50].decode().lower() if i // 50 % 2 else genome[i:i + 50].decode()
+                    for i in range(0, len(genome), 50))))
+
+      output_fasta = os.path.join(self.tmp_dir, 'transcripts.fa')
+      ensembl_data_service = EnsemblDataService('config/ensembl_config.yaml',
+                                                {EnsemblDataService.WORKERS: 2,
+                                                 EnsemblDataService.CACHE_DIR: os.path.join(self.tmp_dir, 'cache')})
+      ensembl_data_service.genome_to_transcripts(genome_fasta, gtf_file, output_fasta)
+      # the transcripts are written in GTF order
+      expected = {record.id: (record.description, str(record.seq)) for record in SeqIO.parse(fasta_file, 'fasta')}
+      self.assertEqual({record.id: (record.description, str(record.seq))
+                        for record in SeqIO.parse(output_fasta, 'fasta')}, expected)
+
+    # a compressed genome can not be memory-mapped
+    with open(genome_fasta, 'rb') as genome_handle, gzip.open(genome_fasta + '.gz', 'wb') as genome_gz_handle:
+      shutil.copyfileobj(genome_handle, genome_gz_handle)
+    with self.assertRaises(ValueError):
+      ensembl_data_service.genome_to_transcripts(genome_fasta + '.gz', gtf_file, output_fasta)
+
+    # gzip GTF without transcript lines: the attributes of the first exon do not add exon keys to the headers
+    gtf_gz = os.path.join(self.tmp_dir, 'no_transcripts.gtf.gz')
+    with open('testdata/test.gtf') as gtf_handle, gzip.open(gtf_gz, 'wt') as gtf_gz_handle:
+      gtf_gz_handle.writelines(line for line in gtf_handle
+                               if line.startswith('#') or line.split('\t')[2] != 'transcript')
+    transcripts = [transcript for _, chrom_transcripts in chromosome_transcripts(gtf_gz)
+                   for transcript in chrom_transcripts]
+    self.assertEqual([transcript['id'] for transcript in transcripts],
+                     [transcript['id'] for _, chrom_transcripts in chromosome_transcripts('testdata/test.gtf')
+                      for transcript in chrom_transcripts])
+    for transcript in transcripts:
+      self.assertNotIn('exon_number', transcript_header(transcript))
+      self.assertIn('exon_number', transcript['attributes'])
+
+
+class ProteomicsTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
   def test_enzyme_digestion(self):
     protein_sequence = "MRCGPLYRFLWLWPYLSYVEAVPIRKVQDDTKTLIKTIVTRINDISHTQSVSSKQRVTGLDFIPGLHPLLSLSKMDQTLAIYQQILASLPSRNVIQISNDLENLRDLLHLLAASKSCPLPQVRALESLESLGVVLEASLYSTEVVALSRLQGSLQDMLRQLDLSPGC"
     peptides = cleave(protein_sequence, PYGPATK_ENZYMES.enzymes['Trypsin']['cleavage rule'], 0, 0)
@@ -81,6 +507,105 @@ class MyTestCase(unittest.TestCase):
     }
     peptides = cleave(protein_sequence, PYGPATK_ENZYMES.enzymes['Trypsin']['cleavage rule'], 3, 0)
     self.assertEqual(len(peptides), len(DESIRED_PEPTIDES))
+    self.assertEqual(enzyme_cleavage_rule('Trypsin').cleave(protein_sequence, 3, 0), peptides)
+
+  def test_cleavage_rules(self):
+    sequences = [str(record.seq) for record in SeqIO.parse('testdata/test_db.fa', 'fasta')]
+    sequences += ['', 'K', 'KP', 'PK', 'DXB-*K', 'MKRPKRK']
+    for enzyme, properties in PYGPATK_ENZYMES.enzymes.items():
+      cleavage_rule = enzyme_cleavage_rule(enzyme)
+      for sequence in sequences:
+        for missed_cleavages, min_length, max_length in [(0, None, None), (2, 7, 40), (1, 0, None)]:
+          expected = cleave(sequence, properties['cleavage rule'], missed_cleavages, min_length, max_length)
+          peptides = cleavage_rule.cleave(sequence, missed_cleavages, min_length, max_length)
+          self.assertEqual(peptides, expected, enzyme)
+          # same iteration order, the decoy databases depend on it
+          self.assertEqual(list(peptides), list(expected), enzyme)
+
+  def test_peptide_set(self):
+    cleavage_rule = enzyme_cleavage_rule('Trypsin')
+    peptides = [peptide for record in SeqIO.parse('testdata/test_db.fa', 'fasta')
+                for peptide in cleavage_rule.peptides(str(record.seq), 1)]
+    unique_peptides = set(peptides)
+    for bloom_filter_bits in (0, 10):
+      peptide_set = PeptideSet(bloom_filter_bits=bloom_filter_bits, buffer_size=50)
+      peptide_set.update(peptides[::2])
+      for peptide in peptides[1::2]:
+        peptide_set.add(peptide)
+      self.assertEqual(len(peptide_set), len(unique_peptides))
+      self.assertEqual(set(peptide_set), unique_peptides)
+      self.assertTrue(all(peptide in peptide_set for peptide in peptides))
+      self.assertFalse(any(peptide[::-1] in peptide_set for peptide in peptides if peptide[::-1] not in unique_peptides))
+      others = [peptide[::-1] for peptide in peptides[:100]]
+      self.assertEqual(set(peptide_set.intersection(others)), unique_peptides & set(others))
+      self.assertEqual(set(peptide_set.intersection(PeptideSet(others))), unique_peptides & set(others))
+      # iteration follows the hashes, not the order the peptides were added in
+      self.assertEqual(list(peptide_set), list(PeptideSet(reversed(peptides))))
+
+  def test_decoy_threads(self):
+    with open('config/protein_decoy.yaml') as config_handle:
+      config = yaml.safe_load(config_handle)
+    # the output and method of the config file would win over the ones of the test
+    for key in ['output', 'method', 'memory_save']:
+      del config['proteindb_decoy'][key]
+    config_file = os.path.join(self.tmp_dir, 'protein_decoy.yaml')
+    with open(config_file, 'w') as config_handle:
+      yaml.safe_dump(config, config_handle)
+
+    for method in ['protein-reverse', 'protein-shuffle', 'decoypyrat', 'pgdbdeep']:
+      for memory_save in [False, True] if method == 'decoypyrat' else [False]:
+        decoys = []
+        for threads in [1, 2]:
+          output_file = os.path.join(self.tmp_dir, 'decoy_{}.fa'.format(threads))
+          service = ProteinDBDecoyService(config_file, {
+            ProteinDBDecoyService.CONFIG_INPUT_FILE: 'testdata/test_db.fa',
+            ProteinDBDecoyService.CONFIG_PROTEINDB_OUTPUT: output_file,
+            ProteinDBDecoyService.CONFIG_DECOY_METHOD: method,
+            ProteinDBDecoyService.CONFIG_TEMP_DIR: self.tmp_dir,
+            ProteinDBDecoyService.CONFIG_MEMORY_SAVE: memory_save,
+            ProteinDBDecoyService.CONFIG_USE_SUFFIX: False,
+            ProteinDBDecoyService.CONFIG_KEEP_TARGET_HITS: False,
+            ProteinDBDecoyService.CONFIG_THREADS: threads})
+          # several chunks per worker
+          service.DECOY_CHUNK_SIZE = 300
+          service.decoy_database()
+          with open(output_file) as output_handle:
+            decoys.append(output_handle.read())
+        self.assertEqual(decoys[0], decoys[1], method)
+        self.assertIn('>DECOY_', decoys[0])
+    # no temporary file left
+    self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['decoy_1.fa', 'decoy_1_noAlternative.fa', 'decoy_2.fa',
+                                                   'decoy_2_noAlternative.fa', 'protein_decoy.yaml'])
+
+    # the peptides are replaced at their offsets, not where they are found in other peptides
+    service = ProteinDBDecoyService(config_file, {ProteinDBDecoyService.CONFIG_INPUT_FILE: 'testdata/test_db.fa'})
+    text, peptides = service.decoypyrat_replace_peptides(['>DECOY_1\n', 'AAAAAAKGAAAAAAKMR\n'],
+                                                         {'AAAAAAK': 'AAAAALK'})
+    self.assertEqual(text, '>DECOY_1\nAAAAALKGAAAAAAKMR\n')
+    self.assertEqual(sorted(peptides), ['AAAAAAK', 'GAAAAAAK'])
+
+  def test_merge_protein_databases(self):
+    gz_file = os.path.join(self.tmp_dir, 'test_db.fa.gz')
+    with open('testdata/test_db.fa', 'rb') as fasta_handle, gzip.open(gz_file, 'wb') as gz_handle:
+      shutil.copyfileobj(fasta_handle, gz_handle)
+    input_files = ['testdata/test_db.fa', 'testdata/proteindb_from_altORFs_DNAseq.fa', gz_file]
+    stats = merge_protein_databases(input_files, os.path.join(self.tmp_dir, 'merged.fa'))
+    self.assertEqual(stats['spilled_runs'], 0)
+    # small memory limit: the proteins are sorted to runs on disk
+    spilled_stats = merge_protein_databases(input_files, os.path.join(self.tmp_dir, 'merged.fa.gz'), memory_limit=5000,
+                                            temp_dir=self.tmp_dir)
+    self.assertGreater(spilled_stats['spilled_runs'], 1)
+    with open(os.path.join(self.tmp_dir, 'merged.fa'), 'r') as merged_handle, \
+        gzip.open(os.path.join(self.tmp_dir, 'merged.fa.gz'), 'rt') as spilled_handle:
+      merged = merged_handle.read()
+      self.assertEqual(spilled_handle.read(), merged)
+
+    sequences = [str(record.seq) for input_file in input_files[:2] for record in SeqIO.parse(input_file, 'fasta')]
+    merged_records = list(SeqIO.parse(io.StringIO(merged), 'fasta'))
+    self.assertEqual([str(record.seq) for record in merged_records], list(dict.fromkeys(sequences)))
+    self.assertEqual(stats['output_sequences'], len(merged_records))
+    self.assertEqual(stats['input_sequences'], len(sequences) + len(list(SeqIO.parse('testdata/test_db.fa', 'fasta'))))
+    self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['merged.fa', 'merged.fa.gz', 'test_db.fa.gz'])
 
 
 if __name__ == '__main__':
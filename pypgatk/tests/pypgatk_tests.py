@@ -1,3 +1,8 @@
+import os
+import shutil
+import tempfile
+
+import yaml
 from click.testing import CliRunner
 
 from pypgatk.pypgatk_cli import cli
@@ -36,6 +41,44 @@ def vcf_to_proteindb_notannotated():
                           '--annotation_field_name', "''"])
   assert result.exit_code == 0
 
+def vcf_to_proteindb_workers():
+  """
+    Test the vcf-to-proteindb tool splitting the VCF by chromosome across multiple workers, the database must be the
+    same as the one of a serial run
+    :return:
+    """
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    # the output file of the config would override --output_proteindb
+    with open('config/ensembl_config.yaml') as config_handle:
+      config = yaml.safe_load(config_handle)
+    del config['ensembl_translation']['proteindb_output_file']
+    config_file = os.path.join(tmp_dir, 'ensembl_config.yaml')
+    with open(config_file, 'w') as config_handle:
+      yaml.safe_dump(config, config_handle)
+
+    runner = CliRunner()
+    proteindbs = []
+    for workers in [1, 2]:
+      output_proteindb = os.path.join(tmp_dir, 'proteindb_from_ENSEMBL_VCF_{}_workers.fa'.format(workers))
+      result = runner.invoke(cli,
+                             ['vcf-to-proteindb', '--config_file', config_file,
+                              '--vcf', 'testdata/test.vcf',
+                              '--input_fasta', 'testdata/test.fa',
+                              '--gene_annotations_gtf', 'testdata/test.gtf',
+                              '--var_prefix', 'ensvar',
+                              '--af_field', 'MAF',
+                              '--output_proteindb', output_proteindb,
+                              '--annotation_field_name', 'CSQ',
+                              '--workers', workers])
+      assert result.exit_code == 0
+      with open(output_proteindb) as proteindb_handle:
+        proteindbs.append(proteindb_handle.read())
+    assert proteindbs[0] == proteindbs[1]
+    assert proteindbs[0].count('>') > 0
+  finally:
+    shutil.rmtree(tmp_dir)
+
 def vcf_gnomad_to_proteindb():
   """
     Test the default behaviour of the vcf-to-proteindb tool
@@ -241,9 +284,22 @@ def check_ensembl_database():
   assert result.exit_code == 0
 
 
+def merge_protein_databases():
+  """
+        Test the merge of protein databases into a non-redundant database
+        :return:
+        """
+  runner = CliRunner()
+  result = runner.invoke(cli,
+                         ['merge-proteindb', '-in', 'testdata/test_db.fa',
+                          '-in', 'testdata/proteindb_from_altORFs_DNAseq.fa', '-out', 'testdata/merged_db.fa'])
+  assert result.exit_code == 0
+
+
 if __name__ == '__main__':
   vcf_to_proteindb()
   vcf_to_proteindb_notannotated()
+  vcf_to_proteindb_workers()
   vcf_gnomad_to_proteindb()
   dnaseq_to_proteindb()
   dnaseq_ncrnas_to_proteindb()
@@ -254,6 +310,7 @@ if __name__ == '__main__':
   cbioportal_to_proteindb()
   generate_decoy_database()
   cosmic_to_proteindb()
+  merge_protein_databases()
   download_ensembl_data()
   #download_ensembl_data_37() #skip to reduce space usage
   download_cbioportal_data()
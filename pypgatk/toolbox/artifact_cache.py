@@ -0,0 +1,255 @@
+"""
+This module implements a cache of the artifacts derived from the input files (gene annotation DBs, transcript
+models, indexes). An artifact is stored under a key computed from the content of its inputs, the version of
+pypgatk and the build parameters, so it is reused by any later run on the same inputs and rebuilt when any of
+them changes. Artifacts are built in a temporary folder and moved into the cache once complete, checked
+before being reused, and the least recently used artifacts are removed when the cache grows over its size limit.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+try:
+  from importlib import metadata
+except ImportError:
+  # Python < 3.8, the version is read with pkg_resources
+  metadata = None
+
+MANIFEST = 'manifest.json'
+DIGESTS = 'digests.json'
+TMP_PREFIX = '.tmp-'
+# temporary folders older than this (seconds) are left over by interrupted runs
+STALE_TMP_AGE = 24 * 3600
+
+
+def tool_version():
+  if metadata is not None:
+    try:
+      return metadata.version('pypgatk')
+    except metadata.PackageNotFoundError:
+      return 'unknown'
+  try:
+    import pkg_resources
+  except ImportError:
+    return 'unknown'
+  try:
+    return pkg_resources.get_distribution('pypgatk').version
+  except pkg_resources.DistributionNotFound:
+    return 'unknown'
+
+
+def file_digest(file_name, chunk_size=1024 * 1024):
+  """
+  sha256 of the content of a file
+  """
+  digest = hashlib.sha256()
+  with open(file_name, 'rb') as handle:
+    for chunk in iter(lambda: handle.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _write_json(data, file_name):
+  """
+  Write a json file atomically
+  """
+  tmp_file = '{}.{}.tmp'.format(file_name, os.getpid())
+  with open(tmp_file, 'w') as handle:
+    json.dump(data, handle, indent=1, sort_keys=True)
+  os.replace(tmp_file, file_name)
+
+
+def _read_json(file_name):
+  try:
+    with open(file_name, 'r') as handle:
+      return json.load(handle)
+  except (OSError, ValueError):
+    return None
+
+
+class ArtifactCache:
+  """
+  Content addressed cache of derived artifacts: <cache_dir>/<kind>/<key>/ holds the artifact file and a manifest
+  with its size and the inputs it was built from.
+  """
+
+  def __init__(self, cache_dir, max_size=None, logger=None):
+    """
+    :param cache_dir: cache folder, created if needed
+    :param max_size: maximum size of the cache in bytes, None for no limit
+    :param logger: logger for the cache hits and builds
+    """
+    self._cache_dir = os.path.abspath(cache_dir)
+    self._max_size = max_size
+    self._logger = logger
+    os.makedirs(self._cache_dir, exist_ok=True)
+    self._digests = None
+
+  @property
+  def cache_dir(self):
+    return self._cache_dir
+
+  def _log(self, msg):
+    if self._logger is not None:
+      self._logger.debug(msg)
+
+  def input_digest(self, file_name):
+    """
+    Content hash of an input file. Hashes are remembered by path, size and modification time so unchanged
+    inputs are only read once.
+    """
+    file_name = os.path.realpath(file_name)
+    stat = os.stat(file_name)
+    digests_file = os.path.join(self._cache_dir, DIGESTS)
+    if self._digests is None:
+      self._digests = _read_json(digests_file) or {}
+    known = self._digests.get(file_name)
+    if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+      return known['sha256']
+    digest = file_digest(file_name)
+    # merge with the digests written by other runs in the meantime
+    self._digests = _read_json(digests_file) or {}
+    self._digests[file_name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    _write_json(self._digests, digests_file)
+    return digest
+
+  def key(self, kind, inputs, params=None):
+    """
+    Key of an artifact: hash of the content of its inputs, the tool version and the build parameters
+    :param kind: type of artifact
+    :param inputs: input files
+    :param params: build parameters (json serializable)
+    :return: key
+    """
+    description = {'kind': kind, 'version': tool_version(), 'params': params,
+                   'inputs': [self.input_digest(input_file) for input_file in inputs]}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+  @staticmethod
+  def _is_valid(entry_dir, artifact, validate):
+    manifest = _read_json(os.path.join(entry_dir, MANIFEST))
+    if manifest is None or manifest.get('artifact') != os.path.basename(artifact):
+      return False
+    try:
+      if os.path.getsize(artifact) != manifest['size']:
+        return False
+      return validate is None or bool(validate(artifact))
+    except Exception:
+      return False
+
+  def get(self, kind, inputs, build, name, params=None, validate=None):
+    """
+    Path of an artifact, built if it is not in the cache (or not valid)
+    :param kind: type of artifact, e.g. 'featuredb'
+    :param inputs: input files the artifact is derived from
+    :param build: function writing the artifact to the path given as argument
+    :param name: file name of the artifact
+    :param params: build parameters that change the artifact (json serializable)
+    :param validate: function checking an artifact before it is reused
+    :return: path of the artifact
+    """
+    entry_dir = os.path.join(self._cache_dir, kind, self.key(kind, inputs, params))
+    artifact = os.path.join(entry_dir, name)
+    if self._is_valid(entry_dir, artifact, validate):
+      os.utime(os.path.join(entry_dir, MANIFEST))  # last use, for the eviction
+      self._log("Cached {} reused: {}".format(kind, artifact))
+      return artifact
+    if os.path.exists(entry_dir):
+      self._log("Cached {} is not valid, rebuilding: {}".format(kind, entry_dir))
+      shutil.rmtree(entry_dir, ignore_errors=True)
+
+    tmp_dir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self._cache_dir)
+    try:
+      tmp_artifact = os.path.join(tmp_dir, name)
+      start_time = time.time()
+      build(tmp_artifact)
+      _write_json({'artifact': name, 'size': os.path.getsize(tmp_artifact), 'kind': kind, 'params': params,
+                   'inputs': [os.path.realpath(input_file) for input_file in inputs], 'version': tool_version(),
+                   'build_time': time.time() - start_time}, os.path.join(tmp_dir, MANIFEST))
+      os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+      try:
+        os.rename(tmp_dir, entry_dir)
+      except OSError:
+        # built at the same time by another run
+        if not self._is_valid(entry_dir, artifact, validate):
+          raise
+    finally:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+    self._log("Cached {} built: {}".format(kind, artifact))
+    self.evict(keep=entry_dir)
+    return artifact
+
+  def get_object(self, kind, inputs, build, params=None):
+    """
+    Python object derived from input files, pickled in the cache
+    :param kind: type of artifact, e.g. 'transcript_model'
+    :param inputs: input files the object is derived from
+    :param build: function returning the object
+    :param params: build parameters that change the object (json serializable)
+    :return: object
+    """
+    built = []
+
+    def write(artifact):
+      built.append(build())
+      with open(artifact, 'wb') as handle:
+        pickle.dump(built[0], handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    artifact = self.get(kind, inputs, write, kind + '.pickle', params)
+    if built:
+      return built[0]
+    try:
+      with open(artifact, 'rb') as handle:
+        return pickle.load(handle)
+    except Exception as e:
+      self._log("Cached {} could not be loaded ({}), rebuilding".format(kind, e))
+      shutil.rmtree(os.path.dirname(artifact), ignore_errors=True)
+      return self.get_object(kind, inputs, build, params)
+
+  def entries(self):
+    """
+    Artifacts in the cache
+    :return: list of (last use time, size in bytes, entry folder)
+    """
+    entries = []
+    for kind in os.listdir(self._cache_dir):
+      kind_dir = os.path.join(self._cache_dir, kind)
+      if kind.startswith(TMP_PREFIX) or not os.path.isdir(kind_dir):
+        continue
+      for key in os.listdir(kind_dir):
+        entry_dir = os.path.join(kind_dir, key)
+        try:
+          last_use = os.path.getmtime(os.path.join(entry_dir, MANIFEST))
+        except OSError:
+          last_use = 0
+        size = sum(os.path.getsize(os.path.join(entry_dir, file_name)) for file_name in os.listdir(entry_dir))
+        entries.append((last_use, size, entry_dir))
+    return entries
+
+  def evict(self, keep=None):
+    """
+    Remove the least recently used artifacts until the cache fits in its maximum size, and the temporary
+    folders of interrupted builds
+    :param keep: entry folder that is never removed (the artifact just built or reused)
+    """
+    for file_name in os.listdir(self._cache_dir):
+      tmp_dir = os.path.join(self._cache_dir, file_name)
+      if file_name.startswith(TMP_PREFIX) and time.time() - os.path.getmtime(tmp_dir) > STALE_TMP_AGE:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if self._max_size is None:
+      return
+    entries = sorted(self.entries())
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in entries:
+      if total_size <= self._max_size:
+        break
+      if entry_dir == keep:
+        continue
+      self._log("Cache over {} bytes, removing {}".format(self._max_size, entry_dir))
+      shutil.rmtree(entry_dir, ignore_errors=True)
+      total_size -= size
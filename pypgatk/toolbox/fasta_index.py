@@ -0,0 +1,313 @@
+"""
+This module implements a persistent index of FASTA files. The offset of every record is written once to a SQLite
+table (by default in the temporary folder, see default_index_file) and reused by later runs while the FASTA file is
+unchanged, records are read from the memory-mapped FASTA file. Records are the same as the ones returned by Bio.SeqIO.index(fasta, 'fasta').
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+INDEX_SUFFIX = '.pgi'
+INDEX_VERSION = 1
+
+INDEX_SCHEMA = """
+CREATE TABLE meta (version INTEGER, fasta_size INTEGER, fasta_mtime_ns INTEGER, duplicate_keys INTEGER);
+CREATE TABLE records (id TEXT, key TEXT, offset INTEGER, length INTEGER);
+CREATE TABLE aliases (alias TEXT PRIMARY KEY, key TEXT);
+"""
+
+SEQ_WHITESPACE = b' \t\r\n'
+
+
+def record_key(record_id):
+  """
+  Transcript ID of a FASTA record ID: GENCODE IDs hold the transcript ID and its gene, names... separated by |
+  """
+  return record_id.split('|')[0]
+
+
+def fasta_records(fasta):
+  """
+  (ID, offset, length) of the records of a memory-mapped FASTA file, a record starts at a line starting with >
+  """
+  size = len(fasta)
+  if fasta[:1] == b'>':
+    start = 0
+  else:
+    start = fasta.find(b'\n>')
+    if start == -1:
+      return
+    start += 1
+  while True:
+    next_record = fasta.find(b'\n>', start)
+    end = size if next_record == -1 else next_record + 1
+    title_end = fasta.find(b'\n', start, end)
+    words = fasta[start + 1:end if title_end == -1 else title_end].split(None, 1)
+    yield (words[0].decode() if words else ''), start, end - start
+    if next_record == -1:
+      return
+    start = end
+
+
+def fasta_entries(fasta):
+  """
+  (title, sequence start, sequence end) of the records of a memory-mapped FASTA file, in file order. The sequence
+  is only read when needed, see fasta_sequence.
+  """
+  for _, offset, length in fasta_records(fasta):
+    title_end = fasta.find(b'\n', offset, offset + length)
+    if title_end == -1:
+      title_end = offset + length
+    yield fasta[offset + 1:title_end].decode().rstrip(), title_end, offset + length
+
+
+def fasta_sequence(fasta, start, end):
+  """
+  Sequence of a record of a memory-mapped FASTA file as bytes, without line breaks
+  """
+  return fasta[start:end].translate(None, SEQ_WHITESPACE)
+
+
+def map_fasta(fasta_file):
+  """
+  Memory-mapped content of an uncompressed FASTA file
+  """
+  with open(fasta_file, 'rb') as fasta_handle:
+    if os.fstat(fasta_handle.fileno()).st_size == 0:
+      return b''
+    if fasta_handle.read(2) == b'\x1f\x8b':
+      raise ValueError("{} is gzip compressed, the FASTA file must be decompressed to be indexed".format(fasta_file))
+    return mmap.mmap(fasta_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def index_matches(index_file, fasta_file):
+  """
+  Check that an index was built from the current content of a FASTA file (same size and modification time)
+  :param index_file: index
+  :param fasta_file: FASTA file
+  :return: True if the index can be used
+  """
+  if not os.path.isfile(index_file):
+    return False
+  stat = os.stat(fasta_file)
+  try:
+    conn = sqlite3.connect('file:{}?mode=ro'.format(index_file), uri=True)
+    try:
+      return conn.execute("SELECT version, fasta_size, fasta_mtime_ns FROM meta").fetchone() == (
+        INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+    finally:
+      conn.close()
+  except sqlite3.Error:
+    return False
+
+
+def build_index(fasta_file, index_file):
+  """
+  Write the index of a FASTA file: offset and length of every record by ID, the transcript ID of every record
+  (see record_key) and the transcript IDs without version. The index is written to a temporary file first.
+  :param fasta_file: FASTA file
+  :param index_file: index
+  :return: index file
+  """
+  stat = os.stat(fasta_file)
+  tmp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+  if os.path.exists(tmp_file):
+    os.remove(tmp_file)
+  conn = sqlite3.connect(tmp_file)
+  try:
+    conn.executescript("PRAGMA synchronous=OFF; PRAGMA journal_mode=OFF;")
+    conn.executescript(INDEX_SCHEMA)
+    fasta = map_fasta(fasta_file)
+    try:
+      conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                       ((record_id, record_key(record_id), offset, length)
+                        for record_id, offset, length in fasta_records(fasta)))
+    finally:
+      if isinstance(fasta, mmap.mmap):
+        fasta.close()
+    try:
+      conn.execute("CREATE UNIQUE INDEX records_id ON records (id)")
+    except sqlite3.IntegrityError:
+      duplicate = conn.execute("SELECT id FROM records GROUP BY id HAVING count(*) > 1 LIMIT 1").fetchone()[0]
+      raise ValueError("Duplicate key '{}' in {}".format(duplicate, fasta_file))
+    conn.execute("CREATE INDEX records_key ON records (key)")
+    # the last transcript with the same ID without version wins, as {key.split('.')[0]: key for key in keys}
+    conn.execute("INSERT OR REPLACE INTO aliases "
+                 "SELECT CASE WHEN instr(key, '.') THEN substr(key, 1, instr(key, '.') - 1) ELSE key END, key "
+                 "FROM records ORDER BY rowid")
+    duplicate_keys = conn.execute("SELECT count(*) - count(DISTINCT key) FROM records").fetchone()[0]
+    conn.execute("INSERT INTO meta VALUES (?, ?, ?, ?)",
+                 (INDEX_VERSION, stat.st_size, stat.st_mtime_ns, duplicate_keys))
+    conn.commit()
+  except Exception:
+    conn.close()
+    os.remove(tmp_file)
+    raise
+  conn.close()
+  os.replace(tmp_file, index_file)
+  return index_file
+
+
+def default_index_file(fasta_file, suffix=INDEX_SUFFIX, next_to_fasta=False):
+  """
+  Index file of a FASTA file: <fasta name>_<path digest><suffix> in the temporary folder, or <fasta><suffix> next to
+  it with next_to_fasta when its folder is writable
+  """
+  index_file = fasta_file + suffix
+  if next_to_fasta and (os.access(os.path.dirname(os.path.abspath(fasta_file)), os.W_OK) or
+                        os.path.exists(index_file)):
+    return index_file
+  path_digest = hashlib.sha1(os.path.realpath(fasta_file).encode()).hexdigest()
+  return os.path.join(tempfile.gettempdir(), '{}_{}{}'.format(os.path.basename(fasta_file), path_digest, suffix))
+
+
+class FastaIndex:
+  """
+  Read-only dict-like access to the records of a FASTA file by ID, using a persistent index built on first use
+  (see build_index). With by_key=True records are looked up by transcript ID instead (see record_key).
+  """
+
+  def __init__(self, fasta_file, index_file=None, by_key=False, sequence_store=None):
+    """
+    :param fasta_file: FASTA file
+    :param index_file: index, built if missing or out of date (default see default_index_file)
+    :param by_key: look up records by transcript ID instead of record ID
+    :param sequence_store: SequenceStore of the FASTA file, the sequences of the records are then read from it
+                           (closed with the index)
+    """
+    self._fasta_file = fasta_file
+    self._index_file = index_file if index_file else default_index_file(fasta_file)
+    if not index_matches(self._index_file, fasta_file):
+      build_index(fasta_file, self._index_file)
+    self._conn = sqlite3.connect('file:{}?mode=ro'.format(self._index_file), uri=True, check_same_thread=False)
+    self._column = 'key' if by_key else 'id'
+    if by_key:
+      duplicate_keys = self._conn.execute("SELECT duplicate_keys FROM meta").fetchone()[0]
+      if duplicate_keys:
+        self._conn.close()
+        raise ValueError("{} transcript IDs are duplicated in {}".format(duplicate_keys, fasta_file))
+    self._lookup = "SELECT rowid, offset, length FROM records WHERE {} = ?".format(self._column)
+    self._fasta = map_fasta(fasta_file)
+    self._sequence_store = sequence_store
+    if sequence_store is not None and len(sequence_store) != len(self):
+      self.close()
+      raise ValueError("The sequence store does not match the index of {}".format(fasta_file))
+
+  @property
+  def index_file(self):
+    return self._index_file
+
+  def close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+    if isinstance(self._fasta, mmap.mmap):
+      self._fasta.close()
+    self._fasta = b''
+    if self._sequence_store is not None:
+      self._sequence_store.close()
+      self._sequence_store = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def __len__(self):
+    return self._conn.execute("SELECT count(*) FROM records").fetchone()[0]
+
+  def __contains__(self, key):
+    return self._conn.execute(self._lookup, (key,)).fetchone() is not None
+
+  def __iter__(self):
+    return self.keys()
+
+  def keys(self):
+    """
+    Record IDs (or transcript IDs) in file order
+    """
+    for key, in self._conn.execute("SELECT {} FROM records ORDER BY rowid".format(self._column)):
+      yield key
+
+  def _record(self, rowid, offset, length):
+    title_end = self._fasta.find(b'\n', offset, offset + length)
+    if title_end == -1:
+      title_end = offset + length
+    title = self._fasta[offset + 1:title_end].decode().rstrip()
+    words = title.split(None, 1)
+    record_id = words[0] if words else ''
+    if self._sequence_store is not None:
+      seq = Seq(self._sequence_store.sequence(rowid - 1))
+    else:
+      seq = Seq(fasta_sequence(self._fasta, title_end, offset + length).decode())
+    return SeqRecord(seq, id=record_id, name=record_id, description=title)
+
+  def __getitem__(self, key):
+    row = self._conn.execute(self._lookup, (key,)).fetchone()
+    if row is None:
+      raise KeyError(key)
+    return self._record(*row)
+
+  def row(self, key):
+    """
+    Number of a record in the file (0-based), None if there is no such record
+    """
+    row = self._conn.execute(self._lookup, (key,)).fetchone()
+    return None if row is None else row[0] - 1
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def records(self):
+    """
+    All the records, in file order
+    """
+    for row in self._conn.execute("SELECT rowid, offset, length FROM records ORDER BY rowid"):
+      yield self._record(*row)
+
+  def entries(self):
+    """
+    (record number, fasta header) of all the records in file order, the sequences are read with sequence_bytes
+    """
+    for rowid, offset, length in self._conn.execute("SELECT rowid, offset, length FROM records ORDER BY rowid"):
+      title_end = self._fasta.find(b'\n', offset, offset + length)
+      if title_end == -1:
+        title_end = offset + length
+      yield rowid - 1, self._fasta[offset + 1:title_end].decode().rstrip()
+
+  def sequence_bytes(self, row, start=0, end=None):
+    """
+    Bases [start, end) of a record as bytes, only this region is decoded from the sequence store. The bytes are
+    read by the translation engine (see toolbox.translation) without any str or Seq copy.
+    :param row: record number (0-based, see row)
+    :param start: start in the sequence
+    :param end: end in the sequence (exclusive), None for the end of the sequence
+    :return: bytes
+    """
+    if self._sequence_store is not None:
+      length = self._sequence_store.sequence_length(row)
+      return self._sequence_store.decode(row, start, length if end is None else min(end, length))
+    offset, length = self._conn.execute("SELECT offset, length FROM records WHERE rowid = ?", (row + 1,)).fetchone()
+    title_end = self._fasta.find(b'\n', offset, offset + length)
+    if title_end == -1:
+      return b''
+    return fasta_sequence(self._fasta, title_end, offset + length)[start:end]
+
+  def versioned_key(self, transcript_id):
+    """
+    Transcript ID of a record from the ID without version, e.g. ENST00000456328 -> ENST00000456328.2
+    :param transcript_id: transcript ID without version
+    :return: transcript ID with version, None if there is no such record
+    """
+    row = self._conn.execute("SELECT key FROM aliases WHERE alias = ?", (transcript_id,)).fetchone()
+    return None if row is None else row[0]
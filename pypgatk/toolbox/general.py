@@ -85,6 +85,15 @@ class ParameterConfiguration:
       self._log_files.append(logfile)
     self.get_logger().debug("Logging system initialized")
 
+  def __getstate__(self):
+    """
+    Services are sent to worker processes when a command runs in parallel. The log handlers hold
+    open files and locks, they are not copied; the logger itself is looked up again by name.
+    """
+    state = self.__dict__.copy()
+    state['_log_handlers'] = []
+    return state
+
   def get_pipeline_parameters(self):
     return self._pipeline_parameters
 
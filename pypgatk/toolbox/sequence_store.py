@@ -0,0 +1,303 @@
+"""
+This module implements a packed store of the sequences of a FASTA file. Nucleotides are kept with 2 bits per base,
+the letters other than A/C/G/T (N, IUPAC codes...) and the lowercase (soft-masked) regions as runs, as in the
+UCSC 2bit format. The store is written once per FASTA file (<fasta>.p2b) and memory-mapped read-only, so
+the processes of a parallel run share the same pages. Only the requested regions of a sequence are decoded.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from pypgatk.toolbox.fasta_index import fasta_records, map_fasta
+
+STORE_SUFFIX = '.p2b'
+STORE_MAGIC = b'PGATK2B\x01'
+STORE_VERSION = 1
+HEADER = struct.Struct('<8sQ')
+
+SEQ_WHITESPACE = b' \t\r\n'
+
+# base -> 2 bits code, any other letter is stored as an exception
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(b'ACGT'):
+  _CODES[_base] = _code
+# packed byte -> its 4 bases
+_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)[
+  np.stack([(np.arange(256) >> shift) & 3 for shift in (6, 4, 2, 0)], axis=1)]
+
+STORE_ARRAYS = (('packed_offsets', np.uint64), ('lengths', np.uint64),
+                ('exception_offsets', np.uint64), ('exception_starts', np.uint32),
+                ('exception_ends', np.uint32), ('exception_bases', np.uint8),
+                ('mask_offsets', np.uint64), ('mask_starts', np.uint32), ('mask_ends', np.uint32),
+                ('packed', np.uint8))
+
+
+def _runs(positions):
+  """
+  Runs of consecutive positions
+  :param positions: sorted positions
+  :return: starts, ends (exclusive) of the runs
+  """
+  if not len(positions):
+    return positions, positions
+  breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+  return positions[np.concatenate(([0], breaks))], positions[np.concatenate((breaks - 1, [len(positions) - 1]))] + 1
+
+
+def pack_sequence(seq_bytes):
+  """
+  2 bits packed bases, runs of other letters and lowercase runs of a sequence
+  :param seq_bytes: sequence
+  :return: packed bytes, (starts, ends, letters) of the exceptions, (starts, ends) of the lowercase runs
+  """
+  seq = np.frombuffer(seq_bytes, dtype=np.uint8)
+  upper = np.frombuffer(seq_bytes.upper(), dtype=np.uint8)
+  mask_starts, mask_ends = _runs(np.flatnonzero(seq != upper))
+
+  codes = _CODES[upper]
+  exceptions = np.flatnonzero(codes == 4)
+  if len(exceptions):
+    # a run of exceptions ends where the letter changes
+    letters = upper[exceptions]
+    breaks = np.flatnonzero((np.diff(exceptions) != 1) | (np.diff(letters) != 0)) + 1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks - 1, [len(exceptions) - 1]))
+    exception_runs = (exceptions[firsts], exceptions[lasts] + 1, letters[firsts])
+    codes[exceptions] = 0
+  else:
+    exception_runs = (exceptions, exceptions, np.zeros(0, dtype=np.uint8))
+
+  padded = np.zeros((len(codes) + 3) // 4 * 4, dtype=np.uint8)
+  padded[:len(codes)] = codes
+  padded = padded.reshape(-1, 4)
+  packed = (padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]
+  return packed.astype(np.uint8).tobytes(), exception_runs, (mask_starts, mask_ends)
+
+
+def _merge_runs(starts, ends, letters=None):
+  """
+  Merge the runs that end where the next one starts (with the same letter)
+  """
+  if len(starts) < 2:
+    return starts, ends, letters
+  join = starts[1:] == ends[:-1]
+  if letters is not None:
+    join &= letters[1:] == letters[:-1]
+  firsts = np.flatnonzero(np.concatenate(([True], ~join)))
+  lasts = np.concatenate((firsts[1:] - 1, [len(starts) - 1]))
+  return starts[firsts], ends[lasts], None if letters is None else letters[firsts]
+
+
+def _sequence_chunks(fasta, start, end, chunk_size):
+  """
+  Sequence of a region of a FASTA file without the line breaks, in chunks of a multiple of 4 bases (but the last)
+  """
+  carry = b''
+  while start < end:
+    chunk = carry + fasta[start:min(start + chunk_size, end)].translate(None, SEQ_WHITESPACE)
+    start += chunk_size
+    carry = b''
+    if start < end:
+      cut = len(chunk) // 4 * 4
+      chunk, carry = chunk[:cut], chunk[cut:]
+    if chunk:
+      yield chunk
+
+
+def build_sequence_store(fasta_file, store_file, chunk_size=16 * 1024 * 1024):
+  """
+  Write the packed store of the sequences of a FASTA file, records are stored in file order
+  :param fasta_file: FASTA file
+  :param store_file: store
+  :param chunk_size: bytes of a record packed at once, long records (chromosomes) are packed in chunks
+  :return: store file
+  """
+  stat = os.stat(fasta_file)
+  packed_offsets = [0]
+  lengths = []
+  exception_offsets = [0]
+  exception_starts, exception_ends, exception_bases = [], [], []
+  mask_offsets = [0]
+  mask_starts, mask_ends = [], []
+  tmp_file = '{}.{}.tmp'.format(store_file, os.getpid())
+  try:
+    fasta = map_fasta(fasta_file)
+    try:
+      with open(tmp_file + '.packed', 'wb') as packed_handle:
+        for _, offset, length in fasta_records(fasta):
+          title_end = fasta.find(b'\n', offset, offset + length)
+          seq_length = 0
+          packed_size = 0
+          exceptions = ([], [], [])
+          mask = ([], [])
+          for chunk in _sequence_chunks(fasta, offset + length if title_end == -1 else title_end,
+                                        offset + length, chunk_size):
+            packed, chunk_exceptions, chunk_mask = pack_sequence(chunk)
+            packed_handle.write(packed)
+            packed_size += len(packed)
+            exceptions[0].append(chunk_exceptions[0] + seq_length)
+            exceptions[1].append(chunk_exceptions[1] + seq_length)
+            exceptions[2].append(chunk_exceptions[2])
+            mask[0].append(chunk_mask[0] + seq_length)
+            mask[1].append(chunk_mask[1] + seq_length)
+            seq_length += len(chunk)
+          exceptions = _merge_runs(*[np.concatenate(runs) if runs else np.zeros(0, dtype=np.int64)
+                                     for runs in exceptions])
+          mask = _merge_runs(*[np.concatenate(runs) if runs else np.zeros(0, dtype=np.int64) for runs in mask])
+          packed_offsets.append(packed_offsets[-1] + packed_size)
+          lengths.append(seq_length)
+          exception_starts.append(exceptions[0])
+          exception_ends.append(exceptions[1])
+          exception_bases.append(exceptions[2])
+          exception_offsets.append(exception_offsets[-1] + len(exceptions[0]))
+          mask_starts.append(mask[0])
+          mask_ends.append(mask[1])
+          mask_offsets.append(mask_offsets[-1] + len(mask[0]))
+    finally:
+      if isinstance(fasta, mmap.mmap):
+        fasta.close()
+
+    arrays = {'packed_offsets': packed_offsets[:-1], 'lengths': lengths, 'exception_offsets': exception_offsets,
+              'exception_starts': exception_starts, 'exception_ends': exception_ends,
+              'exception_bases': exception_bases, 'mask_offsets': mask_offsets, 'mask_starts': mask_starts,
+              'mask_ends': mask_ends}
+    for name, dtype in STORE_ARRAYS:
+      if name in ('exception_starts', 'exception_ends', 'exception_bases', 'mask_starts', 'mask_ends'):
+        arrays[name] = np.concatenate(arrays[name]).astype(dtype) if arrays[name] else np.zeros(0, dtype=dtype)
+      elif name != 'packed':
+        arrays[name] = np.array(arrays[name], dtype=dtype)
+
+    # header, then every array aligned on 8 bytes, the packed bases last
+    layout = {'version': STORE_VERSION, 'fasta_size': stat.st_size, 'fasta_mtime_ns': stat.st_mtime_ns,
+              'records': len(lengths), 'arrays': {}}
+    offset = 0
+    for name, dtype in STORE_ARRAYS:
+      size = packed_offsets[-1] if name == 'packed' else arrays[name].nbytes
+      layout['arrays'][name] = [offset, size // np.dtype(dtype).itemsize]
+      offset += (size + 7) // 8 * 8
+    header = json.dumps(layout).encode()
+    data_start = (HEADER.size + len(header) + 7) // 8 * 8
+    with open(tmp_file, 'wb') as store_handle:
+      store_handle.write(HEADER.pack(STORE_MAGIC, len(header)))
+      store_handle.write(header)
+      for name, _ in STORE_ARRAYS:
+        store_handle.seek(data_start + layout['arrays'][name][0])
+        if name == 'packed':
+          with open(tmp_file + '.packed', 'rb') as packed_handle:
+            for chunk in iter(lambda: packed_handle.read(1024 * 1024), b''):
+              store_handle.write(chunk)
+        else:
+          store_handle.write(arrays[name].tobytes())
+      store_handle.truncate(data_start + offset)
+    os.replace(tmp_file, store_file)
+  finally:
+    for file_name in (tmp_file, tmp_file + '.packed'):
+      if os.path.exists(file_name):
+        os.remove(file_name)
+  return store_file
+
+
+def _read_layout(store_handle):
+  magic, header_size = HEADER.unpack(store_handle.read(HEADER.size))
+  if magic != STORE_MAGIC:
+    raise ValueError("Not a sequence store")
+  return json.loads(store_handle.read(header_size)), (HEADER.size + header_size + 7) // 8 * 8
+
+
+def store_matches(store_file, fasta_file):
+  """
+  Check that a store was built from the current content of a FASTA file (same size and modification time)
+  :param store_file: store
+  :param fasta_file: FASTA file
+  :return: True if the store can be used
+  """
+  if not os.path.isfile(store_file):
+    return False
+  stat = os.stat(fasta_file)
+  try:
+    with open(store_file, 'rb') as store_handle:
+      layout, _ = _read_layout(store_handle)
+  except (OSError, ValueError, struct.error):
+    return False
+  return (layout.get('version'), layout.get('fasta_size'), layout.get('fasta_mtime_ns')) == (
+    STORE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+
+class SequenceStore:
+  """
+  Memory-mapped packed sequences of a FASTA file, by record number in file order
+  """
+
+  def __init__(self, store_file):
+    """
+    :param store_file: store written by build_sequence_store
+    """
+    self._store_file = store_file
+    with open(store_file, 'rb') as store_handle:
+      layout, data_start = _read_layout(store_handle)
+      self._map = mmap.mmap(store_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    self._num_records = layout['records']
+    for name, dtype in STORE_ARRAYS:
+      offset, count = layout['arrays'][name]
+      setattr(self, '_' + name, np.frombuffer(self._map, dtype=dtype, count=count, offset=data_start + offset))
+
+  def __len__(self):
+    return self._num_records
+
+  def __getstate__(self):
+    # the worker processes map the store again
+    return {'store_file': self._store_file}
+
+  def __setstate__(self, state):
+    self.__init__(state['store_file'])
+
+  def sequence_length(self, row):
+    return int(self._lengths[row])
+
+  def sequence(self, row):
+    """
+    Sequence of a record
+    :param row: record number
+    :return: str
+    """
+    return self.decode(row, 0, int(self._lengths[row])).decode()
+
+  def decode(self, row, start, end):
+    """
+    Bases [start, end) of a record
+    :param row: record number
+    :param start: start in the record
+    :param end: end in the record (exclusive)
+    :return: bytes
+    """
+    if end <= start:
+      return b''
+    packed_offset = int(self._packed_offsets[row])
+    first_byte = start // 4
+    bases = _BASES[self._packed[packed_offset + first_byte:packed_offset + (end + 3) // 4]].reshape(-1)
+    bases = bases[start - 4 * first_byte:end - 4 * first_byte]
+
+    first, last = int(self._exception_offsets[row]), int(self._exception_offsets[row + 1])
+    if first < last:
+      starts = self._exception_starts[first:last]
+      ends = self._exception_ends[first:last]
+      for run in range(np.searchsorted(ends, start, side='right'), np.searchsorted(starts, end, side='left')):
+        bases[max(int(starts[run]), start) - start:min(int(ends[run]), end) - start] = self._exception_bases[first + run]
+
+    first, last = int(self._mask_offsets[row]), int(self._mask_offsets[row + 1])
+    if first < last:
+      starts = self._mask_starts[first:last]
+      ends = self._mask_ends[first:last]
+      for run in range(np.searchsorted(ends, start, side='right'), np.searchsorted(starts, end, side='left')):
+        bases[max(int(starts[run]), start) - start:min(int(ends[run]), end) - start] += 32
+    return bases.tobytes()
+
+  def close(self):
+    for name, _ in STORE_ARRAYS:
+      setattr(self, '_' + name, None)
+    self._map.close()
+
@@ -0,0 +1,211 @@
+"""
+This module implements a codon translation engine based on NumPy lookup tables. Each NCBI translation table
+is compiled once into a 64 entries table indexed by the codon, the sequences are translated as byte arrays.
+Codons with bases other than A/C/G/T (IUPAC ambiguity codes, gaps, ...) are translated by Biopython, so the
+result is always the same as Bio.Seq.translate.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+
+BASES = 'TCAG'
+INVALID_CODON = 64
+
+# IUPAC DNA complement, as Bio.Seq.reverse_complement (U is complemented as in RNA)
+_COMPLEMENT = bytes.maketrans(b'ACGTUMRWSYKVHDBNXacgtumrwsykvhdbnx', b'TGCAAKYWSRMBDHVNXtgcaakywsrmbdhvnx')
+
+# base -> 0..3, any other letter -> 4
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+  _BASE_CODES[ord(_base)] = _code
+  _BASE_CODES[ord(_base.lower())] = _code
+
+
+class TranslationTable:
+  """
+  Compiled NCBI translation table.
+  """
+
+  def __init__(self, table_id=1, stop_symbol='*'):
+    self.table_id = table_id
+    self.stop_symbol = stop_symbol
+    codon_table = CodonTable.unambiguous_dna_by_id[table_id]
+    self._lookup = np.zeros(INVALID_CODON + 1, dtype=np.uint8)
+    for first in range(4):
+      for second in range(4):
+        for third in range(4):
+          codon = BASES[first] + BASES[second] + BASES[third]
+          amino_acid = codon_table.forward_table.get(codon, stop_symbol)
+          self._lookup[16 * first + 4 * second + third] = ord(amino_acid)
+    self._lookup[INVALID_CODON] = ord('X')
+    self._ambiguous_codons = {}
+
+  def _translate_ambiguous_codon(self, codon):
+    amino_acid = self._ambiguous_codons.get(codon)
+    if amino_acid is None:
+      amino_acid = str(Seq(codon).translate(table=self.table_id, stop_symbol=self.stop_symbol))
+      self._ambiguous_codons[codon] = amino_acid
+    return amino_acid
+
+  @staticmethod
+  def as_bytes(seq):
+    """
+    Bytes of a str, Seq or bytes sequence
+    """
+    if isinstance(seq, (bytes, bytearray)):
+      return bytes(seq)
+    if isinstance(seq, str):
+      return seq.encode('latin-1')
+    return str(seq).encode('latin-1')
+
+  @staticmethod
+  def codon_index(seq_bytes):
+    """
+    Codon starting at every position of the sequence as an index in [0, 64), INVALID_CODON for the codons
+    that are not made of A/C/G/T only.
+    :param seq_bytes: sequence as bytes
+    :return: numpy array of len(seq_bytes) - 2 codon indexes
+    """
+    codes = _BASE_CODES[np.frombuffer(seq_bytes, dtype=np.uint8)]
+    if len(codes) < 3:
+      return np.zeros(0, dtype=np.uint8)
+    index = 16 * codes[:-2] + 4 * codes[1:-1] + codes[2:]
+    invalid = (codes[:-2] == 4) | (codes[1:-1] == 4) | (codes[2:] == 4)
+    index[invalid] = INVALID_CODON
+    return index
+
+  def _translate_codons(self, seq_bytes, codons, frame, to_stop):
+    amino_acids = self._lookup[codons]
+    if to_stop:
+      # the codons after the first stop codon are not translated, as Biopython does
+      stops = np.flatnonzero(amino_acids == ord(self.stop_symbol))
+      if len(stops):
+        amino_acids = amino_acids[:stops[0]]
+        codons = codons[:stops[0]]
+    ambiguous = np.flatnonzero(codons == INVALID_CODON)
+    protein = amino_acids.tobytes().decode('latin-1')
+    if len(ambiguous):
+      protein = list(protein)
+      for i in ambiguous.tolist():
+        start = frame + 3 * i
+        protein[i] = self._translate_ambiguous_codon(seq_bytes[start:start + 3].decode('latin-1'))
+        if to_stop and protein[i] == self.stop_symbol:
+          protein = protein[:i]
+          break
+      protein = ''.join(protein)
+    return protein
+
+  def translate(self, seq, to_stop=False, frame=0):
+    """
+    Translate a sequence, the trailing partial codon is ignored.
+    :param seq: DNA sequence (str, Seq or bytes)
+    :param to_stop: stop the translation at the first stop codon
+    :param frame: offset of the first codon
+    :return: protein sequence (str)
+    """
+    return self.translate_frames(seq, frames=(frame,), to_stop=to_stop)[0]
+
+  def translate_frames(self, seq, frames=(0, 1, 2), to_stop=False):
+    """
+    Translate several reading frames of a sequence, the codons are computed once for all frames.
+    :param seq: DNA sequence (str, Seq or bytes)
+    :param frames: offsets of the reading frames
+    :param to_stop: stop the translation at the first stop codon
+    :return: list of protein sequences (str), one per frame
+    """
+    seq_bytes = self.as_bytes(seq)
+    index = self.codon_index(seq_bytes)
+    proteins = []
+    for frame in frames:
+      num_codons = max(len(seq_bytes) - frame, 0) // 3
+      codons = index[frame:frame + 3 * num_codons:3]
+      proteins.append(self._translate_codons(seq_bytes, codons, frame, to_stop))
+    return proteins
+
+
+def reverse_complement_bytes(seq_bytes):
+  """
+  Reverse complement of a DNA sequence given as bytes, the letters other than the IUPAC codes are kept
+  :param seq_bytes: DNA sequence (bytes)
+  :return: bytes
+  """
+  return seq_bytes.translate(_COMPLEMENT)[::-1]
+
+
+@lru_cache(maxsize=None)
+def get_translation_table(table_id=1):
+  """
+  Compiled translation table of an NCBI table ID, the tables are compiled once per process.
+  :param table_id: NCBI translation table ID
+  :return: TranslationTable
+  """
+  return TranslationTable(int(table_id))
+
+
+def translate(seq, table=1, to_stop=False):
+  """
+  Translate a DNA sequence, same result as str(Bio.Seq.Seq(seq).translate(table, to_stop=to_stop)).
+  Tables given by name are translated by Biopython.
+  :param seq: DNA sequence (str, Seq or bytes)
+  :param table: NCBI translation table ID
+  :param to_stop: stop the translation at the first stop codon
+  :return: protein sequence (str)
+  """
+  try:
+    translation_table = get_translation_table(table)
+  except (KeyError, ValueError, TypeError):
+    return str(Seq(TranslationTable.as_bytes(seq).decode('latin-1')).translate(table=table, to_stop=to_stop))
+  return translation_table.translate(seq, to_stop=to_stop)
+
+
+def translate_frames(seq, table=1, frames=(0, 1, 2), to_stop=False):
+  """
+  Translate several reading frames of a DNA sequence.
+  :param seq: DNA sequence (str, Seq or bytes)
+  :param table: NCBI translation table ID
+  :param frames: offsets of the reading frames
+  :param to_stop: stop the translation at the first stop codon
+  :return: list of protein sequences (str), one per frame
+  """
+  try:
+    translation_table = get_translation_table(table)
+  except (KeyError, ValueError, TypeError):
+    seq = Seq(TranslationTable.as_bytes(seq).decode('latin-1'))
+    return [str(seq[frame:].translate(table=table, to_stop=to_stop)) for frame in frames]
+  return translation_table.translate_frames(seq, frames=frames, to_stop=to_stop)
+
+
+def find_orfs(seq, table=1, frames=(0, 1, 2), min_length=0, start_codons=('ATG',)):
+  """
+  ORFs of the reading frames of a DNA sequence: from a start codon to the next stop codon of the same frame, only
+  the first start codon after the previous stop codon is used (nested ORFs are not reported). ORFs without a stop
+  codon before the end of the sequence are not reported.
+  :param seq: DNA sequence (str, Seq or bytes)
+  :param table: NCBI translation table ID
+  :param frames: offsets of the reading frames
+  :param min_length: minimum number of amino acids of the ORFs (stop codon excluded)
+  :param start_codons: start codons
+  :return: list of (start, end, protein) in frame order, start and end are the positions of the first base of
+           the start codon and after the last base of the stop codon (0-based)
+  """
+  seq_bytes = TranslationTable.as_bytes(seq)
+  codons = TranslationTable.codon_index(seq_bytes)
+  start_codes = [TranslationTable.codon_index(codon.encode())[0] for codon in start_codons]
+  orfs = []
+  for frame, protein in zip(frames, translate_frames(seq_bytes, table, frames)):
+    frame_codons = codons[frame:frame + 3 * len(protein):3]
+    stops = np.flatnonzero(np.frombuffer(protein.encode('latin-1'), dtype=np.uint8) == ord('*'))
+    starts = np.flatnonzero(np.isin(frame_codons, start_codes))
+    if not len(stops) or not len(starts):
+      continue
+    # first start codon after the previous stop codon, for every stop codon
+    first_start = np.searchsorted(starts, np.concatenate(([0], stops[:-1] + 1)))
+    found = first_start < len(starts)
+    orf_starts = starts[np.minimum(first_start, len(starts) - 1)]
+    found &= (orf_starts < stops) & (stops - orf_starts >= min_length)
+    for start, stop in zip(orf_starts[found].tolist(), stops[found].tolist()):
+      orfs.append((frame + 3 * start, frame + 3 * stop + 3, protein[start:stop]))
+  return orfs
@@ -0,0 +1,415 @@
+"""
+This module implements a lightweight streaming VCF reader for plain and bgzipped files. Records only split the
+fixed columns the protein database generators use (CHROM, POS, ID, REF, ALT, FILTER) and decode an INFO key the
+first time it is requested. Values are decoded with the same rules as PyVCF (types and numbers from the header
+INFO definitions), so both readers can be used interchangeably.
+"""
+
+import gzip
+import io
+import os
+import re
+
+import pysam
+import vcf
+from vcf.parser import RESERVED_INFO
+
+INTEGER = 0
+STRING = 1
+FLOAT = 2
+FLAG = 3
+# INFO types of the header definitions, the other types (String, Character) are decoded as strings
+INFO_TYPES = {'Integer': INTEGER, 'Float': FLOAT, 'Flag': FLAG}
+
+MISSING_VALUES = ('.', '', 'NA')
+_BREAKEND_PATTERN = re.compile(r"[\[\]]")
+_ROW_PATTERN = re.compile(r"\t| +")
+_ANNOTATION_FORMAT_PATTERN = re.compile(r"Format\s*[:=]\s*([^\s\"']+)")
+
+
+def open_vcf(vcf_file, regions=None):
+  """
+  Open a plain or gzip/bgzip compressed VCF file in text mode, the compression is detected from the file content.
+  When regions are given only the header and the records overlapping the regions are read, see VcfRegionsReader.
+  :param vcf_file: VCF file
+  :param regions: list of (chrom, start, end) regions, 0-based and end exclusive
+  :return: text handle (iterable of lines)
+  """
+  if regions is not None:
+    return VcfRegionsReader(vcf_file, regions)
+  with open(vcf_file, 'rb') as handle:
+    magic = handle.read(2)
+  if magic == b'\x1f\x8b':
+    return gzip.open(vcf_file, 'rt')
+  return open(vcf_file, 'r')
+
+
+def parse_regions(regions):
+  """
+  Parse regions given as a BED file or as a comma separated list of chrom, chrom:start or chrom:start-end
+  (1-based, inclusive, as samtools/tabix regions)
+  :param regions: BED file or regions string
+  :return: list of (chrom, start, end) regions, 0-based and end exclusive (end is None for the whole chromosome)
+  """
+  parsed = []
+  if os.path.isfile(regions):
+    with open(regions, 'r') as bed:
+      for line in bed:
+        if not line.strip() or line.startswith(('#', 'track', 'browser')):
+          continue
+        fields = line.split('\t')
+        parsed.append((fields[0], int(fields[1]), int(fields[2])))
+    return parsed
+
+  for region in regions.split(','):
+    region = region.strip()
+    if not region:
+      continue
+    chrom, _, interval = region.rpartition(':')
+    if not chrom or not interval.replace('-', '').replace(',', '').isdigit():
+      parsed.append((region, 0, None))
+      continue
+    start, _, end = interval.partition('-')
+    parsed.append((chrom, int(start) - 1, int(end) if end else None))
+  return parsed
+
+
+def merge_regions(regions):
+  """
+  Merge overlapping regions of the same chromosome
+  :param regions: list of (chrom, start, end) regions
+  :return: dict chrom -> sorted list of disjoint [start, end) intervals
+  """
+  by_chrom = {}
+  for chrom, start, end in regions:
+    by_chrom.setdefault(chrom, []).append((start, float('inf') if end is None else end))
+  merged = {}
+  for chrom, intervals in by_chrom.items():
+    intervals.sort()
+    chrom_merged = [list(intervals[0])]
+    for start, end in intervals[1:]:
+      if start <= chrom_merged[-1][1]:
+        chrom_merged[-1][1] = max(chrom_merged[-1][1], end)
+      else:
+        chrom_merged.append([start, end])
+    merged[chrom] = chrom_merged
+  return merged
+
+
+class VcfRegionsReader:
+  """
+  Lines of a VCF file restricted to regions: the header lines followed by the records overlapping any region
+  (a record covers [POS - 1, POS - 1 + len(REF))), each record once and in file order. bgzipped files with a
+  tabix (.tbi) or CSI (.csi) index are read with pysam, only the blocks of the regions are decompressed;
+  other files are read sequentially and filtered.
+  """
+
+  def __init__(self, vcf_file, regions):
+    """
+    :param vcf_file: VCF file
+    :param regions: list of (chrom, start, end) regions, 0-based and end exclusive
+    """
+    self._vcf_file = vcf_file
+    self._regions = merge_regions(regions)
+    self._tabix = None
+    self._lines = None
+    index = self.find_index(vcf_file)
+    if index is not None:
+      self._tabix = pysam.TabixFile(vcf_file, index=index)
+
+  @staticmethod
+  def find_index(vcf_file):
+    for extension in ('.tbi', '.csi'):
+      if os.path.isfile(vcf_file + extension):
+        return vcf_file + extension
+    return None
+
+  def _contig(self, chrom):
+    """
+    Name of the chromosome in the index, allowing for the chr prefix to be present in only one of the names
+    """
+    contigs = self._tabix.contigs
+    for name in (chrom, chrom[3:] if chrom.startswith('chr') else 'chr' + chrom):
+      if name in contigs:
+        return name
+    return None
+
+  def _indexed_lines(self):
+    for line in self._tabix.header:
+      yield line + '\n'
+    # regions in the order of the chromosomes in the file
+    contig_order = {contig: i for i, contig in enumerate(self._tabix.contigs)}
+    regions = []
+    for chrom, intervals in self._regions.items():
+      contig = self._contig(chrom)
+      if contig is not None:
+        regions.append((contig_order[contig], contig, intervals))
+    for _, contig, intervals in sorted(regions):
+      previous_end = None
+      for start, end in intervals:
+        for line in self._tabix.fetch(contig, start, None if end == float('inf') else end):
+          # records overlapping the previous interval as well were returned already
+          if previous_end is not None and int(line.split('\t', 2)[1]) - 1 < previous_end:
+            continue
+          yield line + '\n'
+        previous_end = end
+
+  def _filtered_lines(self):
+    with open_vcf(self._vcf_file) as vcf_handle:
+      for line in vcf_handle:
+        if line.startswith('#'):
+          yield line
+          continue
+        fields = line.split('\t', 4)
+        if len(fields) < 4:
+          continue
+        intervals = self._regions.get(fields[0])
+        if intervals is None:
+          intervals = self._regions.get(fields[0][3:] if fields[0].startswith('chr') else 'chr' + fields[0])
+        if intervals is None:
+          continue
+        start = int(fields[1]) - 1
+        end = start + len(fields[3])
+        if any(interval_start < max(end, start + 1) and start < interval_end
+               for interval_start, interval_end in intervals):
+          yield line
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    # single pass over the lines, as a file handle
+    if self._lines is None:
+      self._lines = self._indexed_lines() if self._tabix is not None else self._filtered_lines()
+    return next(self._lines)
+
+  def close(self):
+    if self._lines is not None:
+      self._lines.close()
+    if self._tabix is not None:
+      self._tabix.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def parse_annotation_format(description):
+  """
+  Names of the fields of a VEP style annotation (CSQ) from the description of its INFO header line,
+  e.g. "Consequence annotations from Ensembl VEP. Format: Allele|Consequence|IMPACT|..."
+  :param description: description of the INFO field
+  :return: list of field names, None if the description has no Format
+  """
+  if not description:
+    return None
+  match = _ANNOTATION_FORMAT_PATTERN.search(description)
+  if match is None:
+    return None
+  return match.group(1).split('|')
+
+
+class SymbolicAllele:
+  """
+  Structural variant (<DEL>) and breakend alternative alleles. They have no sequence length, like PyVCF's
+  _SV and _Breakend objects.
+  """
+
+  __slots__ = ('allele',)
+
+  def __init__(self, allele):
+    self.allele = allele
+
+  def __str__(self):
+    return self.allele
+
+  def __repr__(self):
+    return self.allele
+
+  def __eq__(self, other):
+    return isinstance(other, SymbolicAllele) and self.allele == other.allele
+
+  def __hash__(self):
+    return hash(self.allele)
+
+
+def parse_alt(alt):
+  """
+  Parse one alternative allele: None for missing values, SymbolicAllele for structural variants and
+  breakends, the sequence (str) otherwise.
+  """
+  if alt in MISSING_VALUES:
+    return None
+  if (_BREAKEND_PATTERN.search(alt) is not None or (len(alt) > 1 and (alt[0] == '.' or alt[-1] == '.')) or
+      (alt[0] == '<' and alt[-1] == '>')):
+    return SymbolicAllele(alt)
+  return alt
+
+
+class VcfInfo:
+  """
+  Read-only mapping over the INFO column of a record. A key is looked up and decoded the first time it is
+  requested, the whole column is only split to list the keys.
+  """
+
+  __slots__ = ('_info_str', '_infos', '_raw', '_values')
+
+  def __init__(self, info_str, infos):
+    self._info_str = info_str
+    self._infos = infos
+    self._raw = None
+    self._values = {}
+
+  def _entries(self):
+    if self._raw is None:
+      self._raw = {}
+      if self._info_str != '.':
+        for entry in self._info_str.split(';'):
+          entry = entry.split('=', 1)
+          self._raw[entry[0]] = entry[1:]
+    return self._raw
+
+  def _decode(self, key, entry):
+    info = self._infos.get(key)
+    if info is not None:
+      entry_type = INFO_TYPES.get(info.type, STRING)
+    elif key in RESERVED_INFO:
+      entry_type = INFO_TYPES.get(RESERVED_INFO[key], STRING)
+    else:
+      entry_type = STRING if entry else FLAG
+
+    if entry_type == INTEGER:
+      values = entry[0].split(',')
+      try:
+        value = [int(x) if x not in MISSING_VALUES else None for x in values]
+      except ValueError:
+        value = [float(x) if x not in MISSING_VALUES else None for x in values]
+    elif entry_type == FLOAT:
+      value = [float(x) if x not in MISSING_VALUES else None for x in entry[0].split(',')]
+    elif entry_type == STRING and entry:
+      value = [x if x not in MISSING_VALUES else None for x in entry[0].split(',')]
+    else:
+      entry_type = FLAG
+      value = True
+
+    if info is not None and info.num == 1 and entry_type != FLAG:
+      value = value[0]
+    return value
+
+  def _find_entry(self, key):
+    """
+    Find the last key=value (or flag) entry of the key without splitting the whole INFO column
+    """
+    info_str = self._info_str
+    end = len(info_str)
+    while True:
+      start = info_str.rfind(key, 0, end)
+      if start < 0:
+        raise KeyError(key)
+      value_start = start + len(key)
+      if (start == 0 or info_str[start - 1] == ';') and (
+          value_start == len(info_str) or info_str[value_start] in '=;'):
+        break
+      end = start + len(key) - 1
+    if value_start == len(info_str) or info_str[value_start] == ';':
+      return []
+    value_end = info_str.find(';', value_start)
+    if value_end < 0:
+      value_end = len(info_str)
+    return [info_str[value_start + 1:value_end]]
+
+  def __getitem__(self, key):
+    try:
+      return self._values[key]
+    except KeyError:
+      if self._info_str == '.' or not key:
+        raise
+      value = self._decode(key, self._find_entry(key))
+      self._values[key] = value
+      return value
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def __contains__(self, key):
+    return key in self._entries()
+
+  def __iter__(self):
+    return iter(self._entries())
+
+  def __len__(self):
+    return len(self._entries())
+
+  def keys(self):
+    return self._entries().keys()
+
+
+class VcfRecord:
+  """
+  VCF record with the attributes of PyVCF's _Record used by the protein database generators.
+  """
+
+  __slots__ = ('CHROM', 'POS', 'ID', 'REF', 'ALT', 'FILTER', 'INFO')
+
+  def __init__(self, row, infos):
+    self.CHROM = row[0]
+    self.POS = int(row[1])
+    self.ID = row[2] if row[2] != '.' else None
+    self.REF = row[3]
+    self.ALT = [parse_alt(alt) for alt in row[4].split(',')]
+    if row[6] == '.':
+      self.FILTER = None
+    elif row[6] == 'PASS':
+      self.FILTER = []
+    else:
+      self.FILTER = row[6].split(';')
+    self.INFO = VcfInfo(row[7], infos)
+
+  def __str__(self):
+    return "Record(CHROM={}, POS={}, REF={}, ALT=[{}])".format(self.CHROM, self.POS, self.REF,
+                                                               ', '.join(str(alt) for alt in self.ALT))
+
+
+class VcfReader:
+  """
+  Streaming VCF reader. Iterating over the reader returns VcfRecord objects, the header INFO definitions
+  are parsed with PyVCF.
+  """
+
+  def __init__(self, handle):
+    """
+    :param handle: text handle of the VCF file, see open_vcf
+    """
+    self._handle = handle
+    header = []
+    self._first_line = None
+    for line in handle:
+      if line.startswith('#'):
+        header.append(line)
+        if line.startswith('#CHROM'):
+          break
+      elif line.strip():
+        self._first_line = line
+        break
+    self.infos = vcf.Reader(io.StringIO(''.join(header))).infos if header else {}
+
+  def __iter__(self):
+    if self._first_line is not None:
+      yield self._parse_line(self._first_line)
+      self._first_line = None
+    for line in self._handle:
+      if line.strip():
+        yield self._parse_line(line)
+
+  def _parse_line(self, line):
+    line = line.strip()
+    if ' ' in line:
+      row = _ROW_PATTERN.split(line)
+    else:
+      row = line.split('\t', 8)
+    return VcfRecord(row, self.infos)
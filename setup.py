@@ -56,8 +56,8 @@ setup(name='pypgatk',
         'wrapt==1.11.1',
 	'setuptools_scm',
         'ratelimit',
-        'pybedtools',
-        'pyteomics'
+        'pyteomics',
+        'pysam'
       ],
       scripts=['pypgatk/pypgatk_cli.py'],
       packages=find_packages(),